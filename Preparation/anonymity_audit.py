@@ -0,0 +1,112 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from time import perf_counter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+from storage import load_frame
+
+#Quasi-identifiers left in the output of anonymise.py, the columns an attacker could link to outside data
+QUASI_IDENTIFIERS = ["age", "gender_id", "job_category", "city_pop_cluster_id"]
+
+def factorize_column(series) -> tuple:
+    """Codes 0..n-1 of the distinct values of a column (missing values are a value of their own) and n"""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return codes.astype(np.int64), len(uniques)
+
+def combine_codes(codes, n_codes, column_codes, n_column) -> tuple:
+    """
+    Codes of the equivalence classes of (codes, column_codes) pairs. Each pair is packed into one int64 key, and when
+    there are more possible keys than rows the keys are hashed (pd.factorize) down to dense codes again. Both codes
+    are then below the number of rows, so the packed keys never overflow and, unlike hashing the row values to 64
+    bits, two classes never share a key
+    """
+    keys = codes * n_column + column_codes
+    if n_codes * n_column <= len(keys):
+        return keys, n_codes * n_column
+    keys, uniques = pd.factorize(keys)
+    return keys.astype(np.int64), len(uniques)
+
+def class_sizes(codes, n_codes) -> np.ndarray:
+    sizes = np.bincount(codes, minlength=n_codes)
+    return sizes[sizes > 0]
+
+def equivalence_class_sizes(df, quasi_identifiers) -> np.ndarray:
+    """Number of rows sharing each distinct combination of values of `quasi_identifiers`"""
+    codes, n_codes = np.zeros(len(df), dtype=np.int64), 1
+    for column in quasi_identifiers:
+        codes, n_codes = combine_codes(codes, n_codes, *factorize_column(df[column]))
+    return class_sizes(codes, n_codes)
+
+def min_class_size(df, quasi_identifiers) -> int:
+    """The k for which `df` is k-anonymous with respect to `quasi_identifiers` (0 for no rows)"""
+    sizes = equivalence_class_sizes(df, quasi_identifiers)
+    return int(sizes.min()) if len(sizes) else 0
+
+def audit(df, quasi_identifiers=QUASI_IDENTIFIERS, k=5, max_combination=None) -> pd.DataFrame:
+    """
+    Check k-anonymity against every combination of the quasi-identifiers, i.e. every subset of them an attacker might
+    know.
+
+    Each column is factorised once. Combinations are visited depth first (a, a+b, a+b+c, ..., a+c, ...), each
+    built from the codes of its prefix plus one column, so only one combination per depth is held in memory.
+
+    PARAMETERS
+    df (pd.DataFrame) - anonymised data
+    quasi_identifiers (list of str) - columns to combine
+    k (int) - required smallest equivalence class
+    max_combination (int) - largest number of quasi-identifiers combined, all of them by default
+
+    RETURNS
+    pd.DataFrame - one row per combination, by number of quasi-identifiers: classes, min_class_size, rows_below_k
+                   (rows in classes smaller than k) and k_anonymous
+    """
+    max_combination = max_combination or len(quasi_identifiers)
+    columns = [factorize_column(df[column]) for column in quasi_identifiers]
+
+    rows = []
+    #(combination, codes and number of codes of its prefix), the codes of a combination are made when it is visited.
+    #combine_codes never writes to the prefix codes, so the roots share one empty prefix
+    empty_prefix = np.zeros(len(df), dtype=np.int64)
+    stack = [((i,), empty_prefix, 1) for i in reversed(range(len(columns)))]
+    while stack:
+        combination, prefix_codes, n_prefix = stack.pop()
+        codes, n_codes = combine_codes(prefix_codes, n_prefix, *columns[combination[-1]])
+        sizes = class_sizes(codes, n_codes)
+        rows.append({
+            "combination": combination,
+            "quasi_identifiers": "+".join(quasi_identifiers[i] for i in combination),
+            "n_quasi_identifiers": len(combination),
+            "classes": len(sizes),
+            "min_class_size": int(sizes.min()) if len(sizes) else 0,
+            "rows_below_k": int(sizes[sizes < k].sum()),
+        })
+        if len(combination) < max_combination:
+            stack.extend((combination + (i,), codes, n_codes) for i in reversed(range(combination[-1] + 1, len(columns))))
+
+    report = pd.DataFrame(rows).sort_values(["n_quasi_identifiers", "combination"]).drop(columns="combination")
+    report["k_anonymous"] = report["min_class_size"] >= k
+    return report.reset_index(drop=True)
+
+if __name__ == "__main__":
+    #e.g. "python anonymity_audit.py data/cleaned_synthetic_data --qi age gender_id job_category city_pop_cluster_id --k 5"
+    parser = argparse.ArgumentParser(description="Smallest equivalence class of every combination of quasi-identifiers")
+    parser.add_argument("data", nargs="?", default="data/cleaned_synthetic_data")
+    parser.add_argument("--qi", nargs="+", default=QUASI_IDENTIFIERS)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-combination", type=int, default=None)
+    args = parser.parse_args()
+
+    print("Data ", end="", flush=True)
+    data = load_frame(args.data, columns=args.qi)
+    print("LOADED")
+
+    start = perf_counter()
+    report = audit(data, args.qi, args.k, args.max_combination)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(report.to_string(index=False))
+    print(f"{len(data)} rows, {len(report)} combinations in {perf_counter() - start:.1f}s: "
+          f"{'k' if report['k_anonymous'].all() else 'NOT k'}-anonymous for k={args.k}")
@@ -0,0 +1,98 @@
+#Benchmark the matrix MWMOTE weighting in mwmote_sampler.py against the loops in MWMOTE.py
+#e.g. "python mwmote_benchmark.py ../Scripts/data/meta_features_train 20000"
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from time import perf_counter
+from sklearn.neighbors import NearestNeighbors
+
+import mwmote_sampler
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Scripts"))
+from storage import load_frame
+
+file_path = sys.argv[1] if len(sys.argv) > 1 else "data/meta_features_train"
+n_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+k1, k2 = 5, 3
+CMAX, Cf_th = 2, 5
+
+#########################---Reference Loops (MWMOTE.py)--################
+
+def closeness_factor(Yi,Xj):
+    if Smin.index.get_loc(Xj.name) not in Nmin[Sbmaj.index.get_loc(Yi.name)]:
+        closeness_factor = 0
+    else:
+        d = np.linalg.norm(Yi.values - Xj.values)
+        if (1/d) <= Cf_th: f = (1/d)
+        else: f = Cf_th
+        closeness_factor = (f/Cf_th)*CMAX
+
+    return closeness_factor
+
+def loop_selection_weights(Simin, Sbmaj):
+    selection_weights = []
+    for j, Xj in Simin.iterrows():
+        c_f = []
+        for i, Yi in Sbmaj.iterrows():
+            c_f.append(closeness_factor(Yi,Xj))
+        d_f = np.array(c_f)/np.array(c_f).sum()
+        selection_weights.append((np.array(c_f) * d_f).sum())
+    return np.array(selection_weights)
+
+def loop_Davg(SminF):
+    Davg = 0
+    for DXindex, Dx in SminF.iterrows():
+        temp = []
+        for DYindex, Dy in SminF.iterrows():
+            if (DYindex != DXindex):
+                temp.append(np.linalg.norm(Dy-Dx))
+        Davg += min(temp)
+    return Davg / len(SminF)
+
+#########################---Benchmark--################
+
+print("LOADING DATA")
+meta_data = load_frame(file_path)
+#Keep every fraud row so the sample still has a usable minority set
+fraud = meta_data[meta_data["is_fraud"] == 1]
+non_fraud = meta_data[meta_data["is_fraud"] == 0]
+sample = pd.concat([fraud.sample(min(len(fraud), n_rows // 20), random_state=0),
+                    non_fraud.sample(min(len(non_fraud), n_rows - min(len(fraud), n_rows // 20)), random_state=0)]).reset_index(drop=True)
+Features = sample.drop(columns=["is_fraud"]).astype(np.float64)
+
+X = Features.to_numpy()
+is_minority = sample["is_fraud"].to_numpy() == 1
+k3 = int(is_minority.sum()/2)
+print(f"{len(X)} rows, {is_minority.sum()} minority")
+
+#Shared sets, so both versions weight the same samples
+SminF = mwmote_sampler.filtered_minority(X, is_minority, k1)
+majority = np.flatnonzero(~is_minority)
+minority = np.flatnonzero(is_minority)
+Sbmaj_pos = majority[mwmote_sampler.borderline_majority(X[majority], X[SminF], k2)]
+
+Smin = Features.iloc[minority]
+Sbmaj = Features.iloc[Sbmaj_pos]
+Nmin = NearestNeighbors(n_neighbors=k3+1).fit(Smin.values).kneighbors(X=Sbmaj.values, return_distance=False)
+Simin = Smin.iloc[np.unique(Nmin.reshape(-1))]
+
+start = perf_counter()
+closeness = mwmote_sampler.closeness_matrix(X[minority], X[Sbmaj_pos], k3, CMAX, Cf_th)
+Simin_pos, matrix_weights = mwmote_sampler.information_weights(closeness)
+matrix_Davg = mwmote_sampler.average_min_distance(X[SminF])
+matrix_time = perf_counter() - start
+
+start = perf_counter()
+loop_weights = loop_selection_weights(Simin, Sbmaj)
+loop_time_weights = perf_counter() - start
+start = perf_counter()
+reference_Davg = loop_Davg(Features.iloc[SminF])
+loop_time = perf_counter() - start + loop_time_weights
+
+print(f"|Sbmaj|={len(Sbmaj)}  |Simin|={len(Simin)}  |SminF|={len(SminF)}")
+print(f"loops:  {loop_time:.2f}s")
+print(f"matrix: {matrix_time:.3f}s  ({loop_time / matrix_time:.0f}x)")
+print(f"max weight difference: {np.abs(matrix_weights - loop_weights).max():.2e}")
+print(f"Davg difference: {abs(matrix_Davg - reference_Davg):.2e}")
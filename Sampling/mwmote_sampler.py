@@ -0,0 +1,224 @@
+#Matrix implementation of the MWMOTE set construction, weighting and clustering stages of MWMOTE.py
+#As presented in "MWMOTE--Majority Weighted Minority Oversampling Technique for Imbalanced Data Set Learning" (https://ieeexplore.ieee.org/document/6361394)
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+from scipy.spatial import cKDTree
+from sklearn.neighbors import NearestNeighbors
+from sklearn.cluster import AgglomerativeClustering
+
+class TooFewMinoritySamples(ValueError):
+    """The data has too few (or too scattered) minority samples for MWMOTE to oversample from"""
+
+def filtered_minority(X, is_minority, k1=5, n_jobs=None, cache=False) -> np.ndarray:
+    """
+    Positions (in X) of the minority samples with at least one other minority sample among their k1 nearest neighbours
+
+    PARAMETERS
+    X (np.ndarray) - all samples
+    is_minority (np.ndarray) - boolean mask of the minority samples in X
+    k1 (int) - neighbourhood size
+    n_jobs (int) - parallel jobs for the neighbour search
+    cache (bool) - read the neighbours from the shared graph of Scripts/knn_cache.py instead of searching
+    """
+    minority = np.flatnonzero(is_minority)
+    if cache:
+        from knn_cache import neighbour_graph
+        NN = neighbour_graph(X, k1+1, n_jobs=n_jobs).neighbours_of_rows(k1, minority)[1]
+    else:
+        construction = NearestNeighbors(n_neighbors=k1+1, n_jobs=n_jobs).fit(X)
+        #The first neighbour of each sample is itself
+        NN = construction.kneighbors(X=X[minority], return_distance=False)[:, 1:]
+
+    has_minority = is_minority[NN].any(axis=1)
+    return minority[has_minority]
+
+def borderline_majority(X_maj, X_minf, k2=3, n_jobs=None) -> np.ndarray:
+    """Positions (in X_maj) of the union of the k2+1 nearest majority samples of each filtered minority sample"""
+    majority_set = NearestNeighbors(n_neighbors=k2+1, n_jobs=n_jobs).fit(X_maj)
+    Nmaj = majority_set.kneighbors(X=X_minf, return_distance=False)
+    return np.unique(Nmaj)
+
+def closeness_matrix(X_min, X_bmaj, k3, CMAX=2, Cf_th=5, n_jobs=None) -> sparse.csr_matrix:
+    """
+    Closeness factor of every borderline majority sample (rows) to every minority sample (columns).
+
+    The factor is zero unless the minority sample is one of the k3+1 nearest minority samples Nmin of the majority sample,
+    so only those entries are stored. Inside Nmin it is min(1/d, Cf_th) / Cf_th * CMAX, which is always positive.
+    """
+    minority_set = NearestNeighbors(n_neighbors=min(k3+1, len(X_min)), n_jobs=n_jobs).fit(X_min)
+    distances, Nmin = minority_set.kneighbors(X=X_bmaj)
+
+    with np.errstate(divide="ignore"):
+        f = np.minimum(1 / distances, Cf_th)
+    closeness = (f / Cf_th) * CMAX
+
+    rows = np.repeat(np.arange(len(X_bmaj)), Nmin.shape[1])
+    return sparse.csr_matrix((closeness.ravel(), (rows, Nmin.ravel())), shape=(len(X_bmaj), len(X_min)))
+
+def information_weights(closeness) -> tuple:
+    """
+    Selection weight of each informative minority sample, the column sums of closeness * density where the density
+    factor is the closeness normalised over the borderline majority samples (each column sums to one).
+
+    RETURNS
+    np.ndarray - positions of the informative minority samples Simin (columns with a non-zero closeness)
+    np.ndarray - their selection weights
+    """
+    closeness = sparse.csc_matrix(closeness)
+    totals = np.asarray(closeness.sum(axis=0)).ravel()
+    Simin = np.flatnonzero(totals > 0)
+
+    density = closeness @ sparse.diags(np.divide(1, totals, out=np.zeros_like(totals), where=totals > 0))
+    weights = np.asarray(closeness.multiply(density).sum(axis=0)).ravel()
+    return Simin, weights[Simin]
+
+def average_min_distance(X) -> float:
+    """Mean distance from each sample to its nearest other sample (Davg)"""
+    distances, _ = cKDTree(X).query(X, k=2)
+    return distances[:, 1].mean()
+
+def minority_clusters(X_min, X_minf, Cp=3) -> np.ndarray:
+    """
+    Average-linkage clusters of the minority samples, merged up to a distance of Cp times Davg of the filtered set.
+    Davg needs two samples, so it is taken over all minority samples when fewer than two passed the filter.
+    """
+    if len(X_min) < 2:
+        raise TooFewMinoritySamples(f"MWMOTE needs at least 2 minority samples to cluster, got {len(X_min)}")
+    Th = average_min_distance(X_minf if len(X_minf) >= 2 else X_min) * Cp
+    model = AgglomerativeClustering(n_clusters=None, metric="euclidean", linkage="average", distance_threshold=Th)
+    return model.fit_predict(X_min)
+
+def selection_probabilities(X, is_minority, k1=5, k2=3, k3=None, CMAX=2, Cf_th=5, n_jobs=None, cache=False) -> tuple:
+    """
+    Run the MWMOTE set construction and weighting.
+
+    PARAMETERS
+    X (np.ndarray) - all samples
+    is_minority (np.ndarray) - boolean mask of the minority samples in X
+    k1, k2, k3 (int) - neighbourhood sizes, k3 defaults to half the minority samples
+    CMAX, Cf_th (float) - closeness factor cut-offs
+    n_jobs (int) - parallel jobs for the neighbour searches
+    cache (bool) - take the k1 neighbourhoods from the shared neighbour graph, see `filtered_minority`
+
+    RETURNS
+    np.ndarray - positions (in X) of the filtered minority samples SminF
+    np.ndarray - positions (in X) of the informative minority samples Simin
+    np.ndarray - selection probability of each of Simin
+    """
+    minority = np.flatnonzero(is_minority)
+    majority = np.flatnonzero(~is_minority)
+    if k3 is None: k3 = int(len(minority)/2)
+
+    SminF = filtered_minority(X, is_minority, k1, n_jobs, cache)
+    if len(SminF) == 0:
+        raise TooFewMinoritySamples(f"No minority sample has another minority sample among its {k1} nearest neighbours, so MWMOTE has none to oversample from")
+    Sbmaj = majority[borderline_majority(X[majority], X[SminF], k2, n_jobs)]
+    closeness = closeness_matrix(X[minority], X[Sbmaj], k3, CMAX, Cf_th, n_jobs)
+    Simin, weights = information_weights(closeness)
+
+    return SminF, minority[Simin], weights / weights.sum()
+
+class MWMOTE:
+    """
+    MWMOTE oversampler with the `fit_resample(X, y)` contract of the imblearn samplers.
+
+    Synthetic samples are x + alpha * (y - x) for an informative minority sample x drawn by selection probability and
+    a random y from the same minority cluster. Cluster members are precomputed as offset arrays into one sorted array,
+    so every draw is an index computation, and samples are generated in vectorized batches sized to `memory_budget`.
+
+    PARAMETERS
+    k1, k2, k3 (int) - neighbourhood sizes, k3 defaults to half the minority samples
+    Cp (float) - clustering threshold as a multiple of Davg
+    CMAX, Cf_th (float) - closeness factor cut-offs
+    n_jobs (int) - parallel jobs for the neighbour searches and the batch generation, -1 for one per CPU
+    random_state (int) - seed for reproducible output, the same for any n_jobs
+    memory_budget (int) - approximate bytes of working memory per batch
+    cache (bool) - take the k1 neighbourhoods from the shared neighbour graph, see `filtered_minority`
+    """
+    def __init__(self, k1=5, k2=3, k3=None, Cp=3, CMAX=2, Cf_th=5, n_jobs=None, random_state=None, memory_budget=2**28, cache=False):
+        self.k1 = k1
+        self.k2 = k2
+        self.k3 = k3
+        self.Cp = Cp
+        self.CMAX = CMAX
+        self.Cf_th = Cf_th
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.memory_budget = memory_budget
+        self.cache = cache
+
+    def fit(self, X, y, minority_label=1):
+        """Compute the selection probabilities and the minority clusters"""
+        X = np.asarray(X, dtype=np.float64)
+        is_minority = np.asarray(y) == minority_label
+
+        SminF, Simin, probabilities = selection_probabilities(X, is_minority, self.k1, self.k2, self.k3, self.CMAX, self.Cf_th, self.n_jobs, self.cache)
+        minority = np.flatnonzero(is_minority)
+        clusters = minority_clusters(X[minority], X[SminF], self.Cp)
+
+        #Members of cluster c are members_[offsets_[c]:offsets_[c] + sizes_[c]] (positions in X)
+        order = np.argsort(clusters, kind="stable")
+        self.members_ = minority[order]
+        self.sizes_ = np.bincount(clusters)
+        self.offsets_ = np.cumsum(self.sizes_) - self.sizes_
+
+        self.Simin_ = Simin
+        self.probabilities_ = probabilities
+        self.Simin_clusters_ = clusters[np.searchsorted(minority, Simin)]
+        return self
+
+    def sample(self, X, n_samples, seed) -> np.ndarray:
+        """n_samples synthetic samples from the fitted sets, drawn with a generator seeded by `seed`"""
+        rng = np.random.default_rng(seed)
+        draws = rng.choice(len(self.Simin_), size=n_samples, p=self.probabilities_)
+        clusters = self.Simin_clusters_[draws]
+        partners = self.members_[self.offsets_[clusters] + (rng.random(n_samples) * self.sizes_[clusters]).astype(np.int64)]
+
+        x_sample = X[self.Simin_[draws]]
+        alpha = rng.random((n_samples, 1))
+        return x_sample + alpha * (X[partners] - x_sample)
+
+    def fit_resample(self, X, y, minority_label=1):
+        """
+        Oversample the minority class until it matches the majority class.
+
+        RETURNS
+        X_resampled, y_resampled - the input followed by the synthetic samples, as DataFrame/Series for pandas input
+        """
+        X_values = np.asarray(X, dtype=np.float64)
+        y_values = np.asarray(y)
+        self.fit(X_values, y_values, minority_label)
+
+        n_minority = (y_values == minority_label).sum()
+        N = max(len(y_values) - 2 * n_minority, 0)
+
+        #A batch holds the sample, its partner and the result
+        batch_size = max(1, self.memory_budget // (3 * 8 * X_values.shape[1]))
+        batches = [(start, min(start + batch_size, N)) for start in range(0, N, batch_size)]
+        seeds = np.random.SeedSequence(self.random_state).spawn(len(batches))
+
+        X_resampled = np.empty((len(X_values) + N, X_values.shape[1]), dtype=np.float64)
+        X_resampled[:len(X_values)] = X_values
+
+        def generate(batch, seed):
+            start, stop = batch
+            X_resampled[len(X_values) + start:len(X_values) + stop] = self.sample(X_values, stop - start, seed)
+
+        #sklearn's convention, as the neighbour searches get the same n_jobs: -1 is every CPU, -2 all but one, ...
+        n_jobs = self.n_jobs or 1
+        if n_jobs < 0:
+            n_jobs = max(os.cpu_count() + 1 + n_jobs, 1)
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(generate, batches, seeds))
+
+        y_resampled = np.concatenate([y_values, np.full(N, minority_label, dtype=y_values.dtype)])
+
+        if isinstance(X, pd.DataFrame):
+            X_resampled = pd.DataFrame(X_resampled, columns=X.columns)
+        if isinstance(y, pd.Series):
+            y_resampled = pd.Series(y_resampled, name=y.name)
+        return X_resampled, y_resampled
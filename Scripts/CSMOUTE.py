@@ -2,7 +2,10 @@ import pandas as pd
 import numpy as np
 import faiss
 
-from random import randrange, uniform
+from instrument import stage
+from time import perf_counter
+from knn_cache import neighbour_graph
+from storage import load_frame, save_frame
 
 class FaissKNeighbors:
     def __init__(self, n_neighbors=5):
@@ -18,80 +21,235 @@ class FaissKNeighbors:
     def kneighbors(self, X):
         return self.index.search(X.astype(np.float32), k=self.n_neighbors)
 
-def SMUTE(X_maj, y_maj, n_smute):
-    X_maj_prime = X_maj.copy().reset_index(drop=True)
-    y_maj_prime = y_maj.copy().reset_index(drop=True)
+class TombstoneIndex:
+    """
+    Flat L2 faiss index over the rows of a preallocated buffer that supports deletion.
 
-    x3_y = y_maj_prime.sample().copy()
+    Deleting a row only clears its `alive` flag and searches skip dead rows, so nothing is refitted when points are
+    removed. New rows are appended to the index as they are written to the buffer, and the index is rebuilt from the
+    live rows once half of it is dead.
+    """
+    def __init__(self, buffer, n_rows):
+        self.buffer = buffer
+        self.alive = np.zeros(len(buffer), dtype=bool)
+        self.alive[:n_rows] = True
+        self.rebuild()
 
-    knn = FaissKNeighbors(n_neighbors=6)
+    def rebuild(self):
+        # index row i holds buffer row self.ids[i]
+        self.ids = np.flatnonzero(self.alive)
+        self.index = faiss.IndexFlatL2(self.buffer.shape[1])
+        self.index.add(np.ascontiguousarray(self.buffer[self.ids], dtype=np.float32))
+        self.n_dead = 0
 
+    def add(self, rows):
+        self.alive[rows] = True
+        self.index.add(np.ascontiguousarray(self.buffer[rows], dtype=np.float32))
+        self.ids = np.concatenate([self.ids, rows])
+
+    def remove(self, rows):
+        self.alive[rows] = False
+        self.n_dead += len(rows)
+        if self.n_dead * 2 > self.index.ntotal:
+            self.rebuild()
+
+    def kneighbors(self, rows, k):
+        """
+        Buffer rows of the k nearest live neighbours of each of `rows`, excluding the row itself.
+        Rows with fewer than k live neighbours are padded with -1
+        """
+        queries = np.ascontiguousarray(self.buffer[rows], dtype=np.float32)
+        neighbours = np.full((len(rows), k), -1, dtype=np.int64)
+        todo = np.arange(len(rows))
+        n_search = min(2 * (k + 1), self.index.ntotal)
+        while len(todo) > 0:
+            _, found = self.index.search(queries[todo], n_search)
+            found = np.where(found >= 0, self.ids[found], -1)
+            valid = (found >= 0) & self.alive[np.maximum(found, 0)] & (found != rows[todo, None])
+            rank = np.cumsum(valid, axis=1)
+            take = valid & (rank <= k)
+            hit_rows, hit_cols = np.nonzero(take)
+            neighbours[todo[hit_rows], rank[hit_rows, hit_cols] - 1] = found[hit_rows, hit_cols]
+
+            # search again, wider, for rows whose nearest results were mostly dead
+            short = rank[:, -1] < k
+            if n_search == self.index.ntotal:
+                break
+            todo = todo[short]
+            n_search = min(2 * n_search, self.index.ntotal)
+        return neighbours
+
+def disjoint_pairs(x1, x2) -> np.ndarray:
+    """Mask keeping each pair only if neither of its points is already used by an earlier pair in the batch"""
+    used = set()
+    keep = np.zeros(len(x1), dtype=bool)
+    for i, (a, b) in enumerate(zip(x1.tolist(), x2.tolist())):
+        if a not in used and b not in used:
+            used.update((a, b))
+            keep[i] = True
+    return keep
+
+def SMUTE(X_maj, y_maj, n_smute, batch_size=4096, k=5, seed=None, stats=None):
+    """
+    Undersample the majority class by n_smute points. Each step replaces a random point x1 and one of its k nearest
+    neighbours x2 with a point x3 at a random position on the line between them.
+
+    Points live in a preallocated buffer with a deletable index, so nothing is refitted or copied per step, and each
+    round takes up to `batch_size` steps at once from pairs that share no point.
+
+    PARAMETERS
+    X_maj (pd.DataFrame) - majority class features
+    y_maj (pd.Series) - majority class labels
+    n_smute (int) - number of points to remove
+    batch_size (int) - maximum number of pairs merged per round
+    k (int) - number of nearest neighbours x2 is drawn from
+    seed (int) - seed for reproducible output
+    stats (dict) - optional, filled with the number of samples, seconds and samples per second
+
+    RETURNS
+    pd.DataFrame, pd.Series - the undersampled majority class
+    """
+    rng = np.random.default_rng(seed)
+    n = len(X_maj)
+    # a lone majority point has no neighbour to merge with
+    if n_smute > 0 and n < 2:
+        raise ValueError(f"SMUTE needs at least 2 majority samples to merge, got {n}")
+    # nothing to remove (n_smute <= 0) leaves the majority class as it is
+    n_smute = max(min(n_smute, n - 1), 0)
+
+    # every merge frees two rows and writes one new row after the originals
+    buffer = np.empty((n + n_smute, X_maj.shape[1]), dtype=np.float64)
+    buffer[:n] = X_maj.to_numpy(dtype=np.float64)
+    labels = np.empty(n + n_smute, dtype=y_maj.dtype)
+    labels[:n] = y_maj.to_numpy()
+    if n_smute > 0:
+        labels[n:] = y_maj.iloc[rng.integers(n)]
+
+    index = TombstoneIndex(buffer, n)
+    n_rows = n
+    done = 0
     last_print = 0
+    start = perf_counter()
 
     print(" KNN FIT - SAMPLING")
-    while((len(X_maj) - len(X_maj_prime)) < n_smute):
-        x1_id = X_maj_prime.sample().index.item()
-        x1 = X_maj_prime.iloc[x1_id]
-        X_maj_prime_fit = X_maj_prime.to_numpy().copy(order='C')
-        y_maj_prime_fit = y_maj_prime.to_numpy().copy(order='C')
-        knn.fit(X_maj_prime_fit, y_maj_prime_fit)
-        distances, indices = knn.kneighbors(x1.to_numpy().reshape(1, -1))
-        indices = indices[0][1:6]
-        x2_id = indices[randrange(5)]
-        x2 = X_maj_prime.iloc[x2_id]
-        r = uniform(0, 1)
-        x3 = x1 + (r * (x2 - x1))
-
-        X_maj_prime = X_maj_prime.drop([x1_id, x2_id]).reset_index(drop=True)
-        y_maj_prime = y_maj_prime.drop([x1_id, x2_id]).reset_index(drop=True)
-
-        X_maj_prime = X_maj_prime.append(x3, ignore_index=True)
-        y_maj_prime = y_maj_prime.append(x3_y, ignore_index=True)
-
-        completion = 100.0 * (len(X_maj) - len(X_maj_prime)) / n_smute
+    while done < n_smute:
+        candidates = np.flatnonzero(index.alive[:n_rows])
+        batch = min(batch_size, n_smute - done, len(candidates) // 2)
+        x1 = rng.choice(candidates, batch, replace=False)
+
+        neighbours = index.kneighbors(x1, k)
+        n_found = (neighbours >= 0).sum(axis=1)
+        has_neighbour = n_found > 0
+        x1, neighbours, n_found = x1[has_neighbour], neighbours[has_neighbour], n_found[has_neighbour]
+        if len(x1) == 0:
+            break
+        x2 = neighbours[np.arange(len(x1)), rng.integers(0, n_found)]
+
+        keep = disjoint_pairs(x1, x2)
+        x1, x2 = x1[keep], x2[keep]
+
+        r = rng.random((len(x1), 1))
+        x3 = np.arange(n_rows, n_rows + len(x1))
+        buffer[x3] = buffer[x1] + r * (buffer[x2] - buffer[x1])
+
+        index.remove(np.concatenate([x1, x2]))
+        index.add(x3)
+        n_rows += len(x1)
+        done += len(x1)
+
+        completion = 100.0 * done / n_smute
         if completion > last_print:
-            print(f"     {completion:.1f}%")
-            last_print += 0.1
+            print(f"     {completion:.1f}% ({done / (perf_counter() - start):.0f} samples/s)")
+            last_print = completion + 0.1
+
+    elapsed = perf_counter() - start
+    print(f" SMUTE: {done} samples in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.0f} samples/s)")
+    if stats is not None:
+        stats.update(samples=done, seconds=elapsed, samples_per_second=done / max(elapsed, 1e-9))
+
+    alive = np.flatnonzero(index.alive[:n_rows])
+    X_maj_prime = pd.DataFrame(buffer[alive], columns=X_maj.columns)
+    y_maj_prime = pd.Series(labels[alive], name=y_maj.name)
 
     return X_maj_prime, y_maj_prime
 
-def SMOTE(X_min, y_min, n_smote):
-    X_min = X_min.reset_index(drop=True)
-    y_min = y_min.reset_index(drop=True)
+def smote_chunks(X_min, y_min, n_smote, k=5, chunk_size=100000, seed=None, cache=False):
+    """
+    Generate n_smote SMOTE samples in chunks. Each sample is x1 + r * (x2 - x1) for a random minority point x1, one of
+    its k nearest minority neighbours x2 and a random gap r in [0, 1).
 
-    X_min_prime = X_min.copy()
-    y_min_prime = y_min.copy()
+    The k-NN graph is computed once and every (x1, x2, r) triple is drawn up front, so each chunk is a single
+    vectorized gather. Only one chunk of samples is in memory at a time.
 
-    x3_y = y_min_prime.sample().copy()
+    PARAMETERS
+    X_min (pd.DataFrame) - minority class features
+    y_min (pd.Series) - minority class labels
+    n_smote (int) - number of samples to generate
+    k (int) - number of nearest neighbours x2 is drawn from
+    chunk_size (int) - number of samples per chunk
+    seed (int) - seed for reproducible output
+    cache (bool) - read the k-NN graph from the shared `knn_cache` instead of computing it
 
-    knn = FaissKNeighbors(n_neighbors=6)
-    X_numpy = X_min.to_numpy().copy(order='C')
-    y_numpy = y_min.to_numpy().copy(order='C')
-    knn.fit(X_numpy, y_numpy)
+    RETURNS
+    generator of (pd.DataFrame, pd.Series) - synthetic features and labels, chunk by chunk
+    """
+    rng = np.random.default_rng(seed)
+    X_numpy = X_min.to_numpy(dtype=np.float64)
+    # a lone minority point has no neighbour to interpolate towards
+    if n_smote > 0 and len(X_numpy) < 2:
+        raise ValueError(f"SMOTE needs at least 2 minority samples to interpolate between, got {len(X_numpy)}")
+    k = min(k, len(X_numpy) - 1)
 
-    last_print = 0
+    if cache:
+        _, neighbours = neighbour_graph(X_numpy, k + 1).neighbours_of_rows(k)
+    else:
+        knn = FaissKNeighbors(n_neighbors=k + 1)
+        knn.fit(X_numpy, y_min.to_numpy())
+        _, neighbours = knn.kneighbors(X_numpy)
+        # the first neighbour of each point is the point itself
+        neighbours = neighbours[:, 1:]
+    neighbours = np.asarray(neighbours)
+
+    # one draw for all triples: x1 and the choice of neighbour come from scaling uniforms
+    draws = rng.random((n_smote, 3))
+    x1 = (draws[:, 0] * len(X_numpy)).astype(np.int64)
+    x2 = neighbours[x1, (draws[:, 1] * k).astype(np.int64)]
+    gap = draws[:, 2:]
+    label = y_min.iloc[rng.integers(len(y_min))]
+
+    for start in range(0, n_smote, chunk_size):
+        chunk = slice(start, min(start + chunk_size, n_smote))
+        base = X_numpy[x1[chunk]]
+        samples = base + gap[chunk] * (X_numpy[x2[chunk]] - base)
+        yield (pd.DataFrame(samples, columns=X_min.columns, index=pd.RangeIndex(chunk.start, chunk.stop)),
+               pd.Series(label, index=pd.RangeIndex(chunk.start, chunk.stop), name=y_min.name))
+
+def SMOTE(X_min, y_min, n_smote, k=5, chunk_size=100000, seed=None, cache=False):
+    """
+    Oversample the minority class by n_smote points, see `smote_chunks`.
 
+    RETURNS
+    pd.DataFrame, pd.Series - the original minority class followed by the synthetic samples
+    """
+    n = len(X_min)
+    X_min_prime = np.empty((n + n_smote, X_min.shape[1]), dtype=np.float64)
+    X_min_prime[:n] = X_min.to_numpy(dtype=np.float64)
+    y_min_prime = np.empty(n + n_smote, dtype=y_min.dtype)
+    y_min_prime[:n] = y_min.to_numpy()
+
+    start = perf_counter()
     print(" KNN FIT - SAMPLING")
-    while((len(X_min_prime) - len(X_min)) < n_smote):
-        x1_id = X_min.sample().index.item()
-        x1 = X_min.iloc[x1_id]
-        distances, indices = knn.kneighbors(x1.to_numpy().reshape(1, -1))
-        indices = indices[0][1:6]
-        x2_id = indices[randrange(5)]
-        x2 = X_min.iloc[x2_id]
-        r = uniform(0, 1)
-        x3 = x1 + (r * (x2 - x1))
-        X_min_prime = X_min_prime.append(x3, ignore_index=True)
-        y_min_prime = y_min_prime.append(x3_y, ignore_index=True)
-
-        completion = 100.0 * (len(X_min_prime) - len(X_min)) / n_smote
-        if completion > last_print:
-            print(f"     {completion:.1f}%")
-            last_print += 0.1
+    for X_chunk, y_chunk in smote_chunks(X_min, y_min, n_smote, k, chunk_size, seed, cache):
+        X_min_prime[n + X_chunk.index.start:n + X_chunk.index.stop] = X_chunk.to_numpy()
+        y_min_prime[n + X_chunk.index.start:n + X_chunk.index.stop] = y_chunk.to_numpy()
+        print(f"     {100.0 * X_chunk.index.stop / n_smote:.1f}%")
 
-    return X_min_prime, y_min_prime
+    elapsed = perf_counter() - start
+    print(f" SMOTE: {n_smote} samples in {elapsed:.1f}s ({n_smote / max(elapsed, 1e-9):.0f} samples/s)")
 
-def CSMOUTE(majority, minority, ratio):
+    return pd.DataFrame(X_min_prime, columns=X_min.columns), pd.Series(y_min_prime, name=y_min.name)
+
+def CSMOUTE(majority, minority, ratio, cache=False, seed=None):
     X_maj = majority.drop(columns=['is_fraud']).copy()
     y_maj = majority['is_fraud'].copy()
 
@@ -103,24 +261,52 @@ def CSMOUTE(majority, minority, ratio):
     n_smute = n - n_smote
 
     print("SMOTE")
-    X_min_prime, y_min_prime = SMOTE(X_min, y_min, n_smote)
+    with stage("csmoute_smote", rows_in=len(X_min)) as timing:
+        X_min_prime, y_min_prime = SMOTE(X_min, y_min, n_smote, seed=seed, cache=cache)
+        timing.rows_out = len(X_min_prime)
     print("SMUTE")
-    X_maj_prime, y_maj_prime = SMUTE(X_maj, y_maj, n_smute)
+    with stage("csmoute_smute", rows_in=len(X_maj)) as timing:
+        X_maj_prime, y_maj_prime = SMUTE(X_maj, y_maj, n_smute, seed=seed)
+        timing.rows_out = len(X_maj_prime)
 
     return X_maj_prime, y_maj_prime, X_min_prime, y_min_prime
 
-print("LOADING DATA")
-meta_data = pd.read_csv("/mnt/storage/scratch/jc17360/ADS/data/meta_features_train.csv", index_col=0)
+class CSMOUTESampler:
+    """
+    CSMOUTE with the `fit_resample(X, y)` contract of the imblearn samplers, see `CSMOUTE`
+
+    PARAMETERS
+    random_state (int) - seed of both the SMOTE and the SMUTE step, for reproducible output
+    """
+    def __init__(self, ratio=0.9, label="is_fraud", cache=False, random_state=None):
+        self.ratio = ratio
+        self.label = label
+        self.cache = cache
+        self.random_state = random_state
+
+    def fit_resample(self, X, y):
+        data = pd.DataFrame(X).assign(**{self.label: np.asarray(y)})
+        X_maj, y_maj, X_min, y_min = CSMOUTE(majority=data[data[self.label] == 0], minority=data[data[self.label] == 1], ratio=self.ratio, cache=self.cache, seed=self.random_state)
+
+        X_resampled = pd.concat([X_maj, X_min], ignore_index=True)
+        y_resampled = pd.concat([y_maj, y_min], ignore_index=True)
+        if not isinstance(X, pd.DataFrame):
+            return X_resampled.to_numpy(), y_resampled.to_numpy()
+        return X_resampled, y_resampled
+
+if __name__ == "__main__":
+    print("LOADING DATA")
+    meta_data = load_frame("/mnt/storage/scratch/jc17360/ADS/data/meta_features_train")
 
-non_fraud = meta_data[meta_data['is_fraud'] == 0]
-fraud = meta_data[meta_data['is_fraud'] == 1]
+    non_fraud = meta_data[meta_data['is_fraud'] == 0]
+    fraud = meta_data[meta_data['is_fraud'] == 1]
 
-samples = CSMOUTE(majority=non_fraud, minority=fraud, ratio=0.9)
+    samples = CSMOUTE(majority=non_fraud, minority=fraud, ratio=0.9)
 
-non_fraud_samples = samples[0]
-non_fraud_samples['is_fraud'] = samples[1]
-fraud_samples = samples[2]
-fraud_samples['is_fraud'] = samples[3]
+    non_fraud_samples = samples[0]
+    non_fraud_samples['is_fraud'] = samples[1]
+    fraud_samples = samples[2]
+    fraud_samples['is_fraud'] = samples[3]
 
-non_fraud_samples.to_csv("/mnt/storage/scratch/jc17360/ADS/data/CSMOUTE_non_fraud_samples.csv")
-fraud_samples.to_csv("/mnt/storage/scratch/jc17360/ADS/data/CSMOUTE_fraud_samples.csv")
\ No newline at end of file
+    save_frame(non_fraud_samples, "/mnt/storage/scratch/jc17360/ADS/data/CSMOUTE_non_fraud_samples")
+    save_frame(fraud_samples, "/mnt/storage/scratch/jc17360/ADS/data/CSMOUTE_fraud_samples")
@@ -1,8 +1,12 @@
-import pandas as pd
 import imblearn
 
+from instrument import stage
+from storage import load_frame, save_frame
+
 print("LOADING DATA")
-meta_data = pd.read_csv("data/meta_features_train.csv", index_col=0)
+with stage("load") as timing:
+    meta_data = load_frame("data/meta_features_train")
+    timing.rows_out = len(meta_data)
 
 y = meta_data["is_fraud"]
 X = meta_data.drop(["is_fraud"], axis=1)
@@ -10,8 +14,10 @@ X = meta_data.drop(["is_fraud"], axis=1)
 print("SAMPLING")
 oversample = imblearn.over_sampling.SMOTE(sampling_strategy=1.0)
 
-X, y = oversample.fit_resample(X, y)
+with stage("SMOTE", rows_in=len(X)) as timing:
+    X, y = oversample.fit_resample(X, y)
+    timing.rows_out = len(X)
 
 X["is_fraud"] = y
 
-X.to_csv("data/SMOTE_samples.csv")
\ No newline at end of file
+save_frame(X, "data/SMOTE_samples")
\ No newline at end of file
@@ -1,10 +1,13 @@
-import pandas as pd
 import imblearn
 
 from collections import Counter
+from instrument import stage
+from storage import load_frame, save_frame
 
 print("LOADING DATA")
-meta_data = pd.read_csv("/mnt/storage/scratch/jc17360/ADS/data/meta_features_train.csv", index_col=0)
+with stage("load") as timing:
+    meta_data = load_frame("/mnt/storage/scratch/jc17360/ADS/data/meta_features_train")
+    timing.rows_out = len(meta_data)
 
 y = meta_data["is_fraud"]
 X = meta_data.drop(["is_fraud"], axis=1)
@@ -12,11 +15,13 @@ X = meta_data.drop(["is_fraud"], axis=1)
 print("SAMPLING")
 oversample = imblearn.combine.SMOTEENN()
 
-X, y = oversample.fit_resample(X, y)
+with stage("SMOTEENN", rows_in=len(X)) as timing:
+    X, y = oversample.fit_resample(X, y)
+    timing.rows_out = len(X)
 
 counter = Counter(y)
 print(counter)
 
 X["is_fraud"] = y
 
-X.to_csv("/mnt/storage/scratch/jc17360/ADS/data/SMOTEENN_samples.csv")
\ No newline at end of file
+save_frame(X, "/mnt/storage/scratch/jc17360/ADS/data/SMOTEENN_samples")
\ No newline at end of file
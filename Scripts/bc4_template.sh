@@ -11,6 +11,7 @@
 # To specify a specific amount of memory, add "#SBATCH --mem X(MB|GB)". Use only MB or GB, not (MB|GB). Lower means less queue time. However, leaving this
 # Flag blank means you have access to ~100MB memory on the node. When you submit, if you type squeue --user <user> and 
 # See "QOSMinCpuNotSatisfied" then you need to increase either nodes, ntasks-per-node or cpus-per-task
+# For a sweep of samplers and classifiers, "python launcher.py slurm <sweep>" writes job-array scripts in this layout instead
 
 # Get rid of any modules already loaded
 module purge
@@ -0,0 +1,285 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import traceback
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+
+from datetime import datetime, timezone
+from queue import Empty
+from time import perf_counter
+from storage import load_frame, save_frame
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "Preparation"))
+sys.path.append(os.path.join(ROOT, "Sampling"))
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+# Key of the entity ID hashes of the generated data. It protects nothing, so it need not be secret, but being fixed it
+# keeps the cached clean inputs the same between runs
+BENCHMARK_ID_KEY = "benchmark"
+
+class SkipCase(Exception):
+    """Raised by a case whose input does not suit it at this size, the run is recorded as skipped with the message"""
+
+#########################---Inputs--################
+
+def raw_input(n_rows, seed, cache_dir) -> pd.DataFrame:
+    """Generated transactions with the synthetic_train.csv schema, cached on disk per size and seed"""
+    from generator import generate_transactions
+    file_path = os.path.join(cache_dir, f"transactions_{n_rows}_{seed}.parquet")
+    if not os.path.exists(file_path):
+        save_frame(generate_transactions(n_rows, seed=seed), file_path, compact=False)
+    return load_frame(file_path)
+
+def clean_input(n_rows, seed, cache_dir) -> pd.DataFrame:
+    """
+    `anonymise_data` output for the generated transactions, cached on disk. The entity IDs are dense codes, as in the
+    files creation.py writes: the raw 64-bit hashes would outweigh every other column in the neighbour-based cases
+    """
+    from creation import anonymise_data
+    from entity_ids import EntityCodes
+    file_path = os.path.join(cache_dir, f"clean_codes_{n_rows}_{seed}.parquet")
+    if not os.path.exists(file_path):
+        clean_df = anonymise_data(raw_input(n_rows, seed, cache_dir), printing=False, codes=EntityCodes(), secret=BENCHMARK_ID_KEY)
+        save_frame(clean_df, file_path, compact=False)
+    return load_frame(file_path)
+
+def meta_input(n_rows, seed, cache_dir) -> pd.DataFrame:
+    """`extend_meta` output for the generated transactions, cached on disk"""
+    from creation import extend_meta
+    file_path = os.path.join(cache_dir, f"meta_codes_{n_rows}_{seed}.parquet")
+    if not os.path.exists(file_path):
+        with contextlib.redirect_stdout(io.StringIO()):
+            meta_data = extend_meta(clean_input(n_rows, seed, cache_dir), exchange_rates())
+        save_frame(meta_data, file_path, compact=False)
+    return load_frame(file_path)
+
+def exchange_rates():
+    """Generated rates covering the generated transactions, so no snapshot file is needed"""
+    from generator import generate_exchange_rates
+    return generate_exchange_rates()
+
+INPUTS = {"raw": raw_input, "clean": clean_input, "meta": meta_input}
+
+#########################---Cases--################
+
+def case_anonymise_data(raw):
+    from creation import anonymise_data
+    anonymise_data(raw, printing=False, secret=BENCHMARK_ID_KEY)
+
+def case_extend_meta(clean):
+    from creation import extend_meta
+    extend_meta(clean, exchange_rates())
+
+def case_standardise_time(clean):
+    from creation import standardise_time
+    standardise_time(clean["unix_time"])
+
+def case_time_since_last_transactions(clean):
+    from creation import time_since_last_transactions
+    time_since_last_transactions(clean[["person_id", "merchant_id", "unix_time"]], ["person_id", "merchant_id"], printing=False)
+
+def case_transaction_on_date(clean):
+    from creation import transaction_on_date
+    transaction_on_date("person_id", clean[["person_id", "unix_time"]])
+
+def case_prepare_amount(clean):
+    from creation import prepare_amount
+    prepare_amount(clean[["unix_time", "amt"]], "amt", "USD", "GBP", exchange_rates())
+
+def case_transactions_per_entity(clean):
+    from creation import transactions_per_entity
+    transactions_per_entity(clean["person_id"])
+    transactions_per_entity(clean["merchant_id"])
+
+def case_entity_amount_statistic(clean):
+    from creation import entity_amount_statistic
+    entity_amount_statistic("person_id", clean[["person_id", "amt"]], "mean")
+    entity_amount_statistic("merchant_id", clean[["merchant_id", "amt"]], "max")
+
+def case_entity_amount_statistic_by_day(clean):
+    from creation import entity_amount_statistic_by_day
+    entity_amount_statistic_by_day("merchant_id", clean[["merchant_id", "amt", "unix_time"]], "mean")
+    entity_amount_statistic_by_day("person_id", clean[["person_id", "amt", "unix_time"]], "mean")
+
+def case_mdav(raw):
+    from MDAV import mdav
+    mdav(raw[["lat", "long"]].to_numpy(dtype=np.float64), k=10)
+
+def csmoute_split(meta):
+    """Majority/minority features and sample counts as `CSMOUTE` computes them with ratio 0.9"""
+    majority = meta[meta["is_fraud"] == 0]
+    minority = meta[meta["is_fraud"] == 1]
+    n = len(majority) - len(minority)
+    return majority, minority, round(n * 0.9), n - round(n * 0.9)
+
+def case_csmoute_smote(meta):
+    from CSMOUTE import SMOTE
+    _, minority, n_smote, _ = csmoute_split(meta)
+    SMOTE(minority.drop(columns=["is_fraud"]), minority["is_fraud"], n_smote, seed=0)
+
+def case_csmoute_smute(meta):
+    from CSMOUTE import SMUTE
+    majority, _, _, n_smute = csmoute_split(meta)
+    SMUTE(majority.drop(columns=["is_fraud"]), majority["is_fraud"], n_smute, seed=0)
+
+def case_mwmote(meta):
+    from mwmote_sampler import MWMOTE, TooFewMinoritySamples
+    try:
+        MWMOTE(random_state=0).fit_resample(meta.drop(columns=["is_fraud"]), meta["is_fraud"])
+    except TooFewMinoritySamples as error:
+        # small inputs hold a few dozen fraud rows, too scattered for any to have a fraud neighbour
+        raise SkipCase(str(error))
+
+# name: (input, function, largest size run), sizes above the limit are recorded as skipped
+CASES = {
+    "anonymise_data": ("raw", case_anonymise_data, None),
+    "extend_meta": ("clean", case_extend_meta, None),
+    "standardise_time": ("clean", case_standardise_time, None),
+    "time_since_last_transactions": ("clean", case_time_since_last_transactions, None),
+    "transaction_on_date": ("clean", case_transaction_on_date, None),
+    "prepare_amount": ("clean", case_prepare_amount, None),
+    "transactions_per_entity": ("clean", case_transactions_per_entity, None),
+    "entity_amount_statistic": ("clean", case_entity_amount_statistic, None),
+    "entity_amount_statistic_by_day": ("clean", case_entity_amount_statistic_by_day, None),
+    "mdav": ("raw", case_mdav, None),
+    "csmoute_smote": ("meta", case_csmoute_smote, None),
+    # exact neighbour search over the whole majority class per batch, 10M rows would take days
+    "csmoute_smute": ("meta", case_csmoute_smute, 1_000_000),
+    # agglomerative clustering of the minority class is quadratic in memory
+    "mwmote": ("meta", case_mwmote, 1_000_000),
+}
+
+#########################---Runner--################
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def measure_case(name, n_rows, seed, cache_dir, queue):
+    """Prepare the input of one case and time it, in a fresh process so memory figures are not shared between cases"""
+    import resource
+    try:
+        input_name, function, _ = CASES[name]
+        data = INPUTS[input_name](n_rows, seed, cache_dir)
+        rss_before = current_rss_mb()
+
+        start = perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(data)
+        elapsed = perf_counter() - start
+
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        queue.put({"seconds": elapsed, "rows_per_second": n_rows / elapsed, "input_rss_mb": rss_before,
+                   "peak_rss_mb": peak_rss, "status": "ok"})
+    except SkipCase as skip:
+        queue.put({"status": "skipped", "reason": str(skip)})
+    except Exception:
+        queue.put({"status": "error", "error": traceback.format_exc(limit=3)})
+
+def run_case(name, n_rows, seed=0, cache_dir="data/benchmark_cache") -> dict:
+    context = mp.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=measure_case, args=(name, n_rows, seed, cache_dir, queue))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            # killed, e.g. by the out-of-memory killer, before it could report
+            if not process.is_alive():
+                result = {"status": "crashed", "exit_code": process.exitcode}
+    process.join()
+    return {"case": name, "rows": n_rows, **result}
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_suite(cases, sizes, out_path=None, seed=0, cache_dir="data/benchmark_cache", printing=True) -> dict:
+    """
+    Run every case at every size and save the results as JSON, rewritten after each case so a long run can be
+    inspected or interrupted.
+
+    PARAMETERS
+    cases (list of str) - names from `CASES`
+    sizes (list of int) - row counts of the generated input
+    out_path (str) - results file, `data/benchmarks/<commit>.json` by default
+    seed (int) - generator seed, keep it fixed to compare commits
+    cache_dir (str) - directory for generated and derived inputs
+
+    RETURNS
+    dict - run metadata and the list of results
+    """
+    commit = git_commit()
+    out_path = out_path or os.path.join("data", "benchmarks", f"{commit}.json")
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    report = {"commit": commit, "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+              "seed": seed, "results": []}
+
+    for n_rows in sizes:
+        for name in cases:
+            limit = CASES[name][2]
+            if limit is not None and n_rows > limit:
+                result = {"case": name, "rows": n_rows, "status": "skipped", "reason": f"above the {limit} row limit"}
+            else:
+                result = run_case(name, n_rows, seed, cache_dir)
+            report["results"].append(result)
+            if (printing):
+                if result["status"] == "ok":
+                    print(f"{name:<32} {n_rows:>10}  {result['seconds']:>9.2f}s  {result['peak_rss_mb']:>8.0f}MB peak")
+                else:
+                    print(f"{name:<32} {n_rows:>10}  {result['status'].upper()}  {result.get('reason', '')}".rstrip())
+            with open(out_path, "w") as out_file:
+                json.dump(report, out_file, indent=2)
+
+    return report
+
+def compare(old_path, new_path) -> pd.DataFrame:
+    """Time and peak memory of two result files side by side, with new/old ratios"""
+    frames = []
+    for path in (old_path, new_path):
+        with open(path) as result_file:
+            results = pd.DataFrame(json.load(result_file)["results"])
+        frames.append(results[results["status"] == "ok"].set_index(["case", "rows"])[["seconds", "peak_rss_mb"]])
+
+    table = frames[0].join(frames[1], lsuffix="_old", rsuffix="_new", how="inner")
+    table["time_ratio"] = table["seconds_new"] / table["seconds_old"]
+    table["memory_ratio"] = table["peak_rss_mb_new"] / table["peak_rss_mb_old"]
+    return table
+
+if __name__ == "__main__":
+    # e.g. "python benchmark.py --sizes 10000 100000 --cases extend_meta mdav" or "python benchmark.py --compare a.json b.json"
+    parser = argparse.ArgumentParser(description="Time and memory-profile the data preparation and sampling code")
+    parser.add_argument("--cases", nargs="*", default=list(CASES), help=f"any of {', '.join(CASES)}")
+    parser.add_argument("--sizes", nargs="*", type=int, default=SIZES)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default="data/benchmark_cache")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        with pd.option_context("display.width", 200, "display.max_columns", None, "display.max_rows", None):
+            print(compare(*args.compare))
+    else:
+        unknown = set(args.cases) - set(CASES)
+        if unknown:
+            parser.error(f"unknown cases {sorted(unknown)}")
+        report = run_suite(args.cases, args.sizes, args.out, args.seed, args.cache_dir)
+        # a failed case is recorded rather than raised, so the exit status is the only sign of it for scripts and CI
+        failed = [f"{result['case']} at {result['rows']}" for result in report["results"] if result["status"] in ("error", "crashed")]
+        if failed:
+            sys.exit(f"Failed: {', '.join(failed)}")
@@ -1,12 +1,21 @@
-import forex_python.converter as fx
+import json
+import os
+import sys
 import numpy as np
 import pandas as pd
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from entity_ids import ENTITIES, EntityCodes, entity_hashes, entity_id, hash_key
+from exchange_rates import ExchangeRates
+from instrument import stage, traced
 from math import ceil
+from storage import load_frame, save_frame
+from time import perf_counter
 
 def save_data(df:pd.DataFrame,file_path):
-    df.to_csv(file_path)
+    save_frame(df,file_path)
 
 def anonymise_to_cats(series:pd.Series) -> pd.Series:
     return series.astype("category").cat.codes
@@ -18,84 +27,256 @@ def k_anon_jobs(df,k=2) -> pd.Series:
     """
     k anonymise jobs. Note -1 means a None value (Used for jobs which less than k people do)
     """
-    df["job_category"]=anonymise_to_cats(df["job"].str.split(",").str[0].str.strip())
-    group_by=df[["person_id","job_category"]].groupby(["job_category"])
-    rare_job_cats=np.where(group_by["person_id"].nunique()<k)[0].tolist()
+    job_category=anonymise_to_cats(df["job"].str.split(",").str[0].str.strip())
+    people_per_job=df["person_id"].groupby(job_category.to_numpy()).nunique()
 
-    return df["job_category"].transform(lambda x:-1 if (x in rare_job_cats) else x)
+    #lookup array indexed by category code, the extra last slot is what a missing job (-1) reads
+    is_rare=np.zeros(len(people_per_job)+1,dtype=bool)
+    is_rare[people_per_job.index[people_per_job<k]]=True
+    codes=job_category.to_numpy().astype(np.int64)
+    return pd.Series(np.where(is_rare[codes],-1,codes),index=df.index,name="job_category")
 
 # k-anonymous clustering
-def k_anon_clustering(series,k=2) -> pd.Series:
-    series=series.copy()
-    unique_vals=series.unique().tolist()
-    unique_vals=pd.Series(unique_vals,unique_vals)
-    unique_vals.sort_values(ascending=False,inplace=True)
+def cluster_bins(unique_vals,k=2) -> pd.Series:
+    """
+    Map each distinct value to a bin of k consecutive values (largest first). The last bin takes any remainder
+    """
+    unique_vals=np.sort(np.asarray(unique_vals))[::-1]
+    #fewer than k values cannot fill a bin, they keep their own value
+    if unique_vals.size<k: return pd.Series(unique_vals,unique_vals)
+    return pd.Series(np.minimum(np.arange(unique_vals.size)//k,unique_vals.size//k-1),unique_vals)
 
-    bin_id=0
-    i=0
-    for i in range(0,unique_vals.size-k+1,k):
-        unique_vals[i:i+k]=bin_id
-        if (i+2*k>unique_vals.size): unique_vals[i+k:]=bin_id
-        bin_id+=1
+def k_anon_clustering(series,k=2) -> pd.Series:
+    unique_vals=cluster_bins(series.unique(),k)
 
-    return series.transform(lambda x:unique_vals[x])
+    #the bins are indexed by the distinct values in decreasing order, so each row's bin is found by binary search
+    positions=np.searchsorted(-unique_vals.index.to_numpy(),-series.to_numpy())
+    return pd.Series(unique_vals.to_numpy()[positions],index=series.index,name=series.name)
 
-def anonymise_data(df, printing=True) -> pd.DataFrame:
+@traced("anonymise_data")
+def anonymise_data(df, printing=True, codes=None, secret=None) -> pd.DataFrame:
+    """
+    PARAMETERS
+    df (pd.DataFrame) - raw transactions
+    codes (EntityCodes) - persistent dictionaries turning the hashed cc/person/merchant IDs into dense codes (see
+                          entity_ids.py). Pass the same ones for train and test so their IDs match, without them
+                          the IDs are the keyed hashes themselves
+    secret (str) - key of the ID hashes, `ADS_ID_KEY` by default
+    """
     # prepare data
-    if (printing): print("Data ",end="",flush=True)
-    df["trans_date_trans_time"]=pd.to_datetime(df["trans_date_trans_time"],format="%Y-%m-%d %H:%M:%S")
-    df["dob"]=pd.to_datetime(df["dob"],format="%Y-%m-%d")
-    if (printing): print("PREPARED")
+    with stage("prepare",rows_in=len(df)):
+        if (printing): print("Data ",end="",flush=True)
+        df["trans_date_trans_time"]=pd.to_datetime(df["trans_date_trans_time"],format="%Y-%m-%d %H:%M:%S")
+        df["dob"]=pd.to_datetime(df["dob"],format="%Y-%m-%d")
+        if (printing): print("PREPARED")
 
     # clean data
     clean_df=pd.DataFrame()
     clean_df["is_fraud"]=df["is_fraud"]
 
-    if (printing): print("Time ",end="",flush=True)
-    clean_df["unix_time"]=df["unix_time"].copy()
-    if (printing): print("DONE")
+    with stage("time",rows_in=len(df)):
+        if (printing): print("Time ",end="",flush=True)
+        clean_df["unix_time"]=df["unix_time"].copy()
+        if (printing): print("DONE")
+
+    with stage("amount",rows_in=len(df)):
+        if (printing): print("Amount ",end="",flush=True)
+        clean_df["amt"]=df["amt"].copy()
+        if (printing): print("DONE")
+
+    with stage("credit_card",rows_in=len(df)):
+        if (printing): print("Credit Card ",end="",flush=True)
+        clean_df["cc_id"]=entity_id(df,"cc_id",codes,secret)
+        if (printing): print("DONE")
+
+    with stage("person",rows_in=len(df)):
+        if (printing): print("Person  ",end="",flush=True)
+        clean_df["person_id"]=entity_id(df,"person_id",codes,secret)
+        if (printing): print("DONE")
+
+    with stage("gender",rows_in=len(df)):
+        if (printing): print("Gender ",end="",flush=True)
+        clean_df["gender_id"]=anonymise_to_cats(df["gender"])
+        if (printing): print("DONE")
+
+    with stage("job",rows_in=len(df)):
+        if (printing): print("Job ",end="",flush=True)
+        clean_df["job_category"]=k_anon_jobs(pd.concat([df["job"],clean_df["person_id"]],axis=1),k=5)
+        if (printing): print("DONE")
+
+    with stage("age",rows_in=len(df)):
+        if (printing): print("Age ",end="",flush=True)
+        clean_df["age"]=dob_to_age(df[["dob","trans_date_trans_time"]])
+        if (printing): print("DONE")
+
+    with stage("city_pop",rows_in=len(df)):
+        if (printing): print("City Pop ",end="",flush=True)
+        clean_df["city_pop_cluster_id"]=k_anon_clustering(df["city_pop"],k=10)
+        if (printing): print("DONE")
+
+    with stage("merchant",rows_in=len(df)):
+        if (printing): print("Merchant ",end="",flush=True)
+        clean_df["merchant_id"]=entity_id(df,"merchant_id",codes,secret)
+        clean_df["merchant_category"]=anonymise_to_cats(df["category"])
+        if (printing): print("DONE")
+
+    return clean_df
 
-    if (printing): print("Amount ",end="",flush=True)
-    clean_df["amt"]=df["amt"].copy()
-    if (printing): print("DONE")
+# Streaming anonymisation
+# Reads the raw CSVs in chunks and anonymises them in a process pool, so peak memory depends on the chunk size.
+# The entity IDs are keyed hashes encoded with `EntityCodes`, as in `anonymise_data`. The other categorical columns
+# are encoded with persistent global dictionaries instead of per-frame `cat.codes`, so a value keeps the same code
+# across chunks, files and runs (codes are given in order of first appearance).
+
+# Only columns whose values identify nobody are kept as plain text, the entity IDs never are
+CATEGORY_COLUMNS=["gender_id","job_category","merchant_category"]
+
+class CategoryCodes:
+    """
+    Global value -> code dictionaries of `CATEGORY_COLUMNS`, saved to JSON between runs
+    """
+    def __init__(self,codes=None):
+        codes=codes or {}
+        # anything else in the file (older versions also kept card numbers and names) is dropped on the next save
+        self.codes={column:codes.get(column,{}) for column in CATEGORY_COLUMNS}
+
+    @classmethod
+    def load(cls,file_path):
+        if not os.path.exists(file_path): return cls()
+        with open(file_path) as f:
+            return cls(json.load(f))
+
+    def save(self,file_path):
+        with open(f"{file_path}.tmp","w") as f:
+            json.dump(self.codes,f)
+        os.replace(f"{file_path}.tmp",file_path)
+
+    def encode(self,column,uniques,local_codes) -> np.ndarray:
+        """Turn chunk-local codes from `pd.factorize` into global codes, adding unseen values. -1 stays -1"""
+        mapping=self.codes[column]
+        lookup=np.array([mapping.setdefault(str(value),len(mapping)) for value in uniques]+[-1],dtype=np.int64)
+        return lookup[local_codes]
+
+def job_prefix(job:pd.Series) -> pd.Series:
+    return job.str.split(",").str[0].str.strip()
+
+def read_chunks(file_paths,chunksize,usecols=None):
+    for file_path in file_paths:
+        index_col=None if usecols else 0
+        for chunk in pd.read_csv(file_path,index_col=index_col,usecols=usecols,chunksize=chunksize):
+            yield chunk
+
+def global_groupings(file_paths,chunksize,k_jobs=5,k_city=10):
+    """
+    First pass over only the columns needed for the k-anonymity groupings, which depend on the whole dataset:
+    the city population bins and the set of jobs done by fewer than `k_jobs` people (people told apart by their
+    person ID hash, so no names are held)
+    """
+    city_pops=set()
+    job_people=set()
+    for chunk in read_chunks(file_paths,chunksize,usecols=ENTITIES["person_id"]+["city_pop"]):
+        city_pops.update(chunk["city_pop"].unique().tolist())
+        job_people.update(zip(job_prefix(chunk["job"]),entity_hashes(chunk,ENTITIES["person_id"]).tolist()))
 
-    if (printing): print("Credit Card ",end="",flush=True)
-    clean_df["cc_id"]=anonymise_to_cats(df["cc_num"])
-    if (printing): print("DONE")
+    people_per_job=pd.Series([job for job,_ in job_people]).value_counts()
+    rare_jobs=set(people_per_job.index[people_per_job<k_jobs])
+    return cluster_bins(sorted(city_pops),k_city),rare_jobs
 
-    if (printing): print("Person  ",end="",flush=True)
-    clean_df["person_id"]=anonymise_to_cats(df["first"]+"_"+df["last"]+"_"+df["job"]+"_"+df["dob"].apply(lambda x: x.strftime('%Y-%m-%d')))
-    if (printing): print("DONE")
+def init_worker(city_pop_bins,rare_jobs):
+    global worker_city_pop_bins,worker_rare_jobs
+    worker_city_pop_bins,worker_rare_jobs=city_pop_bins,rare_jobs
 
-    if (printing): print("Gender ",end="",flush=True)
-    clean_df["gender_id"]=anonymise_to_cats(df["gender"])
-    if (printing): print("DONE")
+def anonymise_chunk(df):
+    """
+    Anonymise one chunk in a worker. The entity IDs come back as hashes and the other categorical columns as
+    `pd.factorize` results, for the parent to map onto the global dictionaries, which never leave the parent process
+    """
+    df=df.copy()
+    df["trans_date_trans_time"]=pd.to_datetime(df["trans_date_trans_time"],format="%Y-%m-%d %H:%M:%S")
+    df["dob"]=pd.to_datetime(df["dob"],format="%Y-%m-%d")
 
-    if (printing): print("Job ",end="",flush=True)
-    clean_df["job_category"]=k_anon_jobs(pd.concat([df["job"],clean_df["person_id"]],axis=1),k=5)
-    if (printing): print("DONE")
+    clean_df=pd.DataFrame(index=df.index)
+    clean_df["is_fraud"]=df["is_fraud"]
+    clean_df["unix_time"]=df["unix_time"]
+    clean_df["amt"]=df["amt"]
+
+    hashes={column:entity_hashes(df,columns) for column,columns in ENTITIES.items()}
+    jobs=job_prefix(df["job"])
+    keys={
+        "gender_id":df["gender"],
+        "job_category":jobs.where(~jobs.isin(worker_rare_jobs)),
+        "merchant_category":df["category"],
+    }
+    factorized={column:pd.factorize(values) for column,values in keys.items()}
 
-    if (printing): print("Age ",end="",flush=True)
     clean_df["age"]=dob_to_age(df[["dob","trans_date_trans_time"]])
-    if (printing): print("DONE")
+    clean_df["city_pop_cluster_id"]=df["city_pop"].map(worker_city_pop_bins)
 
-    if (printing): print("City Pop ",end="",flush=True)
-    clean_df["city_pop_cluster_id"]=k_anon_clustering(df["city_pop"],k=10)
-    if (printing): print("DONE")
+    return clean_df,hashes,factorized
 
-    if (printing): print("Merchant ",end="",flush=True)
-    clean_df["merchant_id"]=anonymise_to_cats(df["merchant"])
-    clean_df["merchant_category"]=anonymise_to_cats(df["category"])
-    if (printing): print("DONE")
+@traced("anonymise_data_chunked")
+def anonymise_data_chunked(file_paths,out_path,codes=None,category_codes_path="data/category_codes.json",chunksize=100000,n_jobs=None,printing=True):
+    """
+    Streaming version of `anonymise_data` over one or more raw CSVs, written straight to `out_path`. The columns are
+    those of `anonymise_data`, the codes of gender_id, job_category and merchant_category are numbered differently
 
-    return clean_df
+    PARAMETERS
+    file_paths (list of str) - raw transaction CSVs, processed in order as if concatenated
+    out_path (str) - CSV to write the anonymised rows to
+    codes (EntityCodes) - dictionaries of the entity IDs, updated in place, see `anonymise_data`
+    category_codes_path (str) - JSON file of the other category dictionaries, created if missing and updated at the end
+    chunksize (int) - rows per chunk. Peak memory is roughly (2 * n_jobs + 1) chunks
+    n_jobs (int) - worker processes, defaults to the number of CPUs
+
+    RETURNS
+    int - rows written
+    """
+    # fail before reading anything if there is no key for the entity IDs
+    hash_key()
+    n_jobs=n_jobs or os.cpu_count()
+    category_codes=CategoryCodes.load(category_codes_path)
+
+    with stage("groupings"):
+        if (printing): print("Groupings ",end="",flush=True)
+        city_pop_bins,rare_jobs=global_groupings(file_paths,chunksize)
+        if (printing): print("DONE")
+
+    columns=["is_fraud","unix_time","amt","cc_id","person_id","gender_id","job_category","age","city_pop_cluster_id","merchant_id","merchant_category"]
+    rows=0
+    with ProcessPoolExecutor(n_jobs,initializer=init_worker,initargs=(city_pop_bins,rare_jobs)) as pool:
+        pending=deque()
+        chunks=read_chunks(file_paths,chunksize)
+        done=False
+        while not done or pending:
+            # keep at most 2 chunks per worker in flight so memory stays bounded by the chunk size
+            while not done and len(pending)<2*n_jobs:
+                chunk=next(chunks,None)
+                if chunk is None: done=True
+                else: pending.append(pool.submit(anonymise_chunk,chunk))
+            if not pending: break
+
+            # the chunk itself is anonymised in a worker, only waiting for it and encoding and writing it are timed here
+            with stage("chunk") as timing:
+                clean_df,hashes,factorized=pending.popleft().result()
+                for column,column_hashes in hashes.items():
+                    clean_df[column]=column_hashes.view(np.int64) if codes is None else codes.encode(column,column_hashes)
+                for column,(local_codes,uniques) in factorized.items():
+                    clean_df[column]=category_codes.encode(column,uniques,local_codes)
+                clean_df[columns].to_csv(out_path,mode="w" if rows==0 else "a",header=(rows==0))
+                timing.rows_out=len(clean_df)
+
+            rows+=len(clean_df)
+            if (printing): print(f" {rows} rows")
+
+    category_codes.save(category_codes_path)
+    return rows
 
 def standardise_time(series) -> pd.Series:
     min_time = datetime.utcfromtimestamp(series.min())
     min_day = min_time.replace(second=0, minute=0, hour=0)
     return ((series-min_day.timestamp())).astype(int)
 
-def convert_currency(amount : float, date : datetime, cur_currency : str, tar_currency) -> float:
+def convert_currency(amount : float, date : datetime, cur_currency : str, tar_currency, rates=None) -> float:
     """
     Determine the value of an amount of one currency in another currency at a specified point in time
 
@@ -104,39 +285,31 @@ def convert_currency(amount : float, date : datetime, cur_currency : str, tar_cu
     date (datetime) - date of exchange rate to use
     cur_currency (str) - three character code for current currency
     tar_currency (str) - three character code for target currency
+    rates (ExchangeRates) - local rate snapshot, loaded from `data/exchange_rates.csv` if not given
 
     RETURNS
     float - amount of target currency
     """
-    exchange_rate = fx.get_rate(cur_currency, tar_currency, date)
+    if rates is None: rates = ExchangeRates.load()
+    exchange_rate = rates.rate(date.date() if isinstance(date, datetime) else date, cur_currency, tar_currency)
     return round(amount * exchange_rate, 2)
 
-def prepare_amount(df, cur_label, cur_currency="USD", tar_currency="GBP") -> pd.Series:
+def prepare_amount(df, cur_label, cur_currency="USD", tar_currency="GBP", rates=None) -> pd.Series:
     """
     Convert amounts in a dataframe between currencies, using the exchange rate at the start of the date on which transaction occurred
-    NOTE - conversion rate taken at start of day for speed.
+    NOTE - rates come from a local snapshot (see exchange_rates.py), so no network access is needed
 
     PARAMETERS
-    df (pd.Dataframe) - dataframe of transactions with at least ["data",cur_label] columns
+    df (pd.Dataframe) - dataframe of transactions with at least ["unix_time",cur_label] columns
     cur_label (str) - name of column which contains amounts to convert
+    rates (ExchangeRates) - local rate snapshot, loaded from `data/exchange_rates.csv` if not given
     """
-    df_local = df.copy(deep=True)
-    df_local["date"] = pd.to_datetime(df["unix_time"], unit="s").dt.date
+    if rates is None: rates = ExchangeRates.load()
 
-    # determine the exchange rate for each day
-    exchange_rates = pd.DataFrame()
-    exchange_rates["date"] = pd.to_datetime(df_local["date"].unique(), format="%Y-%m-%d")
-    exchange_rates["rate"] = exchange_rates.apply(lambda x:convert_currency(1, x["date"], cur_currency, tar_currency), axis=1)
-
-    # merge dataframes
-    exchange_rates["date"] = exchange_rates["date"].dt.date
-    df_merged = df_local[["date", "amt"]].reset_index().merge(exchange_rates[["date", "rate"]], on="date", how="left").set_index('index')
-
-    # calculated exchanged amounts
     tar_label = "amount_{}".format(tar_currency)
-    df_merged[tar_label] = df_merged.apply(lambda x:round(x["amt"] * x["rate"], 2), axis=1)
+    converted = rates.convert(df[cur_label].to_numpy(), df["unix_time"].to_numpy(), cur_currency, tar_currency)
 
-    return df_merged[tar_label]
+    return pd.Series(converted, index=df.index, name=tar_label)
 
 # Total number of transactions performed by each entity (person or merchant) in the dataset
 def transactions_per_entity(ids) -> pd.Series:
@@ -145,20 +318,73 @@ def transactions_per_entity(ids) -> pd.Series:
     return ids.apply(lambda x: pp_trans[x])
 
 # time since last transaction (merchant and customer)
-def time_since_last_transaction(id_col, df, clean_df) -> pd.Series:
+def time_since_previous(sorted_ids, sorted_times) -> np.ndarray:
+    """
+    Differences of consecutive times of rows sorted by (entity, time), -1 for the first row of every entity run.
+    Shared with the feature graph's `time_since_last_transaction_*` nodes
+    """
+    deltas = np.empty(len(sorted_times), dtype=np.int64)
+    if len(sorted_times) > 0:
+        deltas[0] = -1
+        deltas[1:] = sorted_times[1:] - sorted_times[:-1]
+        deltas[1:][sorted_ids[1:] != sorted_ids[:-1]] = -1
+    return deltas
+
+def time_since_last_transactions(df, id_cols=("person_id", "merchant_id"), timings=None, printing=True) -> pd.DataFrame:
+    """
+    Seconds since each entity's previous transaction, for several entity columns in one pass.
+    Rows are stably sorted by (entity, unix_time) and differenced within each entity run, so the
+    cost is one sort plus linear work per column rather than a full scan of the frame per entity.
+       NOTE -1 = first transaction on record
+
+    PARAMETERS
+    df (pd.DataFrame) - dataframe containing `unix_time` and every column in `id_cols`
+    id_cols (iterable of str) - names of the id columns to group by, e.g. `person_id`, `merchant_id`
+    timings (dict) - optional, filled with the seconds spent in each step, keyed "<id_col>/<step>"
+    printing (bool) - print the step timings as they complete
+
+    RETURNS
+    pd.DataFrame - one `time_since_last_transaction_<entity>` column per id column, aligned to `df`
+    """
+    if timings is None: timings = {}
+    times = df["unix_time"].to_numpy()
+    result = pd.DataFrame(index=df.index)
+
+    for id_col in id_cols:
+        ids = df[id_col].to_numpy()
+
+        # sort by entity then time (lexsort is stable, so ties keep their row order)
+        start = perf_counter()
+        order = np.lexsort((times, ids))
+        sorted_ids = ids[order]
+        sorted_times = times[order]
+        timings[f"{id_col}/sort"] = perf_counter() - start
+
+        # difference consecutive times, marking the first row of every entity run with -1
+        start = perf_counter()
+        deltas = time_since_previous(sorted_ids, sorted_times)
+        timings[f"{id_col}/diff"] = perf_counter() - start
+
+        # scatter back into the original row order
+        start = perf_counter()
+        unsorted = np.empty_like(deltas)
+        unsorted[order] = deltas
+        result["time_since_last_transaction_{}".format(id_col.replace("_id", ""))] = unsorted
+        timings[f"{id_col}/scatter"] = perf_counter() - start
+
+        if (printing):
+            steps = ", ".join(f"{step.split('/')[1]} {secs:.3f}s" for step, secs in timings.items() if step.startswith(id_col + "/"))
+            print(f" {id_col} ({len(order)} rows): {steps}")
+
+    return result
+
+def time_since_last_transaction(id_col, df) -> pd.Series:
     """
     id_col (str) - name of column which contain ids to group by
     df (pd.DataFrame) - dataframe containing `unix_time` and `id_col`
        NOTE -1 = first transaction on record
     """
-    times = df[id_col].copy(deep=True)
-
-    clean_df["time_since_last_transaction_person"] = -1
-    for id_code in df[id_col].unique():
-        trans_times = df[df[id_col] == id_code]["unix_time"]
-        times.loc[df[id_col] == id_code] = trans_times.diff()
-
-    return times.replace(np.nan, -1).astype(int)
+    return time_since_last_transactions(df, [id_col], printing=False).iloc[:, 0]
 
 # mean/min/max amt per merchant/customer
 # NOTE this is USD val so maybe change
@@ -194,44 +420,54 @@ def transaction_on_date(id_col, df) -> pd.Series:
 
     return df_copy["size"].values
 
-def extend_meta(clean_df : pd.DataFrame) -> pd.DataFrame:
-    meta_data = clean_df.copy()
-
-    print("PREPARING TIME META DATA")
-    meta_data["seconds_from_start"] = standardise_time(clean_df["unix_time"])
-    meta_data["hour_of_day"] = pd.to_datetime(clean_df["unix_time"], unit="s").dt.hour
-
-    meta_data["time_since_last_transaction_person"] = time_since_last_transaction("person_id", clean_df[["person_id", "unix_time"]], clean_df)
-    meta_data["time_since_last_transaction_merchant"] = time_since_last_transaction("merchant_id", clean_df[["merchant_id", "unix_time"]], clean_df)
-
-    meta_data["transactions_on_day_person"] = transaction_on_date("person_id", clean_df[["person_id", "unix_time"]])
-
-    print("PREPARING AMOUNT META DATA")
-    meta_data["amount_USD"] = clean_df["amt"].copy()
-    meta_data["amount_GBP"] = prepare_amount(clean_df[["unix_time", "amt"]], "amt", "USD", "GBP")
-
-    meta_data["transaction_by_person"] = transactions_per_entity(clean_df["person_id"])
-    meta_data["transaction_by_merchant"] = transactions_per_entity(clean_df["merchant_id"])
-
-    meta_data["mean_amt_person"] = entity_amount_statistic("person_id", clean_df[["person_id", "amt"]], "mean")
-    meta_data["max_amt_merchant"] = entity_amount_statistic("merchant_id", clean_df[["merchant_id", "amt"]], "max")
-
-    meta_data["mean_amt_merchant_on_day"] = entity_amount_statistic_by_day("merchant_id", clean_df[["merchant_id", "amt", "unix_time"]], "mean")
-    meta_data["max_amt_person_on_day"] = entity_amount_statistic_by_day("person_id", clean_df[["person_id", "amt", "unix_time"]], "mean")
-
-    return meta_data
-
-sets = ["train", "test"]
-
-for set in sets:
-    print(f"EXTENDING SET: {set.upper()}")
-    # Load the data
-    print("Data ", end="", flush=True)
-    loaded_data = pd.read_csv(f"data/synthetic_{set}.csv", index_col=0)
-    print("LOADED")
-
+@traced("extend_meta")
+def extend_meta(clean_df : pd.DataFrame, rates=None, columns=None, n_jobs=None, timings=None) -> pd.DataFrame:
+    """
+    Add the meta feature columns to the clean data, computed through the feature graph (see feature_graph.py)
+       NOTE `transactions_on_day_person`, `mean_amt_merchant_on_day` and `max_amt_person_on_day` differ from files
+       made before the graph: the old index-reset merges returned rows out of order on pandas < 2.2, so regenerate
+       `meta_features_*` files made before it, and retrain models fitted on them. `amount_GBP` matches the files of
+       the forex_python version, but not those written while the local snapshot multiplied by the unrounded daily
+       rate, which need regenerating too
 
-    print("DATA SIZE:", len(loaded_data))
-    clean_df = anonymise_data(loaded_data)
-    meta_data = extend_meta(clean_df)
-    save_data(meta_data, f"data/meta_features_{set}.csv")
+    PARAMETERS
+    clean_df (pd.DataFrame) - output of `anonymise_data`
+    rates (ExchangeRates) - local rate snapshot, loaded from `data/exchange_rates.csv` if not given
+    columns (list of str) - only add these feature columns (any of `FEATURE_COLUMNS` and the sliding-window
+                            `VELOCITY_COLUMNS`), all of `FEATURE_COLUMNS` by default
+    n_jobs (int) - threads running independent features, one per CPU by default
+    timings (dict) - optional, filled with the seconds each graph node took
+    """
+    from feature_graph import compute_features
+
+    print("PREPARING META DATA")
+    features = compute_features(clean_df, columns, None if rates is None else {"rates": rates}, n_jobs, timings)
+    return pd.concat([clean_df, features], axis=1)
+
+if __name__ == "__main__":
+    # refuse to start without a key for the entity IDs, rather than after loading the data
+    hash_key()
+    sets = ["train", "test"]
+    # shared by both sets and kept between runs, so an entity has the same ID everywhere
+    codes = EntityCodes.load("data/entity_codes.npz")
+
+    for set in sets:
+        print(f"EXTENDING SET: {set.upper()}")
+        # "python creation.py --chunked" anonymises the raw CSV in chunks, so only the anonymised columns are ever
+        # loaded whole
+        if "--chunked" in sys.argv:
+            anonymise_data_chunked([f"data/synthetic_{set}.csv"], f"data/cleaned_{set}.csv", codes=codes)
+            clean_df = load_frame(f"data/cleaned_{set}.csv")
+        else:
+            # Load the data
+            print("Data ", end="", flush=True)
+            loaded_data = load_frame(f"data/synthetic_{set}")
+            print("LOADED")
+
+
+            print("DATA SIZE:", len(loaded_data))
+            clean_df = anonymise_data(loaded_data, codes=codes)
+        meta_data = extend_meta(clean_df)
+        save_data(meta_data, f"data/meta_features_{set}")
+
+    codes.save("data/entity_codes.npz")
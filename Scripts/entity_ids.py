@@ -0,0 +1,138 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+# Raw columns identifying each entity. A person is whoever has the same name, job and date of birth
+ENTITIES = {
+    "cc_id": ["cc_num"],
+    "person_id": ["first", "last", "job", "dob"],
+    "merchant_id": ["merchant"],
+}
+
+# Secret the IDs are keyed with. Without it, IDs cannot be recomputed from known names or card numbers. It is required:
+# keep it out of the data directory, and use the same one for every file whose IDs must match
+ID_KEY = os.environ.get("ADS_ID_KEY")
+
+def hash_key(secret=None) -> str:
+    """
+    The 16 character key `pd.util.hash_array` expects, derived from a secret of any length. There is no default key:
+    with a public one (such as pandas' own) anyone could recompute the IDs from card numbers or names and dates of birth
+    """
+    secret = ID_KEY if secret is None else secret
+    if not secret:
+        raise ValueError("No key for the entity IDs, set ADS_ID_KEY to a secret (the IDs can be recomputed from the raw values without one)")
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+def value_strings(uniques) -> np.ndarray:
+    """
+    Distinct values of a column as the strings that get hashed, the same whatever dtype the column was read with:
+    dates as YYYY-MM-DD (the format of the raw dob column), integral floats without the .0 and missing values as ""
+    """
+    uniques = pd.Series(uniques)
+    if pd.api.types.is_datetime64_any_dtype(uniques):
+        strings = uniques.dt.strftime("%Y-%m-%d")
+    elif pd.api.types.is_float_dtype(uniques) and (uniques.dropna() % 1 == 0).all():
+        strings = uniques.astype("Int64").astype(str)
+    else:
+        strings = uniques.astype(str)
+    return strings.where(uniques.notna(), "").to_numpy(dtype=object)
+
+def column_hashes(series, key) -> np.ndarray:
+    """
+    Keyed 64-bit hash (SipHash) of every value of a column. Only the distinct values are turned into strings and
+    hashed, the rows just take their value's hash
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return pd.util.hash_array(value_strings(uniques), hash_key=key, categorize=False)[codes]
+
+def combine_hashes(hashes, column_hashes) -> np.ndarray:
+    """Order-dependent mix of two uint64 hash arrays (boost's hash_combine, widened to 64 bits)"""
+    with np.errstate(over="ignore"):
+        return hashes ^ (column_hashes + np.uint64(0x9E3779B97F4A7C15) + (hashes << np.uint64(6)) + (hashes >> np.uint64(2)))
+
+def entity_hashes(df, columns, secret=None) -> np.ndarray:
+    """
+    64-bit ID of every row's entity, the keyed hash of the values of `columns`. It depends only on the values and the
+    key, so the same entity gets the same ID in every file, batch and run. Two entities share an ID with probability
+    about n^2 / 2^65, under 1e-7 for a million entities
+
+    RETURNS
+    np.ndarray - uint64 hashes, aligned to `df`
+    """
+    key = hash_key(secret)
+    hashes = column_hashes(df[columns[0]], key)
+    for column in columns[1:]:
+        hashes = combine_hashes(hashes, column_hashes(df[column], key))
+    return hashes
+
+class EntityCodes:
+    """
+    Persistent dictionaries from entity hash to a dense code (0, 1, 2, ... in order of first appearance), one per ID
+    column, for when small integer IDs are wanted. Codes never change once given, so IDs stay consistent across
+    files and incremental batches as long as the dictionaries are saved and reloaded between them.
+
+    Each dictionary is the array of hashes in code order, looked up by binary search in a sorted copy.
+    """
+    def __init__(self, hashes=None):
+        self.hashes = {column: np.asarray(values, dtype=np.uint64) for column, values in (hashes or {}).items()}
+        self.sorted = {column: self.sort(values) for column, values in self.hashes.items()}
+
+    @staticmethod
+    def sort(hashes) -> tuple:
+        order = np.argsort(hashes, kind="stable")
+        return hashes[order], order
+
+    @classmethod
+    def load(cls, file_path):
+        """Dictionaries saved by `save`, or empty ones if the file does not exist yet"""
+        if not os.path.exists(file_path):
+            return cls()
+        with np.load(file_path) as saved:
+            return cls({column: saved[column] for column in saved.files})
+
+    def save(self, file_path):
+        """Written to a temporary file first, so an interrupted save leaves the previous dictionaries in place"""
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{file_path}.tmp", "wb") as codes_file:
+            np.savez(codes_file, **self.hashes)
+        os.replace(f"{file_path}.tmp", file_path)
+
+    def encode(self, column, hashes) -> np.ndarray:
+        """Dense codes of entity hashes, giving the next free codes to unseen entities"""
+        known = self.hashes.get(column, np.empty(0, dtype=np.uint64))
+        sorted_hashes, order = self.sorted.get(column, (known, np.empty(0, dtype=np.int64)))
+
+        inverse, uniques = pd.factorize(hashes)
+        uniques = np.asarray(uniques, dtype=np.uint64)
+        positions = np.searchsorted(sorted_hashes, uniques)
+        found = positions < len(sorted_hashes)
+        found[found] = sorted_hashes[positions[found]] == uniques[found]
+
+        codes = np.empty(len(uniques), dtype=np.int64)
+        codes[found] = order[positions[found]]
+        codes[~found] = len(known) + np.arange((~found).sum())
+        if not found.all():
+            self.hashes[column] = np.concatenate([known, uniques[~found]])
+            self.sorted[column] = self.sort(self.hashes[column])
+        return codes[inverse]
+
+def entity_id(df, column, codes=None, secret=None) -> np.ndarray:
+    """
+    One of the `ENTITIES` ID columns (cc_id, person_id, merchant_id) of raw transactions
+
+    PARAMETERS
+    df (pd.DataFrame) - raw transactions with the columns identifying the entity
+    column (str) - ID column to make
+    codes (EntityCodes) - dictionaries to encode the hashes with, updated in place. Without them the IDs are the
+                          hashes themselves (as int64)
+    secret (str) - key of the hashes, `ADS_ID_KEY` by default. One of them is required
+    """
+    hashes = entity_hashes(df, ENTITIES[column], secret)
+    return hashes.view(np.int64) if codes is None else codes.encode(column, hashes)
+
+def entity_ids(df, codes=None, secret=None) -> pd.DataFrame:
+    """All the `ENTITIES` ID columns of raw transactions, see `entity_id`"""
+    return pd.DataFrame({column: entity_id(df, column, codes, secret) for column in ENTITIES}, index=df.index)
@@ -0,0 +1,170 @@
+import argparse
+import glob
+import os
+import numpy as np
+import pandas as pd
+
+from storage import load_frame, save_frame
+
+# Weighting of imblearn's index balanced accuracy, as in `classification_report_imbalanced`
+IBA_ALPHA = 0.1
+
+def combination_name(file_path) -> tuple:
+    """`extra_trees_on_SMOTE_samples.csv` -> (`extra_trees`, `SMOTE`), the names the pipeline notebook writes"""
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    classifier, _, sampler = name.partition("_on_")
+    return classifier, sampler[:-len("_samples")] if sampler.endswith("_samples") else sampler
+
+def load_prediction_csvs(file_paths, test, label="is_fraud") -> pd.DataFrame:
+    """
+    Read the prediction CSVs written by ads_model_pipeline.ipynb (true label `is_fraud`, prediction `is_fraud.1`,
+    indexed like the test set) into one int8 frame aligned to `test`, with a (classifier, sampler) column per file
+
+    PARAMETERS
+    file_paths (list of str) - prediction CSVs
+    test (pd.DataFrame) - the test meta features the predictions were made for
+    """
+    columns = {}
+    for file_path in file_paths:
+        predictions = pd.read_csv(file_path, index_col=0, usecols=[0, 1, 2]).reindex(test.index)
+        if predictions.isna().any().any() or not np.array_equal(predictions[label].to_numpy(), test[label].to_numpy()):
+            raise ValueError(f"{file_path} is not aligned to the test set")
+        columns[combination_name(file_path)] = predictions[f"{label}.1"].to_numpy(dtype=np.int8)
+
+    predictions = pd.DataFrame(columns, index=test.index)
+    predictions.columns = pd.MultiIndex.from_tuples(predictions.columns, names=["classifier", "sampler"])
+    return predictions
+
+def load_grid_predictions(results, test_dir) -> pd.DataFrame:
+    """
+    The predictions saved by `experiments.run_cell` for every row of the experiments results table, in the same layout
+    as `load_prediction_csvs`. Rows without saved predictions (run before they were kept) are skipped.
+
+    PARAMETERS
+    results (pd.DataFrame) - results table written by `experiments.run_grid`
+    test_dir (str) - experiment cache entry of the test set
+    """
+    from experiments import prediction_path
+
+    columns = {}
+    for row in results.itertuples():
+        path = prediction_path(test_dir, row.train_key, row.classifier)
+        if row.test_key == os.path.basename(test_dir) and os.path.exists(path):
+            columns[(row.classifier, row.dataset)] = np.load(path)
+
+    predictions = pd.DataFrame(columns)
+    predictions.columns = pd.MultiIndex.from_tuples(predictions.columns, names=["classifier", "sampler"])
+    return predictions
+
+def ratio(numerator, denominator) -> np.ndarray:
+    """Elementwise division that gives 0 where the denominator is 0, as sklearn and imblearn do"""
+    numerator, denominator = np.asarray(numerator, dtype=np.float64), np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+def class_metrics(tp, fp, fn, tn) -> dict:
+    """imblearn's per-class report values, for the class whose true positives are `tp`"""
+    precision = ratio(tp, tp + fp)
+    recall = ratio(tp, tp + fn)
+    specificity = ratio(tn, tn + fp)
+    geometric_mean = np.sqrt(recall * specificity)
+    return {
+        "precision": precision,
+        "recall": recall,
+        "specificity": specificity,
+        "f1": ratio(2 * precision * recall, precision + recall),
+        "geometric_mean": geometric_mean,
+        "iba": (1 + IBA_ALPHA * (recall - specificity)) * geometric_mean ** 2,
+    }
+
+def evaluate(y_true, amt, predictions, block_size=65536) -> pd.DataFrame:
+    """
+    Confusion matrix, fraud losses and savings, and the imbalanced-classification metrics of every prediction column,
+    from one pass over the prediction matrix.
+
+    The counts and amounts of all columns are matrix products of four weight vectors (fraud, legitimate, fraud amount,
+    legitimate amount) with the predicted labels, accumulated over blocks of rows so only one block is ever converted
+    to floats.
+
+    PARAMETERS
+    y_true (array-like) - true labels of the test set, 1 for fraud
+    amt (array-like) - transaction amounts of the test set
+    predictions (pd.DataFrame) - one column of predicted labels per classifier and sampler, aligned to `y_true`
+    block_size (int) - rows per block
+
+    RETURNS
+    pd.DataFrame - one row per prediction column:
+        tn, fp, fn, tp
+        fraud_loss - amount of the fraud the classifier missed (false negatives)
+        fraud_loss_without_classifier - amount of all fraud in the test set
+        savings - fraud amount the classifier caught
+        investigated_amount - amount of the legitimate transactions flagged as fraud (false positives)
+        financial_loss - (avg cost: missed fraud)*(FN) + (avg cost: investigating fraud)*(FP), the notebook's
+                         general loss, 0 rather than NaN when there are no false negatives or positives
+        accuracy, balanced_accuracy, mcc
+        precision, recall, specificity, f1, geometric_mean, iba - for the fraud class
+        weighted_* - the same, averaged over both classes weighted by support (imblearn's avg / total)
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    amt = np.asarray(amt, dtype=np.float64)
+    if len(predictions) != len(y_true):
+        raise ValueError(f"{len(predictions)} predictions for {len(y_true)} test transactions")
+    values = predictions.to_numpy()
+
+    weights = np.stack([y_true, ~y_true, amt * y_true, amt * ~y_true]).astype(np.float64)
+    # flagged fraud, flagged legitimate, caught fraud amount, flagged legitimate amount, per column
+    totals = np.zeros((4, values.shape[1]))
+    for start in range(0, len(values), block_size):
+        totals += weights[:, start:start + block_size] @ values[start:start + block_size].astype(np.float64)
+
+    positives, negatives = y_true.sum(), (~y_true).sum()
+    tp, fp = totals[0], totals[1]
+    fn, tn = positives - tp, negatives - fp
+    fraud_amount = amt[y_true].sum()
+    caught_amount, investigated_amount = totals[2], totals[3]
+
+    summary = pd.DataFrame({"tn": tn, "fp": fp, "fn": fn, "tp": tp}, index=predictions.columns).astype(np.int64)
+    summary["fraud_loss"] = fraud_amount - caught_amount
+    summary["fraud_loss_without_classifier"] = fraud_amount
+    summary["savings"] = caught_amount
+    summary["investigated_amount"] = investigated_amount
+    summary["financial_loss"] = summary["fraud_loss"] + investigated_amount
+
+    fraud = class_metrics(tp, fp, fn, tn)
+    legitimate = class_metrics(tn, fn, fp, tp)
+    summary["accuracy"] = ratio(tp + tn, len(y_true))
+    summary["balanced_accuracy"] = (fraud["recall"] + legitimate["recall"]) / 2
+    summary["mcc"] = ratio(tp * tn - fp * fn, np.sqrt((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn)))
+    for metric in fraud:
+        summary[metric] = fraud[metric]
+    for metric in fraud:
+        summary[f"weighted_{metric}"] = (fraud[metric] * positives + legitimate[metric] * negatives) / len(y_true)
+    return summary
+
+if __name__ == "__main__":
+    # e.g. "python evaluation.py --predictions 'results/*_on_*_samples.csv'" for the notebook's prediction CSVs
+    # or   "python evaluation.py --grid data/experiment_results.parquet" for the cells run by experiments.py
+    parser = argparse.ArgumentParser(description="Summarise the financial and classification metrics of every classifier and sampler")
+    parser.add_argument("--test", default="data/meta_features_test")
+    parser.add_argument("--predictions", default=None, help="glob of prediction CSVs written by the pipeline notebook")
+    parser.add_argument("--grid", default=None, help="results table of experiments.py")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--out", default="data/evaluation_summary")
+    args = parser.parse_args()
+
+    print("Data ", end="", flush=True)
+    test = load_frame(args.test)
+    print("LOADED")
+
+    if args.grid:
+        from experiments import CACHE_DIR, file_key
+        predictions = load_grid_predictions(load_frame(args.grid), os.path.join(args.cache_dir or CACHE_DIR, file_key(args.test)))
+    else:
+        file_paths = sorted(glob.glob(args.predictions or "*_on_*_samples.csv"))
+        if not file_paths:
+            parser.error("no prediction files found")
+        predictions = load_prediction_csvs(file_paths, test)
+
+    summary = evaluate(test["is_fraud"], test["amt"], predictions)
+    print(save_frame(summary.reset_index(), args.out, compact=False))
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(summary[["tn", "fp", "fn", "tp", "fraud_loss", "savings", "recall", "precision", "geometric_mean", "iba"]])
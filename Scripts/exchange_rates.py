@@ -0,0 +1,135 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+SECONDS_PER_DAY = 86400
+
+def round_cents(values) -> np.ndarray:
+    """
+    Values rounded to 2 decimal places as Python's `round` rounds a float, on its exact value. `np.round` scales by 100
+    first, which can tip a value next to a half cent the other way, so those few are redone with `round`
+    """
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    rounded[near_half] = [round(float(value), 2) for value in values[near_half]]
+    return rounded
+
+class ExchangeRates:
+    """
+    Local table of daily exchange rates, so currency conversion needs no network access and is deterministic.
+
+    The snapshot holds one row per date and one column per currency, each value being the units of that currency
+    per one unit of a common base currency. Any pair is then a ratio of two columns. Dates missing from the snapshot
+    (weekends, holidays) and dates after its end use the most recent earlier rate, as the forex_python service does.
+
+    PARAMETERS
+    table (pd.DataFrame) - rates indexed by date with one column per three character currency code
+    """
+    def __init__(self, table : pd.DataFrame):
+        table = table.sort_index()
+        self.first_day = pd.Timestamp(table.index[0]).value // (SECONDS_PER_DAY * 10**9)
+        days = pd.date_range(table.index[0], table.index[-1], freq="D")
+        self.table = table.set_axis(pd.to_datetime(table.index)).reindex(days).ffill()
+        self.pair_rates = lru_cache(maxsize=64)(self.pair_rates)
+        self.rate = lru_cache(maxsize=4096)(self.rate)
+
+    @classmethod
+    def load(cls, file_path="data/exchange_rates.csv"):
+        """Read a snapshot written by `save` from CSV or Parquet"""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"No exchange rate snapshot at {file_path}. Build it once (it needs network access) "
+                                    f"with \"python exchange_rates.py --out {file_path}\" from the Scripts directory")
+        if str(file_path).endswith(".parquet"):
+            table = pd.read_parquet(file_path)
+        else:
+            table = pd.read_csv(file_path, index_col=0, parse_dates=True, float_precision="round_trip")
+        return cls(table)
+
+    def save(self, file_path):
+        if str(file_path).endswith(".parquet"):
+            self.table.to_parquet(file_path)
+        else:
+            self.table.to_csv(file_path)
+
+    def pair_rates(self, cur_currency : str, tar_currency : str) -> np.ndarray:
+        """Rate from `cur_currency` to `tar_currency` for every day covered by the table, as a float array"""
+        if cur_currency == tar_currency:
+            return np.ones(len(self.table))
+        return (self.table[tar_currency] / self.table[cur_currency]).to_numpy()
+
+    def day_positions(self, days : np.ndarray) -> np.ndarray:
+        """Row positions in the daily table for an array of days since the epoch"""
+        positions = np.asarray(days, dtype=np.int64) - self.first_day
+        if len(positions) > 0 and positions.min() < 0:
+            raise ValueError("Exchange rate snapshot starts after the earliest transaction date")
+        return np.minimum(positions, len(self.table) - 1)
+
+    def rate(self, when : date, cur_currency : str, tar_currency : str) -> float:
+        """Rate on a single date, for scoring one transaction at a time"""
+        day = (when - date(1970, 1, 1)).days
+        return float(self.pair_rates(cur_currency, tar_currency)[self.day_positions([day])[0]])
+
+    def convert(self, amounts, unix_time, cur_currency : str, tar_currency : str) -> np.ndarray:
+        """
+        Convert amounts using the rate for the day (UTC) of each timestamp. The rate is rounded to 2 decimal places
+        before multiplying, as `prepare_amount` has always taken it from `convert_currency(1, ...)`
+
+        PARAMETERS
+        amounts (array-like) - amounts of the current currency
+        unix_time (array-like) - transaction times in seconds since the epoch
+        cur_currency (str) - three character code for current currency
+        tar_currency (str) - three character code for target currency
+
+        RETURNS
+        np.ndarray - amounts of target currency, rounded to 2 decimal places
+        """
+        days = np.asarray(unix_time, dtype=np.int64) // SECONDS_PER_DAY
+        # Python's round for both, as convert_currency rounded the rate and prepare_amount each product of floats
+        rates = round_cents(self.pair_rates(cur_currency, tar_currency))[self.day_positions(days)]
+        return round_cents(np.asarray(amounts, dtype=float) * rates)
+
+def build_snapshot(start : date, end : date, currencies, base="EUR", file_path="data/exchange_rates.csv") -> ExchangeRates:
+    """
+    Download daily rates once with forex_python and write them as a snapshot for `ExchangeRates.load`.
+    This is the only function that needs network access.
+    """
+    import forex_python.converter as fx
+
+    rates = fx.CurrencyRates()
+    table = {}
+    day = start
+    while day <= end:
+        when = datetime(day.year, day.month, day.day)
+        table[day] = {currency: (1.0 if currency == base else rates.get_rate(base, currency, when)) for currency in currencies}
+        day += timedelta(days=1)
+
+    store = ExchangeRates(pd.DataFrame.from_dict(table, orient="index"))
+    store.save(file_path)
+    return store
+
+def data_date_range(file_paths) -> tuple:
+    """First and last day (UTC, as `convert` uses) of the transactions in raw CSVs, reading only their unix_time"""
+    days = [pd.read_csv(file_path, usecols=["unix_time"])["unix_time"] // SECONDS_PER_DAY for file_path in file_paths]
+    first, last = min(int(d.min()) for d in days), max(int(d.max()) for d in days)
+    return date(1970, 1, 1) + timedelta(days=first), date(1970, 1, 1) + timedelta(days=last)
+
+if __name__ == "__main__":
+    # e.g. "python exchange_rates.py" to snapshot USD and GBP over the dates of the raw train and test data
+    parser = argparse.ArgumentParser(description="Download the daily exchange rates the transactions need, once")
+    parser.add_argument("data", nargs="*", default=["data/synthetic_train.csv", "data/synthetic_test.csv"],
+                        help="raw transaction CSVs whose dates the snapshot must cover")
+    parser.add_argument("--currencies", nargs="*", default=["USD", "GBP"])
+    parser.add_argument("--base", default="EUR")
+    parser.add_argument("--out", default="data/exchange_rates.csv")
+    args = parser.parse_args()
+
+    start, end = data_date_range(args.data)
+    print(f"Rates from {start} to {end} ", end="", flush=True)
+    build_snapshot(start, end, args.currencies, args.base, args.out)
+    print(f"SAVED to {args.out}")
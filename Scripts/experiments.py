@@ -0,0 +1,261 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+
+from time import perf_counter
+from storage import load_frame, resolve_path, save_frame
+
+# Directory holding one sub-directory of preprocessed arrays per input file, named by the hash of the file
+CACHE_DIR = os.environ.get("ADS_EXPERIMENT_CACHE", "data/experiment_cache")
+
+# Classifiers of the ads_model_pipeline grid. The keras models stay in the notebook, they need tensorflow and the
+# pre-trained .h5 files
+CLASSIFIERS = ["logistic_regression", "random_forest", "extra_trees"]
+
+# A cached entry is only reused if it was written with this preprocessing, bump it when `preprocess` changes
+PREPROCESSING_VERSION = 2
+
+def make_classifier(name):
+    """A new, unfitted classifier for one of `CLASSIFIERS`, single-threaded as the grid runs one per process"""
+    from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+
+    if name == "logistic_regression": return LogisticRegression()
+    if name == "random_forest": return RandomForestClassifier(random_state=0, n_jobs=1)
+    if name == "extra_trees": return ExtraTreesClassifier(random_state=0, n_jobs=1)
+    raise ValueError(f"Unknown classifier {name}, expected any of {CLASSIFIERS}")
+
+def file_key(file_path) -> str:
+    """Hash of the contents of a data file and of `PREPROCESSING_VERSION`, read in blocks"""
+    digest = hashlib.sha1(str(PREPROCESSING_VERSION).encode())
+    with open(resolve_path(file_path), "rb") as data_file:
+        for block in iter(lambda: data_file.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def dataset_name(file_path) -> str:
+    """`data/SMOTE_samples.parquet` -> `SMOTE`"""
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return name[:-len("_samples")] if name.endswith("_samples") else name
+
+#########################---Preprocessing--################
+
+def preprocess(df, label="is_fraud") -> tuple:
+    """
+    Standard-scale the numeric features and label-encode the others, as the notebook does. Each frame is scaled and
+    encoded on its own, the test set included, so results stay comparable with the earlier runs.
+
+    RETURNS
+    pd.DataFrame, np.ndarray - features (numeric first) and labels
+    """
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    numeric = df.select_dtypes(include=[np.number]).drop(columns=[label])
+    scaled = pd.DataFrame(StandardScaler().fit_transform(numeric), index=df.index, columns=numeric.columns)
+    categoric = df.select_dtypes(exclude=[np.number])
+    # apply on a frame without columns returns an empty Series, which concat would add as a column of NaN
+    if len(categoric.columns):
+        categoric = categoric.apply(lambda column: LabelEncoder().fit_transform(column))
+    return pd.concat([scaled, categoric], axis=1), df[label].to_numpy()
+
+def feature_importances(X, y) -> pd.DataFrame:
+    """
+    RandomForest and ExtraTrees importances of every feature, ordered like the notebook's merged table (by the
+    forest's value, then the extra trees'), so the first rows are the selected features
+    """
+    from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+
+    forest = RandomForestClassifier(random_state=0, n_jobs=1).fit(X, y)
+    extra_trees = ExtraTreesClassifier(random_state=0, n_jobs=1).fit(X, y)
+    importances = pd.DataFrame({"feature": X.columns, "random_forest": forest.feature_importances_,
+                                "extra_trees": extra_trees.feature_importances_})
+    return importances.sort_values(["random_forest", "extra_trees"], ascending=False, ignore_index=True)
+
+def prepare(task) -> str:
+    """
+    Preprocess one data file into `<cache_dir>/<file_key>/`: X.npy, y.npy, columns.json, the raw `amt` column and,
+    for training sets, importances.parquet. meta.json is written last, so an interrupted entry is never read.
+
+    RETURNS
+    str - the cache directory of the file
+    """
+    file_path, cache_dir, label, importances = task
+    directory = os.path.join(cache_dir, file_key(file_path))
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        return directory
+
+    os.makedirs(directory, exist_ok=True)
+    df = load_frame(file_path)
+    X, y = preprocess(df, label)
+    np.save(os.path.join(directory, "X.npy"), X.to_numpy(dtype=np.float64))
+    np.save(os.path.join(directory, "y.npy"), y)
+    np.save(os.path.join(directory, "amt.npy"), df["amt"].to_numpy(dtype=np.float64))
+    with open(os.path.join(directory, "columns.json"), "w") as columns_file:
+        json.dump(list(X.columns), columns_file)
+    if importances:
+        save_frame(feature_importances(X, y), os.path.join(directory, "importances.parquet"), compact=False)
+
+    with open(os.path.join(directory, "meta.json"), "w") as meta_file:
+        json.dump({"file": str(file_path), "rows": len(X), "features": X.shape[1]}, meta_file)
+    return directory
+
+def load_prepared(directory, features=None) -> tuple:
+    """Memory-mapped features (only the named columns if given), labels and raw amounts of a cache entry"""
+    with open(os.path.join(directory, "columns.json")) as columns_file:
+        columns = json.load(columns_file)
+    X = np.load(os.path.join(directory, "X.npy"), mmap_mode="r")
+    if features is not None:
+        X = X[:, [columns.index(feature) for feature in features]]
+    return X, np.load(os.path.join(directory, "y.npy")), np.load(os.path.join(directory, "amt.npy"))
+
+def selected_features(directory, n_features) -> list:
+    return load_frame(os.path.join(directory, "importances.parquet"))["feature"].head(n_features).tolist()
+
+def prediction_path(test_dir, train_key, classifier) -> str:
+    """Where a cell's test set predictions are kept, next to the test set they are aligned to"""
+    return os.path.join(test_dir, "predictions", f"{train_key}.{classifier}.npy")
+
+#########################---Cells--################
+
+def run_cell(task) -> dict:
+    """
+    Fit one classifier on one resampled training set (top features only) and score it on the test set. The predicted
+    labels are saved at `prediction_path` for `evaluation.py`. Runs in a fresh worker process so the peak RSS it reports
+    belongs to this cell alone.
+
+    RETURNS
+    dict - one row of the results table
+    """
+    import resource
+    from sklearn.metrics import accuracy_score, confusion_matrix, f1_score, precision_score, recall_score, roc_auc_score
+
+    dataset, classifier, train_dir, test_dir, n_features = task
+    features = selected_features(train_dir, n_features)
+    X_train, y_train, _ = load_prepared(train_dir, features)
+    X_test, y_test, amt_test = load_prepared(test_dir, features)
+
+    start = perf_counter()
+    model = make_classifier(classifier).fit(X_train, y_train)
+    y_pred = model.predict(X_test)
+    elapsed = perf_counter() - start
+
+    os.makedirs(os.path.join(test_dir, "predictions"), exist_ok=True)
+    np.save(prediction_path(test_dir, os.path.basename(train_dir), classifier), y_pred.astype(np.int8))
+
+    tn, fp, fn, tp = confusion_matrix(y_test, y_pred, labels=[0, 1]).ravel()
+    scores = model.predict_proba(X_test)[:, 1] if hasattr(model, "predict_proba") else y_pred
+    return {
+        "dataset": dataset, "classifier": classifier,
+        "train_key": os.path.basename(train_dir), "test_key": os.path.basename(test_dir),
+        "features": ",".join(features), "train_rows": len(y_train),
+        "accuracy": accuracy_score(y_test, y_pred),
+        "precision": precision_score(y_test, y_pred, zero_division=0),
+        "recall": recall_score(y_test, y_pred, zero_division=0),
+        "f1": f1_score(y_test, y_pred, zero_division=0),
+        "roc_auc": roc_auc_score(y_test, scores) if len(np.unique(y_test)) > 1 else np.nan,
+        "tn": int(tn), "fp": int(fp), "fn": int(fn), "tp": int(tp),
+        # amount of the fraudulent test transactions the classifier let through
+        "financial_loss": float(amt_test[(y_test == 1) & (y_pred == 0)].sum()),
+        "seconds": elapsed, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def load_results(results_path) -> pd.DataFrame:
+    if os.path.exists(results_path):
+        return load_frame(results_path)
+    return pd.DataFrame(columns=["dataset", "classifier", "train_key", "test_key"])
+
+def write_results(results, results_path) -> str:
+    """Replace the results table in one rename, so an interrupted write leaves the previous table intact"""
+    stem, extension = os.path.splitext(results_path)
+    written = save_frame(results.reset_index(drop=True), f"{stem}.tmp{extension}", compact=False)
+    os.replace(written, results_path)
+    return results_path
+
+def run_grid(datasets, test_path, classifiers=CLASSIFIERS, results_path="data/experiment_results.parquet", cache_dir=None,
+             n_features=10, n_jobs=None, label="is_fraud", printing=True) -> pd.DataFrame:
+    """
+    Train and score every classifier on every resampled training set, one process-pool task per cell.
+
+    Preprocessed matrices and feature importances are cached per input file under `cache_dir`, keyed by the hash of
+    its contents, so they are computed once across cells and runs. Results are appended to one table after every
+    cell. Cells already in the table for the same training and test files are skipped, so an interrupted run picks up
+    where it stopped, and a changed input file only reruns its own cells.
+
+    PARAMETERS
+    datasets (list of str) - resampled training sets, e.g. data/SMOTE_samples
+    test_path (str) - test meta features
+    classifiers (list of str) - names from `CLASSIFIERS`
+    results_path (str) - results table, one row per (dataset, classifier)
+    cache_dir (str) - cache directory, `CACHE_DIR` by default
+    n_features (int) - number of top-importance features the classifiers are trained on
+    n_jobs (int) - number of cells run at once, defaults to one per CPU
+    label (str) - label column
+
+    RETURNS
+    pd.DataFrame - the results table
+    """
+    unknown = set(classifiers) - set(CLASSIFIERS)
+    if unknown:
+        raise ValueError(f"Unknown classifiers {sorted(unknown)}, expected any of {CLASSIFIERS}")
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+
+    context = mp.get_context("spawn")
+    n_jobs = n_jobs or os.cpu_count()
+
+    if (printing): print("Preprocessing ",end="",flush=True)
+    tasks = [(test_path, cache_dir, label, False)] + [(path, cache_dir, label, True) for path in datasets]
+    with context.Pool(processes=min(n_jobs, len(tasks))) as pool:
+        test_dir, *train_dirs = pool.map(prepare, tasks)
+    if (printing): print("DONE")
+
+    # drop rows computed from other versions of the input files, keep the rest as done
+    results = load_results(results_path)
+    test_key = os.path.basename(test_dir)
+    current = {(dataset_name(path), os.path.basename(directory)) for path, directory in zip(datasets, train_dirs)}
+    fresh = [(dataset, train_key) in current and key == test_key
+             for dataset, train_key, key in zip(results["dataset"], results["train_key"], results["test_key"])]
+    results = results.loc[np.array(fresh, dtype=bool)]
+    done = set(zip(results["dataset"], results["classifier"]))
+
+    cells = [(dataset_name(path), classifier, directory, test_dir, n_features)
+             for path, directory in zip(datasets, train_dirs) for classifier in classifiers
+             if (dataset_name(path), classifier) not in done]
+    if (printing): print(f"{len(results)} cells done, {len(cells)} to run")
+
+    if cells:
+        # one cell per worker process, so each cell's peak memory is measured on its own
+        with context.Pool(processes=min(n_jobs, len(cells)), maxtasksperchild=1) as pool:
+            rows = results.to_dict("records")
+            for row in pool.imap_unordered(run_cell, cells):
+                rows.append(row)
+                results = pd.DataFrame(rows)
+                write_results(results, results_path)
+                if (printing): print(f"{row['dataset']:<16} {row['classifier']:<20} f1 {row['f1']:.3f}  recall {row['recall']:.3f}  {row['seconds']:>7.1f}s")
+
+    return results.sort_values(["dataset", "classifier"], ignore_index=True)
+
+if __name__ == "__main__":
+    # e.g. "python experiments.py --test data/meta_features_test", every data/*_samples file by default
+    parser = argparse.ArgumentParser(description="Train and score each classifier on each resampled training set")
+    parser.add_argument("datasets", nargs="*", help="resampled training sets, data/*_samples by default")
+    parser.add_argument("--test", default="data/meta_features_test")
+    parser.add_argument("--classifiers", nargs="*", default=CLASSIFIERS, help=f"any of {', '.join(CLASSIFIERS)}")
+    parser.add_argument("--results", default="data/experiment_results.parquet")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--features", type=int, default=10)
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    datasets = args.datasets or sorted({os.path.splitext(path)[0] for path in glob.glob("data/*_samples.*")})
+    if not datasets:
+        parser.error("no resampled training sets given or found in data/")
+    results = run_grid(datasets, args.test, args.classifiers, args.results, args.cache_dir, args.features, args.jobs)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(results.drop(columns=["train_key", "test_key", "features"]))
@@ -0,0 +1,319 @@
+import os
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from instrument import record
+from time import perf_counter, thread_time
+
+SECONDS_PER_DAY = 86400
+
+ID_COLS = ["person_id", "merchant_id"]
+
+# Entities with velocity features, and their trailing windows by the name used in the column names
+VELOCITY_ENTITIES = ["cc_id", "person_id", "merchant_id"]
+VELOCITY_WINDOWS = {"1h": 3600, "24h": 86400, "7d": 7 * 86400}
+
+class Node:
+    """
+    One step of the feature graph: `function(clean_df, *values of inputs)`. Feature nodes return a dict of the
+    `outputs` columns, intermediates (no outputs) return a value other nodes take as input
+
+    PARAMETERS
+    name (str) - unique name, what other nodes list as an input
+    function (callable) - computes the node
+    inputs (list of str) - nodes whose values are passed to `function`, in order
+    outputs (list of str) - feature columns produced
+    """
+    def __init__(self, name, function, inputs=(), outputs=()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+# Every node by name, in registration order, which is also the order of the feature columns
+NODES = {}
+
+def node(name, inputs=(), outputs=()):
+    """Register the decorated function as a node of the graph"""
+    def register(function):
+        NODES[name] = Node(name, function, inputs, outputs)
+        return function
+    return register
+
+#########################---Intermediates--################
+
+@node("time")
+def parsed_time(df) -> pd.Series:
+    return pd.to_datetime(df["unix_time"], unit="s")
+
+@node("day")
+def day_key(df) -> np.ndarray:
+    """Days since the epoch (UTC), the same days as `.dt.date` of the parsed time"""
+    return df["unix_time"].to_numpy(dtype=np.int64) // SECONDS_PER_DAY
+
+@node("rates")
+def load_rates(df):
+    from exchange_rates import ExchangeRates
+    return ExchangeRates.load()
+
+def group_codes(keys) -> tuple:
+    codes, uniques = pd.factorize(keys)
+    return codes, len(uniques)
+
+def register_entity_nodes(id_col):
+    """Group codes of each entity and of each (entity, day), and the rows sorted by (entity, time)"""
+    node(f"codes/{id_col}")(lambda df: group_codes(df[id_col].to_numpy()))
+
+    @node(f"codes/{id_col}/day", inputs=[f"codes/{id_col}", "day"])
+    def entity_day_codes(df, entity, day):
+        codes, _ = entity
+        return group_codes(codes * (day.max() - day.min() + 1) + (day - day.min()) if len(day) else codes)
+
+    @node(f"order/{id_col}", inputs=[f"codes/{id_col}"])
+    def entity_order(df, entity):
+        # lexsort is stable, so ties keep their row order
+        return np.lexsort((df["unix_time"].to_numpy(), entity[0]))
+
+for id_col in VELOCITY_ENTITIES:
+    register_entity_nodes(id_col)
+
+def per_row_count(group) -> np.ndarray:
+    codes, n_groups = group
+    return np.bincount(codes, minlength=n_groups)[codes]
+
+def per_row_statistic(df, group, agg_calc) -> np.ndarray:
+    """`agg_calc` of `amt` over each row's group, computed by the same groupby reduction as creation.py"""
+    return df["amt"].groupby(group[0]).transform(agg_calc).to_numpy()
+
+#########################---Features--################
+
+@node("seconds_from_start", outputs=["seconds_from_start"])
+def seconds_from_start(df) -> dict:
+    from creation import standardise_time
+    return {"seconds_from_start": standardise_time(df["unix_time"]).to_numpy()}
+
+@node("hour_of_day", inputs=["time"], outputs=["hour_of_day"])
+def hour_of_day(df, time) -> dict:
+    return {"hour_of_day": time.dt.hour.to_numpy()}
+
+def register_time_since_last(id_col):
+    column = f"time_since_last_transaction_{id_col.replace('_id', '')}"
+
+    @node(column, inputs=[f"codes/{id_col}", f"order/{id_col}"], outputs=[column])
+    def time_since_last(df, entity, order):
+        """Difference consecutive times in (entity, time) order, -1 for the first transaction of every entity"""
+        from creation import time_since_previous
+        deltas = time_since_previous(entity[0][order], df["unix_time"].to_numpy()[order])
+        unsorted = np.empty_like(deltas)
+        unsorted[order] = deltas
+        return {column: unsorted}
+
+for id_col in ID_COLS:
+    register_time_since_last(id_col)
+
+@node("transactions_on_day_person", inputs=["codes/person_id/day"], outputs=["transactions_on_day_person"])
+def transactions_on_day_person(df, person_day) -> dict:
+    return {"transactions_on_day_person": per_row_count(person_day)}
+
+@node("amount", inputs=["rates"], outputs=["amount_USD", "amount_GBP"])
+def amount(df, rates) -> dict:
+    """USD amount and its GBP value at the rate of the transaction's day, converted by `prepare_amount`'s conversion"""
+    amt = df["amt"].to_numpy()
+    return {"amount_USD": amt.copy(), "amount_GBP": rates.convert(amt, df["unix_time"].to_numpy(), "USD", "GBP")}
+
+@node("transaction_by_entity", inputs=["codes/person_id", "codes/merchant_id"],
+      outputs=["transaction_by_person", "transaction_by_merchant"])
+def transaction_by_entity(df, person, merchant) -> dict:
+    return {"transaction_by_person": per_row_count(person), "transaction_by_merchant": per_row_count(merchant)}
+
+@node("entity_amount", inputs=["codes/person_id", "codes/merchant_id"], outputs=["mean_amt_person", "max_amt_merchant"])
+def entity_amount(df, person, merchant) -> dict:
+    return {"mean_amt_person": per_row_statistic(df, person, "mean"),
+            "max_amt_merchant": per_row_statistic(df, merchant, "max")}
+
+@node("entity_amount_on_day", inputs=["codes/merchant_id/day", "codes/person_id/day"],
+      outputs=["mean_amt_merchant_on_day", "max_amt_person_on_day"])
+def entity_amount_on_day(df, merchant_day, person_day) -> dict:
+    # max_amt_person_on_day has always been the mean, kept so existing models see the same feature
+    return {"mean_amt_merchant_on_day": per_row_statistic(df, merchant_day, "mean"),
+            "max_amt_person_on_day": per_row_statistic(df, person_day, "mean")}
+
+# Every feature column, in the order extend_meta has always written them
+FEATURE_COLUMNS = [column for graph_node in NODES.values() for column in graph_node.outputs]
+
+#########################---Velocity--################
+# Count, amount sum, amount max and number of distinct merchants of each entity's transactions in a trailing window
+# (t - window, t], the transaction itself included. Transactions at the same time count in row order, so every row
+# sees the ones before it, as when they arrive one by one (see `VelocityStore` in feature_store.py). Not part of
+# `FEATURE_COLUMNS`, ask for `VELOCITY_COLUMNS` to add them.
+
+def velocity_columns(id_col, window) -> list:
+    entity = id_col.replace("_id", "")
+    columns = [f"velocity_count_{entity}_{window}", f"velocity_amt_sum_{entity}_{window}", f"velocity_amt_max_{entity}_{window}"]
+    # every merchant window holds a single merchant
+    if id_col != "merchant_id":
+        columns.append(f"velocity_merchants_{entity}_{window}")
+    return columns
+
+def window_starts(entity_codes, times, seconds) -> np.ndarray:
+    """
+    Position of the first transaction of the window ending at each row, for rows sorted by (entity, time). Entity and
+    time are packed into one sorted key, spaced so no window reaches into the previous entity, and all the window
+    starts are found with one binary search of the shifted keys
+    """
+    if len(times) == 0:
+        return np.empty(0, dtype=np.int64)
+    relative = times - times.min()
+    keys = entity_codes.astype(np.int64) * (int(relative.max()) + seconds + 1) + relative
+    return np.searchsorted(keys, keys - seconds, side="right")
+
+def window_max(values, starts) -> np.ndarray:
+    """
+    Maximum of values[starts[i]:i + 1] for every i. The maxima of runs of 2^k values are built one level at a time
+    (a sparse table keeping only its current level), and each window is covered by two overlapping runs of the largest
+    2^k that fits in it, so the cost is n log2 of the longest window
+    """
+    ends = np.arange(len(values))
+    levels = np.log2(ends - starts + 1).astype(np.int64)
+    maxima = np.empty_like(values)
+    level = values.copy()
+    for k in range(int(levels.max()) + 1 if len(values) else 0):
+        rows = np.flatnonzero(levels == k)
+        maxima[rows] = np.maximum(level[starts[rows]], level[rows - 2**k + 1])
+        level[:-2**k] = np.maximum(level[:-2**k], level[2**k:])
+    return maxima
+
+def window_distinct(previous, starts) -> np.ndarray:
+    """
+    Number of distinct values in every window, given the position of the previous row with the same value (-1 for
+    none). Row j counts for the windows ending at i >= j that start after `previous[j]` and at or before j. Window
+    starts never decrease, so those windows are a contiguous range of i, found by binary search and added up with a
+    difference array
+    """
+    positions = np.arange(len(starts))
+    first = np.maximum(positions, np.searchsorted(starts, previous, side="right"))
+    last = np.searchsorted(starts, positions, side="right") - 1
+    counts = first <= last
+    changes = np.bincount(first[counts], minlength=len(starts) + 1) - np.bincount(last[counts] + 1, minlength=len(starts) + 1)
+    return np.cumsum(changes[:-1])
+
+def entity_cumsum(values, codes) -> np.ndarray:
+    """
+    Running sum of values, restarted at every entity of rows sorted by entity. Window sums are differences of two of
+    these, and one running sum over all the entities would make them differences of large totals that lose precision
+    """
+    return pd.Series(values).groupby(codes, sort=False).cumsum().to_numpy()
+
+def register_velocity_entity(id_col):
+    @node(f"sorted/{id_col}", inputs=[f"codes/{id_col}", f"order/{id_col}", "codes/merchant_id"])
+    def sorted_entity(df, entity, order, merchant):
+        """Rows in (entity, time) order with the running amount sum and each row's previous merchant visit"""
+        codes = entity[0][order]
+        amt = df["amt"].to_numpy(dtype=np.float64)[order]
+        rows = {"order": order, "codes": codes, "times": df["unix_time"].to_numpy(dtype=np.int64)[order],
+                "amt": amt, "amt_cumsum": entity_cumsum(amt, codes), "previous_merchant": None}
+        if id_col != "merchant_id":
+            pairs, _ = group_codes(codes.astype(np.int64) * merchant[1] + merchant[0][order])
+            pair_order = np.argsort(pairs, kind="stable")
+            same = pairs[pair_order[1:]] == pairs[pair_order[:-1]]
+            rows["previous_merchant"] = np.full(len(pairs), -1, dtype=np.int64)
+            rows["previous_merchant"][pair_order[1:][same]] = pair_order[:-1][same]
+        return rows
+
+def register_velocity_window(id_col, window, seconds):
+    """Add the velocity nodes of one entity and window to the graph, and their columns to `VELOCITY_COLUMNS`"""
+    columns = velocity_columns(id_col, window)
+
+    @node(f"velocity/{id_col}/{window}", inputs=[f"sorted/{id_col}"], outputs=columns)
+    def velocity(df, rows):
+        order = rows["order"]
+        starts = window_starts(rows["codes"], rows["times"], seconds)
+        ends = np.arange(len(order))
+        # windows starting at the entity's first row take the running sum as it is
+        first = (starts == 0) | (rows["codes"][starts - 1] != rows["codes"][starts])
+        sums = rows["amt_cumsum"][ends] - np.where(first, 0.0, rows["amt_cumsum"][starts - 1])
+        values = [ends - starts + 1, sums, window_max(rows["amt"], starts)]
+        if rows["previous_merchant"] is not None:
+            values.append(window_distinct(rows["previous_merchant"], starts))
+
+        result = {}
+        for column, sorted_values in zip(columns, values):
+            result[column] = np.empty_like(sorted_values)
+            result[column][order] = sorted_values
+        return result
+
+    VELOCITY_COLUMNS.extend(columns)
+
+VELOCITY_COLUMNS = []
+for id_col in VELOCITY_ENTITIES:
+    register_velocity_entity(id_col)
+    for window, seconds in VELOCITY_WINDOWS.items():
+        register_velocity_window(id_col, window, seconds)
+
+#########################---Executor--################
+
+def required_nodes(columns, given) -> list:
+    """Nodes needed for `columns`, dependencies first, without those whose value is `given`"""
+    producers = {column: graph_node.name for graph_node in NODES.values() for column in graph_node.outputs}
+    unknown = [column for column in columns if column not in producers]
+    if unknown:
+        raise ValueError(f"Unknown feature columns {unknown}, expected any of {FEATURE_COLUMNS + VELOCITY_COLUMNS}")
+
+    needed = set()
+    stack = [producers[column] for column in columns]
+    while stack:
+        name = stack.pop()
+        if name not in needed and name not in given:
+            needed.add(name)
+            stack.extend(NODES[name].inputs)
+    return [name for name in NODES if name in needed]
+
+def run_node(graph_node, df, values) -> tuple:
+    """Node value, wall time and CPU time of the thread it ran in"""
+    start, cpu_start = perf_counter(), thread_time()
+    result = graph_node.function(df, *values)
+    return result, perf_counter() - start, thread_time() - cpu_start
+
+def compute_features(df, columns=None, given=None, n_jobs=None, timings=None) -> pd.DataFrame:
+    """
+    Compute feature columns of a clean frame through the feature graph. Only the nodes the requested columns depend on
+    are run, each once, so intermediates such as the parsed time, the day key and the entity sort order are shared by
+    every feature using them. A node is started in a thread pool as soon as all its inputs are ready, so independent
+    features run in parallel (numpy and pandas release the GIL in their sorts, groupbys and arithmetic).
+
+    PARAMETERS
+    df (pd.DataFrame) - clean data with `unix_time`, `amt`, `person_id` and `merchant_id`
+    columns (list of str) - feature columns wanted (any of `FEATURE_COLUMNS` and `VELOCITY_COLUMNS`), all of
+                            `FEATURE_COLUMNS` by default
+    given (dict) - node values supplied by the caller instead of being computed, e.g. {"rates": ExchangeRates}
+    n_jobs (int) - threads, one per CPU by default
+    timings (dict) - optional, filled with the seconds each node took, by node name
+
+    RETURNS
+    pd.DataFrame - the feature columns, aligned to `df`, in graph order
+    """
+    columns = FEATURE_COLUMNS if columns is None else list(columns)
+    values = dict(given or {})
+    if timings is None: timings = {}
+    pending = required_nodes(columns, values)
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        while pending or running:
+            ready = [name for name in pending if all(dependency in values for dependency in NODES[name].inputs)]
+            for name in ready:
+                pending.remove(name)
+                graph_node = NODES[name]
+                running[pool.submit(run_node, graph_node, df, [values[dependency] for dependency in graph_node.inputs])] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                values[name], timings[name], cpu = future.result()
+                record(name, timings[name], cpu, rows_in=len(df))
+
+    features = {}
+    for graph_node in NODES.values():
+        if graph_node.outputs and graph_node.name in values:
+            features.update({column: values[graph_node.name][column] for column in graph_node.outputs if column in columns})
+    return pd.DataFrame(features, index=df.index)
@@ -0,0 +1,282 @@
+import json
+import numpy as np
+import pandas as pd
+
+from collections import deque
+from datetime import datetime
+
+# Position of each running value in an entity's state list
+LAST_TIME, COUNT, AMT_SUM, AMT_MAX, DAY, DAY_COUNT, DAY_SUM = range(7)
+
+SECONDS_PER_DAY = 86400
+
+ID_COLS = ["person_id", "merchant_id"]
+
+def entity_name(id_col) -> str:
+    """`person_id` -> `person`, used to build the extend_meta column names"""
+    return id_col.replace("_id", "")
+
+class EntityFeatureStore:
+    """
+    Incremental version of the `extend_meta` features in creation.py for scoring one transaction at a time.
+
+    Each entity keeps a fixed-size state (last timestamp, count, amount sum and max, and the same for the current day),
+    so `update` is O(1) per transaction and never needs the batch CSV. Aggregates are running values: once every
+    transaction has been seen they equal the whole-history values produced by the batch path.
+
+    PARAMETERS
+    exchange_rate (callable) - optional, maps a `datetime.date` to the USD->GBP rate. Without it `amount_GBP` is not produced
+    """
+    def __init__(self, exchange_rate=None):
+        self.exchange_rate = exchange_rate
+        self.start_time = None
+        self.state = {id_col: {} for id_col in ID_COLS}
+
+    def seconds_from_start(self, unix_time) -> int:
+        # same origin as `standardise_time`: midnight of the day of the earliest transaction
+        min_time = datetime.utcfromtimestamp(self.start_time)
+        min_day = min_time.replace(second=0, minute=0, hour=0)
+        return int(unix_time - min_day.timestamp())
+
+    def update(self, transaction) -> dict:
+        """
+        Add one transaction to the state and return its feature row.
+
+        PARAMETERS
+        transaction (dict-like) - at least `unix_time`, `amt`, `person_id` and `merchant_id`
+
+        RETURNS
+        dict - the transaction's own fields plus the `extend_meta` feature columns
+        """
+        unix_time = int(transaction["unix_time"])
+        amt = float(transaction["amt"])
+        day = unix_time // SECONDS_PER_DAY
+
+        if self.start_time is None or unix_time < self.start_time:
+            self.start_time = unix_time
+
+        row = dict(transaction)
+        row["seconds_from_start"] = self.seconds_from_start(unix_time)
+        row["hour_of_day"] = (unix_time // 3600) % 24
+
+        for id_col in ID_COLS:
+            entity = int(transaction[id_col])
+            state = self.state[id_col].get(entity)
+            if state is None:
+                state = [unix_time, 0, 0.0, amt, day, 0, 0.0]
+                row[f"time_since_last_transaction_{entity_name(id_col)}"] = -1
+                self.state[id_col][entity] = state
+            else:
+                row[f"time_since_last_transaction_{entity_name(id_col)}"] = unix_time - state[LAST_TIME]
+                state[LAST_TIME] = unix_time
+
+            if state[DAY] != day:
+                state[DAY], state[DAY_COUNT], state[DAY_SUM] = day, 0, 0.0
+
+            state[COUNT] += 1
+            state[AMT_SUM] += amt
+            state[AMT_MAX] = max(state[AMT_MAX], amt)
+            state[DAY_COUNT] += 1
+            state[DAY_SUM] += amt
+
+        row.update(self.entity_features(transaction))
+        row["amount_USD"] = amt
+        if self.exchange_rate is not None:
+            rate = self.exchange_rate(datetime.utcfromtimestamp(unix_time).date())
+            # as `ExchangeRates.convert`: the day's rate to 2 decimal places, then the amount
+            row["amount_GBP"] = round(amt * round(rate, 2), 2)
+
+        return row
+
+    def entity_features(self, transaction) -> dict:
+        """Running aggregate columns for the entities of `transaction`, without changing the state"""
+        person = self.state["person_id"][int(transaction["person_id"])]
+        merchant = self.state["merchant_id"][int(transaction["merchant_id"])]
+
+        return {
+            "transactions_on_day_person": person[DAY_COUNT],
+            "transaction_by_person": person[COUNT],
+            "transaction_by_merchant": merchant[COUNT],
+            "mean_amt_person": person[AMT_SUM] / person[COUNT],
+            "max_amt_merchant": merchant[AMT_MAX],
+            "mean_amt_merchant_on_day": merchant[DAY_SUM] / merchant[DAY_COUNT],
+            "max_amt_person_on_day": person[DAY_SUM] / person[DAY_COUNT],
+        }
+
+    def replay(self, clean_df) -> pd.DataFrame:
+        """Update the state with every row of `clean_df` in time order and return the online feature rows"""
+        order = np.argsort(clean_df["unix_time"].to_numpy(), kind="stable")
+        records = clean_df.iloc[order].to_dict("records")
+        rows = [self.update(record) for record in records]
+        return pd.DataFrame(rows, index=clean_df.index[order]).reindex(clean_df.index)
+
+    def save(self, file_path):
+        """Write the state to JSON so a scorer can start warm without replaying history"""
+        with open(file_path, "w") as f:
+            json.dump({
+                "start_time": self.start_time,
+                "state": {id_col: {str(k): v for k, v in states.items()} for id_col, states in self.state.items()},
+            }, f)
+
+    @classmethod
+    def load(cls, file_path, exchange_rate=None):
+        with open(file_path) as f:
+            saved = json.load(f)
+
+        store = cls(exchange_rate)
+        store.start_time = saved["start_time"]
+        store.state = {id_col: {int(k): v for k, v in states.items()} for id_col, states in saved["state"].items()}
+        return store
+
+class VelocityStore:
+    """
+    Incremental version of the sliding-window velocity features of feature_graph.py, one transaction at a time.
+
+    For each entity and window it keeps the transactions still inside the window, their amount sum, a decreasing
+    deque of amounts whose front is the window maximum and a count per merchant, so `update` is amortised O(1) per
+    window. Replayed in time order it gives the same values as the batch features on every row.
+
+    PARAMETERS
+    windows (dict) - window name -> seconds, `VELOCITY_WINDOWS` by default
+    entities (list of str) - ID columns, `VELOCITY_ENTITIES` by default
+    """
+    def __init__(self, windows=None, entities=None):
+        from feature_graph import VELOCITY_ENTITIES, VELOCITY_WINDOWS
+
+        self.windows = dict(VELOCITY_WINDOWS if windows is None else windows)
+        self.entities = list(VELOCITY_ENTITIES if entities is None else entities)
+        # id_col -> window -> entity -> [next sequence number, transactions, amount sum, max deque, merchant counts]
+        self.state = {id_col: {window: {} for window in self.windows} for id_col in self.entities}
+
+    def update(self, transaction) -> dict:
+        """
+        Add one transaction (at least `unix_time`, `amt`, `merchant_id` and the entity ID columns) and return its
+        velocity feature columns
+        """
+        from feature_graph import velocity_columns
+
+        unix_time = int(transaction["unix_time"])
+        amt = float(transaction["amt"])
+        merchant = int(transaction["merchant_id"])
+
+        row = {}
+        for id_col in self.entities:
+            entity = int(transaction[id_col])
+            for window, seconds in self.windows.items():
+                state = self.state[id_col][window].setdefault(entity, [0, deque(), 0.0, deque(), {}])
+                sequence, transactions, _, maxima, merchants = state
+
+                transactions.append((sequence, unix_time, amt, merchant))
+                state[2] += amt
+                while maxima and maxima[-1][1] <= amt:
+                    maxima.pop()
+                maxima.append((sequence, amt))
+                merchants[merchant] = merchants.get(merchant, 0) + 1
+                state[0] += 1
+
+                # drop what has left the window (t - seconds, t]
+                while transactions[0][1] <= unix_time - seconds:
+                    old_sequence, _, old_amt, old_merchant = transactions.popleft()
+                    state[2] -= old_amt
+                    if maxima[0][0] == old_sequence:
+                        maxima.popleft()
+                    merchants[old_merchant] -= 1
+                    if merchants[old_merchant] == 0:
+                        del merchants[old_merchant]
+
+                values = [len(transactions), state[2], maxima[0][1], len(merchants)]
+                row.update(zip(velocity_columns(id_col, window), values))
+        return row
+
+    def replay(self, clean_df) -> pd.DataFrame:
+        """Update the state with every row of `clean_df` in time order and return the velocity feature rows"""
+        order = np.argsort(clean_df["unix_time"].to_numpy(), kind="stable")
+        records = clean_df.iloc[order].to_dict("records")
+        rows = [self.update(record) for record in records]
+        return pd.DataFrame(rows, index=clean_df.index[order]).reindex(clean_df.index)
+
+    def save(self, file_path):
+        """Write the windows and their contents to JSON so a scorer can start warm without replaying history"""
+        with open(file_path, "w") as f:
+            json.dump({
+                "windows": self.windows,
+                "state": {id_col: {window: {str(entity): [state[0], list(state[1]), state[2], list(state[3]), {str(m): c for m, c in state[4].items()}]
+                                            for entity, state in entities.items()}
+                                   for window, entities in windows.items()}
+                          for id_col, windows in self.state.items()},
+            }, f)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path) as f:
+            saved = json.load(f)
+
+        store = cls(saved["windows"], list(saved["state"]))
+        store.state = {id_col: {window: {int(entity): [state[0], deque(tuple(t) for t in state[1]), state[2], deque(tuple(m) for m in state[3]),
+                                                       {int(m): c for m, c in state[4].items()}]
+                                         for entity, state in entities.items()}
+                                for window, entities in windows.items()}
+                       for id_col, windows in saved["state"].items()}
+        return store
+
+# Columns whose batch value is an aggregate over the whole history, or over one day, of the given entity
+HISTORY_COLUMNS = {
+    "transaction_by_person": "person_id",
+    "transaction_by_merchant": "merchant_id",
+    "mean_amt_person": "person_id",
+    "max_amt_merchant": "merchant_id",
+}
+DAY_COLUMNS = {
+    "transactions_on_day_person": "person_id",
+    "mean_amt_merchant_on_day": "merchant_id",
+    "max_amt_person_on_day": "person_id",
+}
+
+def compare_with_batch(online, meta_data) -> pd.Series:
+    """
+    Check the online features against the `extend_meta` output for the same transactions.
+    Row-level columns must match on every row. Aggregate columns are compared on the last transaction
+    of each entity (or entity and day), which is the point where the running value has seen the whole group.
+
+    PARAMETERS
+    online (pd.DataFrame) - output of `EntityFeatureStore.replay`
+    meta_data (pd.DataFrame) - output of `extend_meta` for the same rows
+
+    RETURNS
+    pd.Series - number of mismatching rows per compared column
+    """
+    order = np.argsort(meta_data["unix_time"].to_numpy(), kind="stable")
+    batch = meta_data.iloc[order]
+    online = online.loc[batch.index]
+    day = batch["unix_time"] // SECONDS_PER_DAY
+
+    mismatches = {}
+    for column in online.columns.intersection(meta_data.columns):
+        if column in HISTORY_COLUMNS:
+            last = ~batch[HISTORY_COLUMNS[column]].duplicated(keep="last")
+        elif column in DAY_COLUMNS:
+            last = ~pd.concat([batch[DAY_COLUMNS[column]], day], axis=1).duplicated(keep="last")
+        else:
+            last = pd.Series(True, index=batch.index)
+
+        expected = batch.loc[last, column].to_numpy(dtype=float)
+        actual = online.loc[last, column].to_numpy(dtype=float)
+        mismatches[column] = int((~np.isclose(expected, actual)).sum())
+
+    return pd.Series(mismatches)
+
+if __name__ == "__main__":
+    from creation import extend_meta
+    from exchange_rates import ExchangeRates
+
+    print("Data ", end="", flush=True)
+    clean_df = pd.read_csv("data/cleaned_synthetic_data.csv", index_col=0)
+    print("LOADED")
+
+    rates = ExchangeRates.load()
+    store = EntityFeatureStore(exchange_rate=lambda day: rates.rate(day, "USD", "GBP"))
+    online = store.replay(clean_df)
+    mismatches = compare_with_batch(online, extend_meta(clean_df, rates))
+    print(mismatches)
+
+    store.save("data/feature_store_state.json")
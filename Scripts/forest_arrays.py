@@ -0,0 +1,162 @@
+import json
+import os
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Arrays written by `FlatForest.save`, one .npy file each
+ARRAYS = ["feature", "threshold", "left", "right", "missing_left", "value", "roots"]
+
+class FlatForest:
+    """
+    A fitted sklearn RandomForestClassifier or ExtraTreesClassifier flattened into contiguous arrays, with every tree's
+    nodes stored one after the other. Node i splits on `feature[i]` at `threshold[i]` and continues at `left[i]` or
+    `right[i]` (positions in the same arrays), leaves have feature -1 and hold the class probabilities `value[i]`.
+
+    Prediction walks the trees level by level for a whole batch at once, and gives the same probabilities as the
+    forest it was exported from: rows are compared as float32 like sklearn does and the trees are summed in the
+    same order. Saved forests are memory-mapped on load, so a scorer starts without unpickling any trees.
+
+    PARAMETERS
+    arrays (dict) - the `ARRAYS`, as made by `export_forest` or `load`
+    classes (np.ndarray) - class labels, in the order of the `value` columns
+    n_features (int) - number of features the forest was fitted on
+    """
+    def __init__(self, arrays, classes, n_features):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = n_features
+        self.n_trees = len(self.roots)
+
+    def descend(self, flat_X, n_features, n_rows, roots, levels_per_step=4) -> np.ndarray:
+        """Walk the trees starting at `roots` for every row, one level per step, and return the (n_rows, n_roots) leaves"""
+        nodes = np.tile(np.asarray(roots, dtype=np.int64), n_rows)
+        row_starts = np.repeat(np.arange(n_rows, dtype=np.int64) * n_features, len(roots))
+        has_missing = np.isnan(flat_X).any()
+        # (row, tree) pairs still at an internal node. Leaves point at themselves, so pairs that reach one during a
+        # step just stay there and finished pairs are only dropped between steps
+        active = np.arange(len(nodes))
+        while len(active):
+            current = nodes[active]
+            starts = row_starts[active]
+            for _ in range(levels_per_step):
+                values = flat_X[starts + self.feature[current]]
+                go_left = values <= self.threshold[current]
+                if has_missing:
+                    missing = np.isnan(values)
+                    go_left[missing] = self.missing_left[current[missing]]
+                current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[self.feature[current] >= 0]
+        return nodes.reshape(n_rows, len(roots))
+
+    def apply(self, X, pairs_per_step=16384) -> np.ndarray:
+        """
+        Leaf reached in every tree by every row. Trees are walked a group at a time, with about `pairs_per_step`
+        (row, tree) pairs per group, so large batches work on a few trees' nodes at once and stay in cache while small
+        batches walk every tree together
+
+        RETURNS
+        np.ndarray - (n_rows, n_trees) node positions
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got shape {X.shape}")
+
+        leaves = np.empty((len(X), self.n_trees), dtype=np.int64)
+        group = max(1, pairs_per_step // max(len(X), 1))
+        for first in range(0, self.n_trees, group):
+            leaves[:, first:first + group] = self.descend(X.ravel(), X.shape[1], len(X), self.roots[first:first + group])
+        return leaves
+
+    def predict_block(self, X) -> np.ndarray:
+        leaves = self.apply(X)
+        proba = np.zeros((len(X), self.value.shape[1]))
+        # tree by tree, the order sklearn accumulates in, so the sums match to the last bit
+        for tree in range(self.n_trees):
+            proba += self.value[leaves[:, tree]]
+        proba /= self.n_trees
+        return proba
+
+    def predict_proba(self, X, n_jobs=None, block_size=None) -> np.ndarray:
+        """
+        Class probabilities, averaged over the trees
+
+        PARAMETERS
+        X (array-like) - (n_rows, n_features) feature matrix
+        n_jobs (int) - threads the row blocks are split over, one per CPU by default (numpy releases the GIL)
+        block_size (int) - rows per block, by default the rows are shared evenly between the threads in blocks of
+                           1024 to 8192 rows, which bounds the (rows x trees) working arrays
+        """
+        X = np.asarray(X)
+        n_jobs = n_jobs or os.cpu_count()
+        block_size = block_size or min(8192, max(1024, -(-len(X) // n_jobs)))
+        if len(X) <= block_size:
+            return self.predict_block(X)
+        blocks = [X[start:start + block_size] for start in range(0, len(X), block_size)]
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            return np.concatenate(list(executor.map(self.predict_block, blocks)))
+
+    def predict(self, X, n_jobs=None, block_size=None) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X, n_jobs, block_size), axis=1)]
+
+    def save(self, directory):
+        """Write each array as .npy and meta.json last, so an interrupted save is not loaded"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w") as meta_file:
+            json.dump({"classes": self.classes_.tolist(), "n_features": int(self.n_features_in_),
+                       "n_trees": int(self.n_trees), "n_nodes": len(self.feature)}, meta_file)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+        return cls(arrays, meta["classes"], meta["n_features"])
+
+def export_forest(forest) -> FlatForest:
+    """
+    Flatten a fitted single-output forest classifier (RandomForestClassifier, ExtraTreesClassifier) into a `FlatForest`
+
+    PARAMETERS
+    forest - fitted sklearn forest classifier
+
+    RETURNS
+    FlatForest - predicts the same probabilities as `forest`
+    """
+    if getattr(forest, "n_outputs_", 1) != 1 or not hasattr(forest, "classes_"):
+        raise ValueError("Only single-output forest classifiers can be exported")
+
+    trees = [estimator.tree_ for estimator in forest.estimators_]
+    sizes = np.array([tree.node_count for tree in trees])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    feature, threshold, left, right, missing_left, value = [], [], [], [], [], []
+    for tree, offset in zip(trees, offsets):
+        is_leaf = tree.children_left < 0
+        feature.append(np.where(is_leaf, -1, tree.feature))
+        threshold.append(tree.threshold)
+        # leaves point at themselves, never followed
+        left.append(np.where(is_leaf, np.arange(tree.node_count), tree.children_left) + offset)
+        right.append(np.where(is_leaf, np.arange(tree.node_count), tree.children_right) + offset)
+        missing = getattr(tree, "missing_go_to_left", None)
+        missing_left.append(np.zeros(tree.node_count, dtype=bool) if missing is None else missing.astype(bool))
+        # a tree's probabilities are its leaf values normalised, as DecisionTreeClassifier.predict_proba does
+        leaf_value = tree.value[:, 0, :].astype(np.float64)
+        normaliser = leaf_value.sum(axis=1, keepdims=True)
+        normaliser[normaliser == 0] = 1.0
+        value.append(leaf_value / normaliser)
+
+    arrays = {
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float64),
+        "left": np.concatenate(left).astype(np.int64),
+        "right": np.concatenate(right).astype(np.int64),
+        "missing_left": np.concatenate(missing_left),
+        "value": np.concatenate(value),
+        "roots": offsets.astype(np.int64),
+    }
+    return FlatForest(arrays, forest.classes_, forest.n_features_in_)
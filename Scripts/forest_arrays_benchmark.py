@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+import joblib
+import numpy as np
+
+from time import perf_counter
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+from forest_arrays import FlatForest, export_forest
+from storage import load_frame
+
+# "python forest_arrays_benchmark.py data/SMOTE_samples data/meta_features_test" fits both forests on the first file,
+# checks the exported arrays predict the same probabilities on the second and times prediction and loading
+train_path = sys.argv[1] if len(sys.argv) > 1 else "data/meta_features_train"
+test_path = sys.argv[2] if len(sys.argv) > 2 else "data/meta_features_test"
+BATCH_SIZES = [1, 16, 256, 4096, 65536]
+
+def best_time(function, repeats) -> float:
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+print("Data ", end="", flush=True)
+train = load_frame(train_path)
+test = load_frame(test_path)
+columns = train.select_dtypes(include=[np.number]).columns.drop("is_fraud").intersection(test.columns)
+X_train, y_train = train[columns].to_numpy(dtype=np.float64), train["is_fraud"].to_numpy()
+X_test = test[columns].to_numpy(dtype=np.float64)
+print("LOADED")
+
+for forest in [ExtraTreesClassifier(random_state=0, n_jobs=-1), RandomForestClassifier(random_state=0, n_jobs=-1)]:
+    name = type(forest).__name__
+    forest.fit(X_train, y_train)
+    flat = export_forest(forest)
+    print(f"{name}: {flat.n_trees} trees, {len(flat.feature)} nodes")
+    print(f"  same probabilities: {np.array_equal(forest.predict_proba(X_test), flat.predict_proba(X_test))}")
+
+    for batch_size in BATCH_SIZES:
+        batch = X_test[:batch_size]
+        repeats = max(3, 2000 // batch_size)
+        sklearn_time = best_time(lambda: forest.predict_proba(batch), repeats)
+        flat_time = best_time(lambda: flat.predict_proba(batch), repeats)
+        print(f"  batch {len(batch):>6}  sklearn {sklearn_time * 1000:>9.2f}ms  arrays {flat_time * 1000:>9.2f}ms")
+
+    with tempfile.TemporaryDirectory() as directory:
+        joblib.dump(forest, os.path.join(directory, "model.joblib"))
+        flat.save(os.path.join(directory, "forest"))
+        joblib_time = best_time(lambda: joblib.load(os.path.join(directory, "model.joblib")), 3)
+        flat_time = best_time(lambda: FlatForest.load(os.path.join(directory, "forest")), 3)
+        print(f"  load  joblib {joblib_time * 1000:>9.2f}ms  arrays {flat_time * 1000:>9.2f}ms")
@@ -0,0 +1,117 @@
+import sys
+import numpy as np
+import pandas as pd
+
+from exchange_rates import ExchangeRates
+from storage import save_frame
+
+CATEGORIES = ["entertainment", "food_dining", "gas_transport", "grocery_net", "grocery_pos", "health_fitness", "home",
+              "kids_pets", "misc_net", "misc_pos", "personal_care", "shopping_net", "shopping_pos", "travel"]
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+               "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin"]
+JOBS = ["Engineer, civil (contracting)", "Engineer, mining", "Teacher, primary school", "Doctor, general practice",
+        "Pilot, airline", "Accountant, chartered", "Nurse, adult", "Solicitor", "Designer, furniture", "Chief Executive Officer",
+        "Surveyor, minerals", "Therapist, occupational", "Librarian, public", "Scientist, research (maths)", "Barrister"]
+STATES = ["CA", "TX", "NY", "FL", "PA", "OH", "MI", "IL", "WA", "MO"]
+COLUMNS = ["trans_date_trans_time", "cc_num", "merchant", "category", "amt", "first", "last", "gender", "street", "city",
+           "state", "zip", "lat", "long", "city_pop", "job", "dob", "trans_num", "unix_time", "merch_lat", "merch_long", "is_fraud"]
+
+def random_hex(rng, n, length=32) -> np.ndarray:
+    """n random lowercase hex strings, built from one block of random bytes"""
+    hex_block = rng.bytes(n * length // 2).hex()
+    return np.frombuffer(hex_block.encode(), dtype=f"S{length}").astype(str)
+
+def generate_transactions(n_rows, fraud_rate=0.005, n_people=1000, n_merchants=700, n_cities=900, start="2019-01-01",
+                          n_days=540, seed=0) -> pd.DataFrame:
+    """
+    Seeded synthetic transactions with the schema of `data/synthetic_train.csv`, for benchmarks and tests.
+
+    People have fixed names, card, address, job and date of birth, merchants have a fixed category and location.
+    Transactions are spread over `n_days` days in time order. Fraudulent ones are larger and mostly at night.
+
+    PARAMETERS
+    n_rows (int) - number of transactions
+    fraud_rate (float) - share of fraudulent transactions
+    n_people, n_merchants, n_cities (int) - entity cardinalities
+    start (str) - first transaction date
+    n_days (int) - length of the period covered
+    seed (int) - seed, the same arguments always give the same frame
+    """
+    rng = np.random.default_rng(seed)
+
+    # entities
+    city_lat = rng.uniform(25, 48, n_cities).round(4)
+    city_long = rng.uniform(-123, -70, n_cities).round(4)
+    city_pop = np.round(rng.lognormal(8, 2, n_cities)).astype(np.int64) + 20
+    person_city = rng.integers(0, n_cities, n_people)
+    person_dob = pd.Timestamp("1930-01-01") + pd.to_timedelta(rng.integers(0, 365 * 75, n_people), unit="D")
+    person = {
+        "cc_num": rng.integers(10**11, 10**16, n_people),
+        "first": np.array(FIRST_NAMES)[rng.integers(0, len(FIRST_NAMES), n_people)],
+        "last": np.array(LAST_NAMES)[rng.integers(0, len(LAST_NAMES), n_people)],
+        "gender": np.where(rng.random(n_people) < 0.5, "F", "M"),
+        "street": pd.Series(rng.integers(1, 9999, n_people)).astype(str).to_numpy() + " Main St",
+        "city": pd.Series(person_city).map("City {}".format).to_numpy(),
+        "state": np.array(STATES)[person_city % len(STATES)],
+        "zip": 10000 + person_city * 7 % 89999,
+        "lat": city_lat[person_city],
+        "long": city_long[person_city],
+        "city_pop": city_pop[person_city],
+        "job": np.array(JOBS)[rng.integers(0, len(JOBS), n_people)],
+        "dob": person_dob.strftime("%Y-%m-%d").to_numpy(),
+    }
+    merchant_name = pd.Series(np.arange(n_merchants)).map("fraud_Merchant {}".format).to_numpy()
+    merchant_category = np.array(CATEGORIES)[rng.integers(0, len(CATEGORIES), n_merchants)]
+
+    # transactions, busier people and merchants get more of them
+    person_weight = rng.lognormal(0, 0.6, n_people)
+    merchant_weight = rng.lognormal(0, 0.6, n_merchants)
+    people = rng.choice(n_people, n_rows, p=person_weight / person_weight.sum())
+    merchants = rng.choice(n_merchants, n_rows, p=merchant_weight / merchant_weight.sum())
+    is_fraud = (rng.random(n_rows) < fraud_rate).astype(np.int64)
+
+    start_time = int(pd.Timestamp(start).timestamp())
+    unix_time = rng.integers(start_time, start_time + n_days * 86400, n_rows)
+    # fraud mostly happens at night
+    unix_time = np.where(is_fraud == 1, unix_time - unix_time % 86400 + rng.integers(0, 4 * 3600, n_rows), unix_time)
+    order = np.argsort(unix_time, kind="stable")
+    unix_time, people, merchants, is_fraud = unix_time[order], people[order], merchants[order], is_fraud[order]
+    amt = np.where(is_fraud == 1, rng.gamma(2, 250, n_rows), rng.gamma(1.5, 45, n_rows)).round(2) + 1
+
+    df = pd.DataFrame({
+        "trans_date_trans_time": pd.to_datetime(unix_time, unit="s").strftime("%Y-%m-%d %H:%M:%S"),
+        "merchant": merchant_name[merchants],
+        "category": merchant_category[merchants],
+        "amt": amt,
+        "trans_num": random_hex(rng, n_rows),
+        "unix_time": unix_time,
+        "merch_lat": (city_lat[person_city[people]] + rng.uniform(-1, 1, n_rows)).round(6),
+        "merch_long": (city_long[person_city[people]] + rng.uniform(-1, 1, n_rows)).round(6),
+        "is_fraud": is_fraud,
+    })
+    for column, values in person.items():
+        df[column] = values[people]
+
+    return df[COLUMNS]
+
+def generate_exchange_rates(start="2019-01-01", n_days=540, currencies=("USD", "GBP"), base="EUR", seed=0) -> ExchangeRates:
+    """Seeded daily rates (a random walk per currency) covering the same period as `generate_transactions`"""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(start, periods=n_days + 1, freq="D")
+    levels = {"USD": 1.12, "GBP": 0.87, "EUR": 1.0}
+    table = pd.DataFrame({currency: (levels.get(currency, 1.0) * np.exp(np.cumsum(rng.normal(0, 0.003, len(days))))).round(4)
+                          for currency in currencies if currency != base}, index=days)
+    table[base] = 1.0
+    return ExchangeRates(table)
+
+if __name__ == "__main__":
+    # e.g. "python generator.py 1000000 data/synthetic_train" writes a seeded 1M row frame
+    n_rows = int(sys.argv[1])
+    file_path = sys.argv[2] if len(sys.argv) > 2 else f"data/synthetic_{n_rows}"
+
+    print("Generating ", end="", flush=True)
+    df = generate_transactions(n_rows)
+    print("DONE")
+    print(save_frame(df, file_path, compact=False))
@@ -0,0 +1,249 @@
+import argparse
+import atexit
+import functools
+import json
+import os
+import platform
+import sys
+import threading
+import pandas as pd
+import multiprocessing as mp
+
+from datetime import datetime, timezone
+from time import perf_counter, process_time
+
+# Trace file written when set. Unset, every stage is a no-op. Worker processes never trace, their parent records
+# what it needs (see `record`)
+TRACE_PATH = os.environ.get("ADS_TRACE")
+
+# ru_maxrss is in KB on Linux and in bytes on macOS
+MAXRSS_TO_MB = 1 / 1024 if sys.platform != "darwin" else 1 / 1024**2
+
+class Trace:
+    """
+    Stages recorded by this process, written to `path` as JSON after every top-level stage and at exit
+
+    PARAMETERS
+    path (str) - JSON trace file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.started = perf_counter()
+        self.header = {
+            "command": sys.argv,
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        self.stages = []
+        self.lock = threading.Lock()
+        # names of the stages open in each thread, so nested stages are recorded as "outer/inner"
+        self.open = threading.local()
+
+    def stack(self) -> list:
+        if not hasattr(self.open, "names"):
+            self.open.names = []
+        return self.open.names
+
+    def add(self, stage):
+        with self.lock:
+            self.stages.append(stage)
+
+    def save(self):
+        """Written to a temporary file first, so an interrupted write leaves the previous trace in place"""
+        with self.lock:
+            trace = dict(self.header, stages=list(self.stages))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{self.path}.tmp", "w") as trace_file:
+            json.dump(trace, trace_file, indent=1)
+        os.replace(f"{self.path}.tmp", self.path)
+
+trace = None
+
+def enable(path):
+    """Start tracing to `path` (what setting ADS_TRACE does at import). Ignored in worker processes"""
+    global trace
+    if mp.parent_process() is not None:
+        return
+    if trace is None:
+        atexit.register(lambda: trace is not None and trace.save())
+    trace = Trace(path)
+
+def disable():
+    global trace
+    trace = None
+
+def current_rss_mb() -> float:
+    """Resident memory now (Linux), or None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError):
+        return None
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of the process so far, or None where `resource` is not available (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_TO_MB
+
+class Stage:
+    """
+    One timed stage. Set `rows_out` inside the `with` block to record the rows it produced.
+
+    The process peak RSS can only be read as a high-water mark, so each stage records the mark at its end and how
+    much it raised it: the stages with a `peak_increase_mb` are where the peak memory of a run comes from.
+    """
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self):
+        stack = trace.stack()
+        stack.append(self.name)
+        self.path = "/".join(stack)
+        self.rss_start = current_rss_mb()
+        self.peak_start = peak_rss_mb()
+        self.cpu_start = process_time()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = perf_counter() - self.start
+        cpu = process_time() - self.cpu_start
+        peak = peak_rss_mb()
+        stack = trace.stack()
+        stack.pop()
+        trace.add({
+            "name": self.path,
+            "start_s": round(self.start - trace.started, 6),
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "rss_start_mb": self.rss_start,
+            "rss_end_mb": current_rss_mb(),
+            "peak_rss_mb": peak,
+            "peak_increase_mb": None if peak is None else peak - self.peak_start,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "failed": exc[0] is not None,
+        })
+        if not stack:
+            trace.save()
+        return False
+
+class NoStage:
+    """What `stage` returns when tracing is off: nothing is measured and `rows_out` is simply discarded"""
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NO_STAGE = NoStage()
+
+def stage(name, rows_in=None):
+    """
+    Context manager timing a stage of the pipeline: wall time, CPU time (of this process, all threads), RSS and rows
+    in and out. Stages opened inside it are recorded as `name/<inner name>`.
+
+    e.g. with stage("SMOTE", rows_in=len(X)) as timing:
+             X, y = oversample.fit_resample(X, y)
+             timing.rows_out = len(X)
+    """
+    if trace is None:
+        return NO_STAGE
+    return Stage(name, rows_in)
+
+def n_rows(value):
+    """Rows of a frame, array or the first element of a tuple of them, None for anything else"""
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    return len(value) if hasattr(value, "shape") else None
+
+def traced(name=None):
+    """Decorator running a function as a `stage`, with the rows of its first argument in and of its result out"""
+    def decorate(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if trace is None:
+                return function(*args, **kwargs)
+            with Stage(stage_name, n_rows(args[0]) if args else None) as timing:
+                result = function(*args, **kwargs)
+                timing.rows_out = n_rows(result)
+            return result
+        return wrapper
+    return decorate
+
+def record(name, wall_s, cpu_s=None, peak_rss_mb=None, rows_in=None, rows_out=None):
+    """Add a stage measured elsewhere, e.g. in a worker process or thread, under the stages open in this thread"""
+    if trace is None:
+        return
+    trace.add({
+        "name": "/".join(trace.stack() + [name]),
+        # taken as having just finished
+        "start_s": round(perf_counter() - trace.started - wall_s, 6),
+        "wall_s": wall_s,
+        "cpu_s": cpu_s,
+        "rss_start_mb": None,
+        "rss_end_mb": None,
+        "peak_rss_mb": peak_rss_mb,
+        "peak_increase_mb": None,
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+        "failed": False,
+    })
+
+if TRACE_PATH:
+    enable(TRACE_PATH)
+
+#########################---Report--################
+
+def load_trace(path) -> pd.DataFrame:
+    """
+    Stages of a trace file summed per stage name (stages run in a loop, e.g. per chunk, become one row)
+
+    RETURNS
+    pd.DataFrame - calls, wall_s, cpu_s, rows_in and rows_out summed, peak_rss_mb and peak_increase_mb maximised,
+                   by stage name in order of first start (so outer stages come before the stages inside them)
+    """
+    with open(path) as trace_file:
+        stages = pd.DataFrame(json.load(trace_file)["stages"])
+    columns = ["start_s", "wall_s", "cpu_s", "peak_rss_mb", "peak_increase_mb", "rows_in", "rows_out"]
+    stages[columns] = stages[columns].astype(float)
+    summary = stages.groupby("name").agg(
+        start_s=("start_s", "min"), calls=("wall_s", "size"), wall_s=("wall_s", "sum"), cpu_s=("cpu_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"), peak_increase_mb=("peak_increase_mb", "max"),
+        rows_in=("rows_in", "sum"), rows_out=("rows_out", "sum"))
+    return summary.sort_values("start_s", kind="stable").drop(columns="start_s")
+
+def compare_traces(before, after) -> pd.DataFrame:
+    """Stage by stage wall time, CPU time and peak memory of two traces, with the change from `before` to `after`"""
+    before, after = load_trace(before), load_trace(after)
+    comparison = pd.concat({"before": before, "after": after}, axis=1, sort=False)
+    for column in ["wall_s", "cpu_s", "peak_rss_mb"]:
+        comparison[("change", column)] = comparison[("after", column)] - comparison[("before", column)]
+    comparison[("change", "speedup")] = comparison[("before", "wall_s")] / comparison[("after", "wall_s")]
+    return comparison[[(side, column) for side in ["before", "after", "change"]
+                       for column in ["wall_s", "cpu_s", "peak_rss_mb", "rows_out", "speedup"] if (side, column) in comparison]]
+
+if __name__ == "__main__":
+    # e.g. "ADS_TRACE=data/trace_before.json python creation.py" and again after a change, then
+    #      "python instrument.py data/trace_before.json data/trace_after.json"
+    parser = argparse.ArgumentParser(description="Summarise a pipeline trace, or compare two")
+    parser.add_argument("traces", nargs="+", help="one trace to summarise or two to compare")
+    args = parser.parse_args()
+    if len(args.traces) > 2:
+        parser.error("give one or two traces")
+
+    report = load_trace(args.traces[0]) if len(args.traces) == 1 else compare_traces(*args.traces)
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.float_format", "{:.2f}".format):
+        print(report)
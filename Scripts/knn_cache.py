@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from scipy.sparse import csr_matrix
+from sklearn.base import BaseEstimator
+from sklearn.neighbors import NearestNeighbors
+
+# Directory holding one sub-directory of memory-mapped arrays per cached graph
+CACHE_DIR = os.environ.get("ADS_KNN_CACHE", "data/knn_cache")
+# Written into each graph's meta.json, graphs of an older version (float32 faiss searches before 2) are rebuilt
+GRAPH_VERSION = 2
+
+def content_key(X) -> str:
+    """Hash of the values, shape and dtype of a feature matrix, so a graph is reused only for identical data"""
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    digest = hashlib.sha1()
+    digest.update(str(X.shape).encode())
+    digest.update(memoryview(X).cast("B"))
+    return digest.hexdigest()
+
+def row_hashes(X) -> np.ndarray:
+    return pd.util.hash_pandas_object(pd.DataFrame(np.asarray(X, dtype=np.float64)), index=False).to_numpy()
+
+def not_self(indices, rows) -> np.ndarray:
+    """
+    Mask of the k + 1 nearest neighbour `indices` of `rows` without each row itself, matched by index. A row missing
+    from its own neighbours (more than k exact duplicates of it) loses its first column instead, as in sklearn
+    """
+    drop = np.asarray(indices) == np.asarray(rows)[:, None]
+    drop[~drop.any(axis=1), 0] = True
+    # only the first match counts if the row appears twice
+    drop &= np.cumsum(drop, axis=1) == 1
+    return ~drop
+
+class NeighbourGraph:
+    """
+    k nearest neighbours of every row of a feature matrix, over the same matrix and including the row itself, stored as
+    memory-mapped int32 indices and float64 euclidean distances.
+
+    Any k up to the stored maximum is answered by slicing the first k columns.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+        self.max_k = self.meta["k"]
+        self.indices = np.load(os.path.join(directory, "indices.npy"), mmap_mode="r")
+        self.distances = np.load(os.path.join(directory, "distances.npy"), mmap_mode="r")
+
+    def kneighbors(self, k, rows=None) -> tuple:
+        """
+        Distances and indices of the k nearest neighbours of `rows` (all rows by default)
+
+        RETURNS
+        np.ndarray, np.ndarray - (n_rows, k) float64 distances and int32 indices, nearest first
+        """
+        if k > self.max_k:
+            raise ValueError(f"Graph in {self.directory} holds {self.max_k} neighbours, {k} requested")
+        if rows is None:
+            return self.distances[:, :k], self.indices[:, :k]
+        return self.distances[rows, :k], self.indices[rows, :k]
+
+    def neighbours_of_rows(self, k, rows=None) -> tuple:
+        """
+        Distances and indices of the k nearest neighbours of `rows` (all rows by default) not counting each row itself,
+        as sklearn's `kneighbors()` without X. The row is removed by its index rather than assumed to be the first
+        column, as a duplicate of it can come first (see `not_self`)
+        """
+        rows = np.arange(self.meta["rows"]) if rows is None else np.asarray(rows)
+        distances, indices = self.kneighbors(k + 1, rows)
+        keep = not_self(indices, rows)
+        return np.asarray(distances)[keep].reshape(len(rows), k), np.asarray(indices)[keep].reshape(len(rows), k)
+
+    @staticmethod
+    def build(X, k, directory, block_size=65536, n_jobs=None):
+        """
+        Compute the graph with sklearn's NearestNeighbors, writing it block by block into memory-mapped files. The
+        search is in float64 like the samplers' own, as float32 rounding reorders the neighbours of unscaled features
+        (`unix_time` alone is about 1.5e9)
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        k = min(k, len(X))
+        nn = NearestNeighbors(n_neighbors=k, n_jobs=n_jobs).fit(X)
+
+        os.makedirs(directory, exist_ok=True)
+        indices = np.lib.format.open_memmap(os.path.join(directory, "indices.npy"), mode="w+", dtype=np.int32, shape=(len(X), k))
+        distances = np.lib.format.open_memmap(os.path.join(directory, "distances.npy"), mode="w+", dtype=np.float64, shape=(len(X), k))
+        for start in range(0, len(X), block_size):
+            distances[start:start + block_size], indices[start:start + block_size] = nn.kneighbors(X[start:start + block_size])
+        indices.flush()
+        distances.flush()
+        del indices, distances
+
+        # written last, so a graph interrupted while building is not picked up
+        with open(os.path.join(directory, "meta.json"), "w") as meta_file:
+            json.dump({"k": int(k), "rows": len(X), "features": X.shape[1], "version": GRAPH_VERSION}, meta_file)
+        return NeighbourGraph(directory)
+
+def neighbour_graph(X, k, cache_dir=None, printing=False, n_jobs=None) -> NeighbourGraph:
+    """
+    The cached neighbour graph of X with at least k neighbours per row (counting the row itself), computed and stored
+    on first use. A cached graph with fewer neighbours is rebuilt with k.
+
+    PARAMETERS
+    X (array-like) - feature matrix, the cache is keyed by a hash of its contents
+    k (int) - neighbours needed per row
+    cache_dir (str) - cache directory, `CACHE_DIR` by default
+    n_jobs (int) - threads for building the graph
+    """
+    directory = os.path.join(cache_dir or CACHE_DIR, content_key(X))
+    usable = lambda graph: graph.meta.get("version") == GRAPH_VERSION and graph.max_k >= min(k, len(X))
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        graph = NeighbourGraph(directory)
+        if usable(graph):
+            return graph
+
+    if (printing): print(f"KNN GRAPH ({len(X)} rows, k={k}) ",end="",flush=True)
+    # built under a private name and renamed into place, so processes building the same graph do not collide
+    building = f"{directory}.{os.getpid()}.tmp"
+    NeighbourGraph.build(X, k, building, n_jobs=n_jobs)
+    if os.path.exists(os.path.join(directory, "meta.json")) and usable(NeighbourGraph(directory)):
+        shutil.rmtree(building)
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+        try:
+            os.rename(building, directory)
+        except OSError:
+            # another process renamed its copy first
+            shutil.rmtree(building)
+    if (printing): print("CACHED")
+    return NeighbourGraph(directory)
+
+class CachedNearestNeighbors(BaseEstimator):
+    """
+    Drop-in for sklearn's NearestNeighbors backed by `neighbour_graph`, for the `k_neighbors`/`n_neighbors` argument of
+    the imblearn samplers (e.g. SMOTE(k_neighbors=CachedNearestNeighbors(6))).
+
+    `fit` loads or builds the graph of the fitted matrix. `kneighbors` answers queries that are rows of that matrix
+    from the graph and searches the fitted matrix directly for any other rows, and `kneighbors_graph` (the other
+    method imblearn requires) is built on it. `n_jobs` threads build the graph and run those searches.
+    """
+    def __init__(self, n_neighbors=5, cache_dir=None, max_neighbors=None, n_jobs=None):
+        self.n_neighbors = n_neighbors
+        self.cache_dir = cache_dir
+        self.max_neighbors = max_neighbors
+        self.n_jobs = n_jobs
+
+    def fit(self, X, y=None):
+        self.fit_X_ = np.asarray(X, dtype=np.float64)
+        self.graph_ = neighbour_graph(self.fit_X_, max(self.n_neighbors, self.max_neighbors or 0), self.cache_dir, n_jobs=self.n_jobs)
+        self.n_samples_fit_ = len(self.fit_X_)
+
+        # position of the first fitted row with each row hash, to find query rows in the graph
+        hashes = row_hashes(self.fit_X_)
+        first = ~pd.Index(hashes).duplicated()
+        self.fit_rows_ = pd.Index(hashes[first])
+        self.fit_positions_ = np.flatnonzero(first)
+        return self
+
+    def kneighbors(self, X=None, n_neighbors=None, return_distance=True):
+        k = n_neighbors or self.n_neighbors
+        if (k + 1 if X is None else k) > self.graph_.max_k:
+            self.graph_ = neighbour_graph(self.fit_X_, k + 1 if X is None else k, self.cache_dir, n_jobs=self.n_jobs)
+
+        if X is None:
+            # sklearn's convention: neighbours of the fitted rows, not counting each row itself
+            distances, indices = self.graph_.neighbours_of_rows(k)
+        else:
+            X = np.asarray(X, dtype=np.float64)
+            rows = self.fit_rows_.get_indexer(row_hashes(X))
+            rows = np.where(rows >= 0, self.fit_positions_[rows], -1)
+            # guard against hash collisions
+            rows[rows >= 0] = np.where((self.fit_X_[rows[rows >= 0]] == X[rows >= 0]).all(axis=1), rows[rows >= 0], -1)
+
+            distances = np.empty((len(X), k), dtype=np.float64)
+            indices = np.empty((len(X), k), dtype=np.int64)
+
+            found = rows >= 0
+            distances[found], indices[found] = self.graph_.kneighbors(k, rows[found])
+            if not found.all():
+                nn = NearestNeighbors(n_neighbors=k, n_jobs=self.n_jobs).fit(self.fit_X_)
+                distances[~found], indices[~found] = nn.kneighbors(X[~found])
+
+        if return_distance:
+            return np.asarray(distances, dtype=np.float64), np.asarray(indices, dtype=np.int64)
+        return np.asarray(indices, dtype=np.int64)
+
+    def kneighbors_graph(self, X=None, n_neighbors=None, mode="connectivity"):
+        """
+        Sparse (n_queries, n_samples_fit) matrix of the `kneighbors` of X, as sklearn's: ones in "connectivity" mode,
+        euclidean distances in "distance" mode
+        """
+        if mode not in ("connectivity", "distance"):
+            raise ValueError(f"Unsupported mode {mode}, expected connectivity or distance")
+        distances, indices = self.kneighbors(X, n_neighbors)
+        n_queries, k = indices.shape
+        values = np.ones(indices.size) if mode == "connectivity" else distances.ravel()
+        return csr_matrix((values, indices.ravel(), np.arange(0, n_queries * k + 1, k)), shape=(n_queries, self.n_samples_fit_))
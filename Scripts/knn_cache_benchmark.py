@@ -0,0 +1,61 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import imblearn
+
+from sklearn.neighbors import NearestNeighbors
+from storage import load_frame
+from knn_cache import CachedNearestNeighbors, neighbour_graph
+
+# "python knn_cache_benchmark.py data/meta_features_train 12000" checks the cached k-NN graph and the samplers reading
+# it against sklearn's NearestNeighbors on a 12000 row sample. Without a file it checks generated meta features, which
+# have the same columns (raw unix_time, dense entity codes, amounts)
+file_path = sys.argv[1] if len(sys.argv) > 1 else None
+n_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 12000
+
+def generated_meta_features(n_rows, seed=0):
+    from creation import anonymise_data, extend_meta
+    from entity_ids import EntityCodes
+    from generator import generate_exchange_rates, generate_transactions
+    clean_df = anonymise_data(generate_transactions(n_rows, seed=seed), printing=False, codes=EntityCodes(), secret="benchmark")
+    return extend_meta(clean_df, generate_exchange_rates())
+
+print("Data ", end="", flush=True)
+if file_path:
+    meta_data = load_frame(file_path)
+    meta_data = meta_data.iloc[np.random.default_rng(0).choice(len(meta_data), min(n_rows, len(meta_data)), replace=False)]
+else:
+    meta_data = generated_meta_features(n_rows)
+X = meta_data.drop(["is_fraud"], axis=1).to_numpy(dtype=np.float64)
+y = meta_data["is_fraud"].to_numpy()
+print(f"LOADED ({len(X)} rows, {y.sum()} fraud)")
+
+cache_dir = tempfile.mkdtemp()
+try:
+    k = 5
+    expected_distances, expected = NearestNeighbors(n_neighbors=k).fit(X).kneighbors()
+    graph = neighbour_graph(X, k + 1, cache_dir)
+    distances, indices = graph.neighbours_of_rows(k)
+    assert np.array_equal(indices, expected), f"{(indices != expected).any(axis=1).sum()} rows with other neighbours than sklearn"
+    assert np.allclose(distances, expected_distances)
+    cached = CachedNearestNeighbors(k, cache_dir).fit(X)
+    assert np.array_equal(cached.kneighbors(return_distance=False), expected)
+    assert np.array_equal(cached.kneighbors(X[:100], k + 1, return_distance=False), NearestNeighbors(n_neighbors=k + 1).fit(X).kneighbors(X[:100], return_distance=False))
+    print(f"  graph: same {k}-NN as sklearn on every row")
+
+    samplers = {
+        "ENN": lambda neighbours: imblearn.under_sampling.EditedNearestNeighbours(n_neighbors=neighbours(3)),
+        "ADASYN": lambda neighbours: imblearn.over_sampling.ADASYN(n_neighbors=neighbours(5), random_state=0),
+        "SMOTEENN": lambda neighbours: imblearn.combine.SMOTEENN(
+            smote=imblearn.over_sampling.SMOTE(k_neighbors=neighbours(5), random_state=0),
+            enn=imblearn.under_sampling.EditedNearestNeighbours(sampling_strategy="all", n_neighbors=neighbours(3)), random_state=0),
+    }
+    for name, make in samplers.items():
+        X_reference, y_reference = make(lambda k: k).fit_resample(X, y)
+        X_cached, y_cached = make(lambda k: CachedNearestNeighbors(k + 1, cache_dir)).fit_resample(X, y)
+        assert np.array_equal(X_reference, X_cached) and np.array_equal(y_reference, y_cached), f"{name} with the cache differs from imblearn"
+        print(f"  {name:<9} same output as imblearn ({len(y_cached)} rows)")
+finally:
+    shutil.rmtree(cache_dir)
@@ -0,0 +1,462 @@
+import argparse
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import traceback
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+from experiments import CACHE_DIR, CLASSIFIERS, dataset_name, prepare, run_cell, write_results
+from resample import SAMPLERS, make_sampler, write_samples
+from storage import load_frame, save_frame
+
+# Samplers whose cost grows fastest with the rows (CSMOUTE's SMUTE step searches the majority class, MWMOTE clusters
+# it), the ones a sweep may split into data shards
+SHARDABLE = ["CSMOUTE", "MWMOTE"]
+
+# Units of a phase only start once the previous phase has ended. "merge" joins the sampler shards and preprocesses
+# every training and test file into the experiments cache, so the training units only read the cache
+PHASES = ["sample", "merge", "train"]
+
+# Environment line of the generated Slurm scripts, as in bc4_template.sh
+SLURM_ENVIRONMENT = "module load languages/anaconda3/2020.02-tflow-2.2.0"
+
+def read_json(file_path):
+    with open(file_path) as json_file:
+        return json.load(json_file)
+
+def write_json(value, file_path):
+    """Written to a temporary file first, so a reader never sees half a file"""
+    with open(f"{file_path}.tmp", "w") as json_file:
+        json.dump(value, json_file, indent=1)
+    os.replace(f"{file_path}.tmp", file_path)
+
+def shard_rows(y, n_shards, shard, seed=0) -> np.ndarray:
+    """
+    Rows of one of `n_shards` stratified shards. Each class is shuffled (the same way in every task) and dealt out in
+    turn, so every shard keeps the class balance of the whole set and the shards cover it exactly once
+    """
+    rng = np.random.default_rng(seed)
+    rows = [rng.permutation(np.flatnonzero(y == value))[shard::n_shards] for value in np.unique(y)]
+    return np.sort(np.concatenate(rows))
+
+#########################---Plan--################
+
+def plan_sweep(sweep_dir, data="data/meta_features_train", test="data/meta_features_test", samplers=(),
+               classifiers=CLASSIFIERS, datasets=(), shards=None, out_dir="data", cache_dir=None, n_features=10,
+               label="is_fraud", cache=False) -> list:
+    """
+    Split a sampler x classifier sweep into work units and save the plan as `<sweep_dir>/sweep.json`. Planning the
+    same sweep again keeps the units already done, a different plan needs a new sweep directory.
+
+    Units: one per sampler ("sample.SMOTE"), or per data shard of a `SHARDABLE` sampler ("sample.MWMOTE.003"); one
+    per sampler joining its shards into `<out_dir>/<sampler>_samples` ("merge.MWMOTE"); one preprocessing the test set
+    and each already resampled dataset ("prepare.test"); one per (training set, classifier) ("train.SMOTE.extra_trees")
+
+    PARAMETERS
+    sweep_dir (str) - directory of the plan, the units' outputs and the job scripts
+    data (str) - training meta features the samplers resample
+    test (str) - test meta features
+    samplers (list of str) - names from `SAMPLERS`
+    classifiers (list of str) - names from `CLASSIFIERS`
+    datasets (list of str) - resampled training sets to train on as they are, e.g. data/SMOTE_samples
+    shards (dict) - number of data shards per sampler, 1 by default. Each shard is resampled on its own, so
+                    neighbours are only searched within a shard
+    out_dir (str) - directory for the merged `<sampler>_samples`
+    cache_dir (str) - experiments cache, `experiments.CACHE_DIR` by default
+    n_features (int) - number of top-importance features the classifiers are trained on
+    label (str) - label column
+    cache (bool) - share k-NN graphs between samplers and runs through `knn_cache`
+
+    RETURNS
+    list of dict - the units, in phase order
+    """
+    shards = shards or {}
+    unknown = (set(samplers) | set(shards)) - set(SAMPLERS)
+    if unknown:
+        raise ValueError(f"Unknown samplers {sorted(unknown)}, expected any of {SAMPLERS}")
+    unknown = set(classifiers) - set(CLASSIFIERS)
+    if unknown:
+        raise ValueError(f"Unknown classifiers {sorted(unknown)}, expected any of {CLASSIFIERS}")
+    unshardable = {name for name, n_shards in shards.items() if n_shards > 1} - set(SHARDABLE)
+    if unshardable:
+        raise ValueError(f"Samplers {sorted(unshardable)} cannot be sharded, only {SHARDABLE}")
+
+    units = []
+    # (dataset name, unit whose done.json holds its cache directory)
+    training_sets = []
+    for sampler in samplers:
+        n_shards = shards.get(sampler, 1)
+        inputs = [f"sample.{sampler}" if n_shards == 1 else f"sample.{sampler}.{shard:03d}" for shard in range(n_shards)]
+        units += [{"id": unit_id, "phase": "sample", "kind": "sample", "sampler": sampler, "shard": shard, "shards": n_shards}
+                  for shard, unit_id in enumerate(inputs)]
+        units.append({"id": f"merge.{sampler}", "phase": "merge", "kind": "merge", "inputs": inputs,
+                      "file": os.path.join(os.path.abspath(out_dir), f"{sampler}_samples")})
+        training_sets.append((sampler, f"merge.{sampler}"))
+    units.append({"id": "prepare.test", "phase": "merge", "kind": "prepare", "file": os.path.abspath(test), "train": False})
+    for file_path in datasets:
+        name = dataset_name(file_path)
+        units.append({"id": f"prepare.{name}", "phase": "merge", "kind": "prepare", "file": os.path.abspath(file_path), "train": True})
+        training_sets.append((name, f"prepare.{name}"))
+    units += [{"id": f"train.{name}.{classifier}", "phase": "train", "kind": "train", "dataset": name,
+               "classifier": classifier, "inputs": [source, "prepare.test"]}
+              for name, source in training_sets for classifier in classifiers]
+
+    ids = [unit["id"] for unit in units]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Datasets named more than once: {sorted({unit_id for unit_id in ids if ids.count(unit_id) > 1})}")
+
+    sweep = {
+        "settings": {"data": os.path.abspath(data), "cache_dir": os.path.abspath(cache_dir or CACHE_DIR),
+                     "n_features": n_features, "label": label, "cache": cache},
+        "units": units,
+    }
+    sweep_path = os.path.join(sweep_dir, "sweep.json")
+    if os.path.exists(sweep_path):
+        if read_json(sweep_path) != sweep:
+            raise ValueError(f"{sweep_dir} holds a different sweep, plan this one in a new directory")
+        return units
+    os.makedirs(os.path.join(sweep_dir, "units"), exist_ok=True)
+    write_json(sweep, sweep_path)
+    return units
+
+def load_sweep(sweep_dir) -> tuple:
+    """Settings and units (by ID, in phase order) of a planned sweep"""
+    sweep = read_json(os.path.join(sweep_dir, "sweep.json"))
+    return sweep["settings"], {unit["id"]: unit for unit in sweep["units"]}
+
+def unit_path(sweep_dir, unit_id, file_name="") -> str:
+    return os.path.join(sweep_dir, "units", unit_id, file_name)
+
+def unit_state(sweep_dir, unit_id) -> str:
+    """"done", "failed" (raised an error, or was killed in a local run) or "pending" (never run, or killed on Slurm)"""
+    if os.path.exists(unit_path(sweep_dir, unit_id, "done.json")):
+        return "done"
+    if os.path.exists(unit_path(sweep_dir, unit_id, "failed.json")):
+        return "failed"
+    return "pending"
+
+def pending_units(sweep_dir, phase) -> list:
+    """Units of a phase that are not done, the ones a run or a resubmission (re)starts"""
+    _, units = load_sweep(sweep_dir)
+    return [unit_id for unit_id, unit in units.items() if unit["phase"] == phase and unit_state(sweep_dir, unit_id) != "done"]
+
+def finished_inputs(sweep_dir, unit) -> list:
+    """done.json of each input of a unit, raising if one is not done (e.g. its shard failed)"""
+    missing = [unit_id for unit_id in unit["inputs"] if unit_state(sweep_dir, unit_id) != "done"]
+    if missing:
+        raise RuntimeError(f"{unit['id']} needs units that are not done: {', '.join(missing)}")
+    return [read_json(unit_path(sweep_dir, unit_id, "done.json")) for unit_id in unit["inputs"]]
+
+#########################---Units--################
+
+def run_sample(sweep_dir, settings, unit) -> dict:
+    """Resample the training set, or one shard of it, with one sampler"""
+    label = settings["label"]
+    meta_data = load_frame(settings["data"])
+    dtypes = meta_data.dtypes.drop(label)
+    if unit["shards"] > 1:
+        meta_data = meta_data.iloc[shard_rows(meta_data[label].to_numpy(), unit["shards"], unit["shard"])]
+    X = meta_data.drop(columns=[label]).to_numpy(dtype=np.float64)
+    y = meta_data[label].to_numpy()
+    del meta_data
+
+    X_resampled, y_resampled = make_sampler(unit["sampler"], settings["cache"]).fit_resample(X, y)
+    path = write_samples(unit["sampler"], np.asarray(X_resampled), np.asarray(y_resampled), dtypes,
+                         unit_path(sweep_dir, unit["id"]), label)
+    return {"file": path, "rows_in": len(y), "rows_out": len(y_resampled)}
+
+def run_prepare(sweep_dir, settings, unit) -> dict:
+    """Preprocess one file into the experiments cache"""
+    directory = prepare((unit["file"], settings["cache_dir"], settings["label"], unit["train"]))
+    return {"file": unit["file"], "cache_dir": directory}
+
+def run_merge(sweep_dir, settings, unit) -> dict:
+    """Join a sampler's shards, in shard order, into its `<sampler>_samples` file and preprocess it"""
+    shards = [load_frame(done["file"]) for done in finished_inputs(sweep_dir, unit)]
+    os.makedirs(os.path.dirname(unit["file"]), exist_ok=True)
+    path = save_frame(pd.concat(shards, ignore_index=True), unit["file"])
+    return dict(run_prepare(sweep_dir, settings, dict(unit, file=path, train=True)), rows=sum(len(shard) for shard in shards))
+
+def run_train(sweep_dir, settings, unit) -> dict:
+    """Fit and score one classifier on one training set, see `experiments.run_cell`"""
+    train, test = finished_inputs(sweep_dir, unit)
+    row = run_cell((unit["dataset"], unit["classifier"], train["cache_dir"], test["cache_dir"], settings["n_features"]))
+    return {"row": row}
+
+UNIT_KINDS = {"sample": run_sample, "merge": run_merge, "prepare": run_prepare, "train": run_train}
+
+def run_unit(sweep_dir, unit_id) -> dict:
+    """
+    Run one unit unless it is already done. Its outputs go to `units/<id>/`, done.json last, so a unit that raised
+    (recorded in failed.json) or was killed (e.g. at the Slurm time limit) is not done and is run again next time.
+
+    RETURNS
+    dict - the unit's done.json: its outputs, seconds, peak_rss_mb (of the process) and host
+    """
+    import resource
+    settings, units = load_sweep(sweep_dir)
+    unit = units[unit_id]
+    done_path = unit_path(sweep_dir, unit_id, "done.json")
+    failed_path = unit_path(sweep_dir, unit_id, "failed.json")
+    if os.path.exists(done_path):
+        return read_json(done_path)
+
+    os.makedirs(unit_path(sweep_dir, unit_id), exist_ok=True)
+    start = perf_counter()
+    try:
+        outputs = UNIT_KINDS[unit["kind"]](sweep_dir, settings, unit)
+    except Exception:
+        write_json({"error": traceback.format_exc(), "host": platform.node()}, failed_path)
+        raise
+
+    done = dict(outputs, seconds=perf_counter() - start, host=platform.node(),
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    write_json(done, done_path)
+    if os.path.exists(failed_path):
+        os.remove(failed_path)
+    return done
+
+#########################---Results--################
+
+def sweep_status(sweep_dir) -> pd.DataFrame:
+    """State, time and peak memory of every unit, with the last line of the error of failed ones"""
+    _, units = load_sweep(sweep_dir)
+    rows = []
+    for unit_id, unit in units.items():
+        state = unit_state(sweep_dir, unit_id)
+        row = {"unit": unit_id, "phase": unit["phase"], "state": state, "seconds": np.nan, "peak_rss_mb": np.nan, "error": ""}
+        if state == "done":
+            done = read_json(unit_path(sweep_dir, unit_id, "done.json"))
+            row.update(seconds=done["seconds"], peak_rss_mb=done["peak_rss_mb"])
+        elif state == "failed":
+            row["error"] = read_json(unit_path(sweep_dir, unit_id, "failed.json"))["error"].strip().splitlines()[-1]
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("unit")
+
+def collect_results(sweep_dir, results_path=None) -> pd.DataFrame:
+    """
+    Results table (as `experiments.run_grid` writes it) of the training units done so far, written to
+    `<sweep_dir>/results.parquet` by default. Collecting again after a rerun adds the units that were retried
+    """
+    _, units = load_sweep(sweep_dir)
+    rows = [read_json(unit_path(sweep_dir, unit_id, "done.json"))["row"] for unit_id, unit in units.items()
+            if unit["kind"] == "train" and unit_state(sweep_dir, unit_id) == "done"]
+    if not rows:
+        return pd.DataFrame(columns=["dataset", "classifier"])
+    results = pd.DataFrame(rows).sort_values(["dataset", "classifier"], ignore_index=True)
+    write_results(results, results_path or os.path.join(sweep_dir, "results.parquet"))
+    return results
+
+#########################---Local--################
+
+def run_unit_process(sweep_dir, unit_id) -> tuple:
+    """
+    Run one unit in a python process of its own, with the command a Slurm array task runs, its output going to
+    `logs/<unit>.out`. A unit killed by the system (e.g. out of memory) only takes its own process down, and is
+    recorded in failed.json like a unit that raised.
+
+    RETURNS
+    str, float, str - unit ID, seconds and error (None for a unit that is done)
+    """
+    logs = os.path.join(sweep_dir, "logs")
+    os.makedirs(logs, exist_ok=True)
+    log_path = os.path.join(logs, f"{unit_id}.out")
+    with open(log_path, "w") as log_file:
+        process = subprocess.run([sys.executable, "-u", os.path.abspath(__file__), "run", sweep_dir, unit_id],
+                                 stdout=log_file, stderr=subprocess.STDOUT)
+
+    if unit_state(sweep_dir, unit_id) == "done":
+        return unit_id, read_json(unit_path(sweep_dir, unit_id, "done.json"))["seconds"], None
+    failed_path = unit_path(sweep_dir, unit_id, "failed.json")
+    if process.returncode < 0:
+        error = f"killed by {signal.Signals(-process.returncode).name}, see {log_path}"
+        os.makedirs(unit_path(sweep_dir, unit_id), exist_ok=True)
+        write_json({"error": error, "host": platform.node()}, failed_path)
+    elif os.path.exists(failed_path):
+        error = read_json(failed_path)["error"].strip().splitlines()[-1]
+    else:
+        error = f"exited with code {process.returncode}, see {log_path}"
+    return unit_id, None, error
+
+def run_local(sweep_dir, phases=PHASES, n_jobs=None, printing=True) -> pd.DataFrame:
+    """
+    Run the pending units of a sweep on this machine, phase by phase, each in a process of its own as a Slurm array
+    task would be (see `run_unit_process`), then collect the results. Running it again only retries the units that
+    are not done, whether they raised or were killed.
+
+    PARAMETERS
+    sweep_dir (str) - a sweep planned with `plan_sweep`
+    phases (list of str) - phases to run, all of `PHASES` by default
+    n_jobs (int) - number of units run at once, defaults to one per CPU
+
+    RETURNS
+    pd.DataFrame - `sweep_status` after the run
+    """
+    for phase in phases:
+        pending = pending_units(sweep_dir, phase)
+        if (printing): print(f"{phase}: {len(pending)} units to run")
+        if not pending:
+            continue
+        # the threads only wait on the unit processes
+        with ThreadPoolExecutor(max_workers=min(n_jobs or os.cpu_count(), len(pending))) as executor:
+            futures = [executor.submit(run_unit_process, sweep_dir, unit_id) for unit_id in pending]
+            for future in as_completed(futures):
+                unit_id, seconds, error = future.result()
+                if (printing): print(f"{unit_id:<40} " + (f"{seconds:>8.1f}s" if error is None else f"FAILED {error}"))
+
+    collect_results(sweep_dir)
+    return sweep_status(sweep_dir)
+
+#########################---Slurm--################
+
+def slurm_script(job_name, command, logs, partition="cpu", time="1-00:00:00", cpus=4, memory=None, n_tasks=None,
+                 max_parallel=None, environment=SLURM_ENVIRONMENT) -> str:
+    """Batch script in the layout of bc4_template.sh running `command`, as a job array of `n_tasks` tasks if given"""
+    lines = [
+        "#!/usr/bin/env bash",
+        f"#SBATCH --job-name={job_name}",
+        f"#SBATCH --partition={partition}",
+        f"#SBATCH --time={time}",
+        "#SBATCH --nodes 1",
+        "#SBATCH --ntasks-per-node=1",
+        f"#SBATCH --cpus-per-task={cpus}",
+    ]
+    if memory:
+        lines.append(f"#SBATCH --mem {memory}")
+    if n_tasks is None:
+        lines.append(f"#SBATCH --output={logs}/%x_%j.out")
+    else:
+        lines.append(f"#SBATCH --array=0-{n_tasks - 1}" + (f"%{max_parallel}" if max_parallel else ""))
+        lines.append(f"#SBATCH --output={logs}/%x_%A_%a.out")
+    lines += [
+        "",
+        "# Written by launcher.py for the units pending when it ran. Write the scripts again rather than resubmitting this one",
+        "",
+        "module purge",
+        environment,
+        "",
+        command,
+        "",
+    ]
+    return "\n".join(lines)
+
+def write_slurm(sweep_dir, partition="cpu", time="1-00:00:00", cpus=4, memory=None, max_parallel=None,
+                environment=SLURM_ENVIRONMENT) -> str:
+    """
+    Write a job-array script per phase for the units still pending, a job collecting the results and `submit.sh`,
+    which submits them so that each starts once the previous one has ended. Failed units do not stop the later
+    phases (their dependants fail too): writing and submitting the scripts again retries just what is not done.
+
+    Array task i of a phase runs line i of `slurm/<phase>.units`.
+
+    RETURNS
+    str - path of submit.sh
+    """
+    sweep_dir = os.path.abspath(sweep_dir)
+    slurm_dir = os.path.join(sweep_dir, "slurm")
+    logs = os.path.join(sweep_dir, "logs")
+    os.makedirs(slurm_dir, exist_ok=True)
+    os.makedirs(logs, exist_ok=True)
+    launcher = f"python -u {os.path.abspath(__file__)}"
+    options = dict(partition=partition, time=time, cpus=cpus, memory=memory, environment=environment)
+
+    jobs = []
+    for phase in PHASES:
+        pending = pending_units(sweep_dir, phase)
+        if not pending:
+            continue
+        with open(os.path.join(slurm_dir, f"{phase}.units"), "w") as units_file:
+            units_file.write("\n".join(pending) + "\n")
+        command = f"{launcher} run {sweep_dir} --phase {phase} --index $SLURM_ARRAY_TASK_ID"
+        jobs.append((phase, slurm_script(f"ads_{phase}", command, logs, n_tasks=len(pending), max_parallel=max_parallel, **options)))
+    jobs.append(("collect", slurm_script("ads_collect", f"{launcher} collect {sweep_dir}", logs, **dict(options, cpus=1))))
+
+    submit = ["#!/usr/bin/env bash", f"# Submit the pending units of {sweep_dir}", "set -e", "previous="]
+    for phase, script in jobs:
+        script_path = os.path.join(slurm_dir, f"{phase}.sh")
+        with open(script_path, "w") as script_file:
+            script_file.write(script)
+        submit.append(f'previous=$(sbatch --parsable ${{previous:+--dependency=afterany:$previous}} {script_path} | cut -d ";" -f 1)')
+        submit.append(f'echo "{phase} $previous"')
+
+    submit_path = os.path.join(slurm_dir, "submit.sh")
+    with open(submit_path, "w") as submit_file:
+        submit_file.write("\n".join(submit) + "\n")
+    os.chmod(submit_path, 0o755)
+    return submit_path
+
+if __name__ == "__main__":
+    # e.g. "python launcher.py plan data/sweeps/all --samplers SMOTE ADASYN MWMOTE --shards MWMOTE=8"
+    #      "python launcher.py local data/sweeps/all --jobs 4" to run it here, or
+    #      "python launcher.py slurm data/sweeps/all --time 2-00:00:00 --mem 32GB" and "bash data/sweeps/all/slurm/submit.sh"
+    #      Rerun either to retry the units that failed or never finished, "python launcher.py status data/sweeps/all" lists them
+    parser = argparse.ArgumentParser(description="Split a sampler x classifier sweep into work units and run them locally or as Slurm job arrays")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan = commands.add_parser("plan", help="split a sweep into units")
+    plan.add_argument("sweep")
+    plan.add_argument("--data", default="data/meta_features_train")
+    plan.add_argument("--test", default="data/meta_features_test")
+    plan.add_argument("--samplers", nargs="*", default=[], help=f"any of {', '.join(SAMPLERS)}")
+    plan.add_argument("--classifiers", nargs="*", default=CLASSIFIERS, help=f"any of {', '.join(CLASSIFIERS)}")
+    plan.add_argument("--datasets", nargs="*", default=[], help="resampled training sets to train on as they are")
+    plan.add_argument("--shards", nargs="*", default=[], help=f"e.g. MWMOTE=8, for any of {', '.join(SHARDABLE)}")
+    plan.add_argument("--out", default="data")
+    plan.add_argument("--cache-dir", default=None)
+    plan.add_argument("--features", type=int, default=10)
+    plan.add_argument("--knn-cache", action="store_true", help="reuse k-NN graphs from data/knn_cache")
+
+    local = commands.add_parser("local", help="run the pending units in a process pool")
+    local.add_argument("sweep")
+    local.add_argument("--phases", nargs="*", default=PHASES)
+    local.add_argument("--jobs", type=int, default=None)
+
+    slurm = commands.add_parser("slurm", help="write job-array scripts for the pending units")
+    slurm.add_argument("sweep")
+    slurm.add_argument("--partition", default="cpu")
+    slurm.add_argument("--time", default="1-00:00:00")
+    slurm.add_argument("--cpus", type=int, default=4)
+    slurm.add_argument("--mem", default=None, help="e.g. 16GB")
+    slurm.add_argument("--max-parallel", type=int, default=None, help="most array tasks running at once")
+    slurm.add_argument("--environment", default=SLURM_ENVIRONMENT, help="line loading python, e.g. a conda activate")
+
+    run = commands.add_parser("run", help="run one unit (what the array tasks call)")
+    run.add_argument("sweep")
+    run.add_argument("unit", nargs="?", help="unit ID")
+    run.add_argument("--phase", choices=PHASES)
+    run.add_argument("--index", type=int, help="line of slurm/<phase>.units")
+
+    commands.add_parser("status", help="state of every unit").add_argument("sweep")
+    commands.add_parser("collect", help="gather the results of the finished training units").add_argument("sweep")
+    args = parser.parse_args()
+
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.max_rows", None):
+        if args.command == "plan":
+            shards = {name: int(n_shards) for name, n_shards in (shard.split("=") for shard in args.shards)}
+            units = plan_sweep(args.sweep, args.data, args.test, args.samplers, args.classifiers, args.datasets, shards,
+                               args.out, args.cache_dir, args.features, cache=args.knn_cache)
+            print(pd.Series([unit["phase"] for unit in units]).value_counts(sort=False).rename("units"))
+        elif args.command == "local":
+            status = run_local(args.sweep, args.phases, args.jobs)
+            print(status["state"].value_counts())
+            if (status["state"] != "done").any():
+                sys.exit(1)
+        elif args.command == "slurm":
+            print(write_slurm(args.sweep, args.partition, args.time, args.cpus, args.mem, args.max_parallel, args.environment))
+        elif args.command == "run":
+            if args.unit is None:
+                if args.phase is None or args.index is None:
+                    parser.error("give a unit ID, or --phase and --index")
+                with open(os.path.join(args.sweep, "slurm", f"{args.phase}.units")) as units_file:
+                    args.unit = units_file.read().split()[args.index]
+            print(args.unit, run_unit(args.sweep, args.unit)["seconds"])
+        elif args.command == "status":
+            print(sweep_status(args.sweep))
+        else:
+            print(collect_results(args.sweep).drop(columns=["train_key", "test_key", "features"], errors="ignore"))
@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+import numpy as np
+
+from time import perf_counter
+from storage import load_frame
+
+async def request(reader, writer, method, path, body=b"") -> tuple:
+    """One HTTP/1.1 request on an open keep-alive connection, returning the status and the decoded JSON body"""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, value = line.decode("latin-1").split(":", 1)
+        if key.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+async def client(host, port, path, bodies, deadline, latencies, errors):
+    """Send the bodies in turn over one connection until `deadline`, recording each request's latency"""
+    reader, writer = await asyncio.open_connection(host, port)
+    position = 0
+    while perf_counter() < deadline:
+        start = perf_counter()
+        status, _ = await request(reader, writer, "POST", path, bodies[position % len(bodies)])
+        latencies.append(perf_counter() - start)
+        errors[0] += status != 200
+        position += 1
+    writer.close()
+
+async def run_load(host, port, model, transactions, connections=32, duration=10.0, per_request=1) -> dict:
+    """
+    Keep `connections` concurrent clients sending scoring requests for `duration` seconds.
+
+    PARAMETERS
+    transactions (list of dict) - transactions sent in turn
+    connections (int) - concurrent keep-alive connections, each with one request in flight
+    duration (float) - seconds to run for
+    per_request (int) - transactions in each request body
+
+    RETURNS
+    dict - client-side request count, errors, throughput and p50/p99 latency, and the service's own /stats
+    """
+    bodies = [json.dumps(transactions[start:start + per_request]).encode()
+              for start in range(0, len(transactions) - per_request + 1, per_request)]
+    latencies, errors = [], [0]
+    # each client starts at a different body so concurrent requests carry different transactions
+    offsets = np.linspace(0, len(bodies), connections, endpoint=False).astype(int)
+
+    start = perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[client(host, port, f"/score/{model}", bodies[offset:] + bodies[:offset], deadline, latencies, errors)
+                           for offset in offsets])
+    elapsed = perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(host, port)
+    _, server_stats = await request(reader, writer, "GET", "/stats")
+    writer.close()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "requests_per_s": len(latencies) / elapsed,
+        "transactions_per_s": len(latencies) * per_request / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "server": server_stats,
+    }
+
+if __name__ == "__main__":
+    # e.g. "python load_test.py extra_trees --data data/meta_features_test --connections 64 --duration 30"
+    parser = argparse.ArgumentParser(description="Generate scoring load against a local scoring_service.py")
+    parser.add_argument("model")
+    parser.add_argument("--data", default="data/meta_features_test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--per-request", type=int, default=1)
+    parser.add_argument("--rows", type=int, default=10000, help="number of transactions loaded to send")
+    args = parser.parse_args()
+
+    print("Data ", end="", flush=True)
+    transactions = load_frame(args.data).drop(columns=["is_fraud"]).head(args.rows).to_dict("records")
+    print("LOADED")
+
+    result = asyncio.run(run_load(args.host, args.port, args.model, transactions, args.connections, args.duration, args.per_request))
+    server = result.pop("server")
+    print(f"client  {result['requests']} requests, {result['errors']} errors, {result['requests_per_s']:.0f} req/s, "
+          f"{result['transactions_per_s']:.0f} transactions/s, p50 {result['p50_ms']:.2f}ms, p99 {result['p99_ms']:.2f}ms")
+    print(f"server  p50 {server['p50_ms']:.2f}ms, p99 {server['p99_ms']:.2f}ms, mean batch {server['mean_batch_size']:.1f}, "
+          f"{server['requests_per_s']:.0f} req/s since start")
@@ -0,0 +1,169 @@
+import numpy as np
+import faiss
+
+from collections import Counter
+from knn_cache import not_self
+from sklearn.neighbors import NearestNeighbors
+
+def as_float32(X) -> np.ndarray:
+    return np.ascontiguousarray(X, dtype=np.float32)
+
+def take(values, indices):
+    """Rows of a frame, series or array by position, with a fresh index like imblearn's output"""
+    if hasattr(values, "iloc"):
+        return values.iloc[indices].reset_index(drop=True)
+    return np.asarray(values)[indices]
+
+def nearest_neighbours(X, queries, k, backend="sklearn", n_jobs=None, block_size=65536) -> np.ndarray:
+    """
+    Indices (in X) of the k nearest neighbours of each query, searched in blocks of `block_size` queries.
+
+    PARAMETERS
+    backend (str) - "sklearn" for NearestNeighbors in float64 with n_jobs threads, "faiss" for a multi-threaded flat
+                    faiss index in float32, which is faster but reorders the neighbours of unscaled features (raw
+                    `unix_time` is about 1.5e9), so only use it on standardised data
+    n_jobs (int) - threads for the sklearn backend (faiss uses all cores)
+    """
+    if backend == "faiss":
+        index = faiss.IndexFlatL2(X.shape[1])
+        index.add(as_float32(X))
+        search = lambda block: index.search(as_float32(block), k)[1]
+    elif backend == "sklearn":
+        nn = NearestNeighbors(n_neighbors=k, n_jobs=n_jobs).fit(X)
+        search = lambda block: nn.kneighbors(block, return_distance=False)
+    else:
+        raise ValueError(f"Unknown backend {backend}, expected faiss or sklearn")
+
+    neighbours = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), block_size):
+        neighbours[start:start + block_size] = search(queries[start:start + block_size])
+    return neighbours
+
+class BatchEditedNN:
+    """
+    Edited Nearest Neighbours undersampling (as imblearn's EditedNearestNeighbours with the default "auto" strategy):
+    a sample of a non-minority class is dropped unless its n_neighbors nearest neighbours agree with its class.
+
+    PARAMETERS
+    n_neighbors (int) - neighbourhood size, not counting the sample itself
+    kind_sel (str) - "all" keeps a sample only if every neighbour agrees, "mode" if most do
+    backend (str) - neighbour search backend, see `nearest_neighbours`, or "cache" to read the shared graph of
+                    `knn_cache.neighbour_graph`
+    n_jobs (int) - threads for the sklearn backend and for building the cached graph
+    block_size (int) - samples queried per block
+    """
+    def __init__(self, n_neighbors=3, kind_sel="all", backend="sklearn", n_jobs=None, block_size=65536):
+        self.n_neighbors = n_neighbors
+        self.kind_sel = kind_sel
+        self.backend = backend
+        self.n_jobs = n_jobs
+        self.block_size = block_size
+
+    def fit_resample(self, X, y):
+        y_values = np.asarray(y)
+        counts = Counter(y_values)
+        class_minority = min(counts, key=counts.get)
+
+        candidates = np.flatnonzero(y_values != class_minority)
+        # neighbours of each sample besides itself
+        if self.backend == "cache":
+            from knn_cache import neighbour_graph
+            neighbours = neighbour_graph(np.asarray(X), self.n_neighbors + 1, n_jobs=self.n_jobs).neighbours_of_rows(self.n_neighbors, candidates)[1]
+        else:
+            neighbours = nearest_neighbours(X, np.asarray(X)[candidates], self.n_neighbors + 1, self.backend, self.n_jobs, self.block_size)
+            neighbours = neighbours[not_self(neighbours, candidates)].reshape(len(candidates), self.n_neighbors)
+        agree = y_values[neighbours] == y_values[candidates, None]
+
+        if self.kind_sel == "all":
+            keep = agree.all(axis=1)
+        else:
+            keep = agree.sum(axis=1) * 2 > self.n_neighbors
+
+        # grouped by class like imblearn's output
+        kept = candidates[keep]
+        self.sample_indices_ = np.concatenate([np.flatnonzero(y_values == target_class) if target_class == class_minority
+                                               else kept[y_values[kept] == target_class] for target_class in np.unique(y_values)])
+        return take(X, self.sample_indices_), take(y, self.sample_indices_)
+
+class BatchCondensedNN:
+    """
+    Condensed Nearest Neighbour undersampling (Hart's rule, as imblearn's CondensedNearestNeighbour with 1-NN).
+
+    Prototypes start as the minority class plus one random sample of each other class. The other samples are scanned
+    in order and a sample becomes a prototype when its nearest prototype is of another class. Instead of a 1-NN query
+    and refit per sample, each block of candidates is queried against the prototypes at once, and the index is only
+    refitted after blocks that added some. Only the misclassified candidates of a block are then resolved in order,
+    against each other, which gives the same prototypes as the one-at-a-time scan. Distances are float64 and taken
+    from coordinate differences, as the raw features are too large for float32 or the expanded |a|^2 + |b|^2 - 2ab.
+
+    PARAMETERS
+    n_passes (int) - scans over the candidates, later passes only add samples still misclassified
+    block_size (int) - candidates queried per block
+    random_state (int) - seed for the starting sample of each class (drawn as imblearn draws it)
+    n_jobs (int) - threads for the prototype searches
+    """
+    def __init__(self, n_passes=1, block_size=4096, random_state=None, n_jobs=None):
+        self.n_passes = n_passes
+        self.block_size = block_size
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+
+    def condense(self, X, y_values, candidates, prototypes):
+        """Scan `candidates` once and return them with the prototypes grown by the misclassified ones"""
+        X = np.asarray(X, dtype=np.float64)
+        index = NearestNeighbors(n_neighbors=1, n_jobs=self.n_jobs).fit(X[prototypes])
+        labels = y_values[prototypes]
+        added = []
+
+        for start in range(0, len(candidates), self.block_size):
+            block = candidates[start:start + self.block_size]
+            distances, nearest = index.kneighbors(X[block])
+            wrong = np.flatnonzero(labels[nearest[:, 0]] != y_values[block])
+            if len(wrong) == 0:
+                continue
+
+            # a misclassified candidate is fixed by an earlier one added from this block if that one is closer
+            # than its nearest prototype and has its class
+            X_wrong = X[block[wrong]]
+            y_wrong = y_values[block[wrong]]
+            take_block = np.zeros(len(wrong), dtype=bool)
+            for i in range(len(wrong)):
+                taken = np.flatnonzero(take_block[:i] & (y_wrong[:i] == y_wrong[i]))
+                squares = ((X_wrong[taken] - X_wrong[i]) ** 2).sum(axis=1)
+                take_block[i] = not (np.sqrt(squares) < distances[wrong[i], 0]).any()
+
+            new = block[wrong[take_block]]
+            added.append(new)
+            labels = np.concatenate([labels, y_values[new]])
+            index = NearestNeighbors(n_neighbors=1, n_jobs=self.n_jobs).fit(X[np.concatenate([prototypes] + added)])
+
+        return np.concatenate([prototypes] + added)
+
+    def fit_resample(self, X, y):
+        X_values = np.asarray(X)
+        y_values = np.asarray(y)
+        counts = Counter(y_values)
+        class_minority = min(counts, key=counts.get)
+        random_state = np.random.RandomState(self.random_state)
+
+        minority = np.flatnonzero(y_values == class_minority)
+        kept = []
+        for target_class in np.unique(y_values):
+            if target_class == class_minority:
+                kept.append(minority)
+                continue
+            idx_maj = np.flatnonzero(y_values == target_class)
+            seed = idx_maj[random_state.randint(low=0, high=len(idx_maj), size=1)]
+
+            prototypes = np.concatenate([minority, seed])
+            candidates = idx_maj[idx_maj != seed[0]]
+            for _ in range(self.n_passes):
+                n_before = len(prototypes)
+                prototypes = self.condense(X_values, y_values, candidates, prototypes)
+                candidates = np.setdiff1d(candidates, prototypes[n_before:], assume_unique=True)
+                if len(prototypes) == n_before:
+                    break
+            kept.append(prototypes[len(minority):])
+
+        self.sample_indices_ = np.concatenate(kept)
+        return take(X, self.sample_indices_), take(y, self.sample_indices_)
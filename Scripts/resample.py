@@ -0,0 +1,153 @@
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+
+from instrument import record, stage
+from time import perf_counter, process_time
+from storage import load_frame, save_frame
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Sampling"))
+
+SAMPLERS = ["ADASYN", "SMOTE", "SMOTEENN", "CondensedNN", "EditedNN", "CSMOUTE", "MWMOTE"]
+
+def make_sampler(name, cache=False):
+    """
+    A new sampler with `fit_resample(X, y)` for one of `SAMPLERS`. With `cache` the neighbour searches read the shared
+    graphs of `knn_cache` (CondensedNN grows its own prototype index and always searches)
+    """
+    import imblearn
+    from knn_cache import CachedNearestNeighbors
+
+    # imblearn asks for one neighbour more than it uses, the sample itself
+    neighbours = lambda k: CachedNearestNeighbors(k + 1) if cache else k
+
+    if name == "ADASYN": return imblearn.over_sampling.ADASYN(n_neighbors=neighbours(5))
+    if name == "SMOTE": return imblearn.over_sampling.SMOTE(k_neighbors=neighbours(5))
+    if name == "SMOTEENN":
+        return imblearn.combine.SMOTEENN(smote=imblearn.over_sampling.SMOTE(k_neighbors=neighbours(5)),
+                                         enn=imblearn.under_sampling.EditedNearestNeighbours(sampling_strategy="all", n_neighbors=neighbours(3)))
+    if name == "CondensedNN":
+        from prototype_selection import BatchCondensedNN
+        return BatchCondensedNN(random_state=0)
+    if name == "EditedNN":
+        from prototype_selection import BatchEditedNN
+        return BatchEditedNN(n_neighbors=3, backend="cache" if cache else "sklearn")
+    if name == "CSMOUTE":
+        from CSMOUTE import CSMOUTESampler
+        return CSMOUTESampler(ratio=0.9, cache=cache, random_state=0)
+    if name == "MWMOTE":
+        from mwmote_sampler import MWMOTE
+        return MWMOTE(random_state=0, cache=cache)
+    raise ValueError(f"Unknown sampler {name}, expected any of {SAMPLERS}")
+
+def share_features(meta_data, directory, label="is_fraud") -> tuple:
+    """
+    Write the feature matrix and labels as .npy files that every worker memory-maps, so the data is parsed once and
+    its pages are shared between processes instead of being copied into each one.
+
+    RETURNS
+    str, str - paths of the feature and label arrays
+    """
+    X_path = os.path.join(directory, "X.npy")
+    y_path = os.path.join(directory, "y.npy")
+    np.save(X_path, meta_data.drop([label], axis=1).to_numpy(dtype=np.float64))
+    np.save(y_path, meta_data[label].to_numpy())
+    return X_path, y_path
+
+def run_sampler(task) -> tuple:
+    """
+    Resample the memory-mapped features with one sampler. Runs in a fresh worker process so the peak RSS it reports
+    belongs to this sampler alone.
+
+    RETURNS
+    str, np.ndarray, np.ndarray, float, float, float - sampler name, resampled X and y, wall time (s), CPU time (s)
+                                                      and peak RSS (MB)
+    """
+    import resource
+    name, X_path, y_path, cache = task
+
+    X = np.load(X_path, mmap_mode="r")
+    y = np.load(y_path, mmap_mode="r")
+    start, cpu_start = perf_counter(), process_time()
+    X_resampled, y_resampled = make_sampler(name, cache).fit_resample(X, y)
+    elapsed, cpu = perf_counter() - start, process_time() - cpu_start
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return name, np.asarray(X_resampled), np.asarray(y_resampled), elapsed, cpu, peak_rss
+
+def write_samples(name, X_resampled, y_resampled, dtypes, out_dir, label="is_fraud") -> str:
+    """
+    Save one sampler's output as `<out_dir>/<name>_samples`, in the layout the sampling scripts wrote. CSMOUTE too is
+    written as one file of both classes, the `CSMOUTE_samples` the notebooks read and the experiments train on, where
+    CSMOUTE.py writes the classes apart as `CSMOUTE_non_fraud_samples` and `CSMOUTE_fraud_samples`
+
+    dtypes (pd.Series) - dtype of each feature column of the input. The samplers work on float64 arrays, so the
+                         columns are cast back with `astype` as imblearn casts its DataFrame output (integer columns
+                         are truncated, not rounded)
+    """
+    X = pd.DataFrame(X_resampled, columns=dtypes.index).astype(dtypes)
+    X[label] = y_resampled
+    return save_frame(X, os.path.join(out_dir, f"{name}_samples"))
+
+def resample_all(file_path, samplers, out_dir, n_jobs=None, label="is_fraud", cache=False, printing=True) -> pd.DataFrame:
+    """
+    Run the given samplers concurrently over one load of the training meta features and write each result.
+
+    PARAMETERS
+    file_path (str) - meta features to resample, read with `load_frame`
+    samplers (list of str) - names from `SAMPLERS`
+    out_dir (str) - directory for the `<name>_samples` outputs
+    n_jobs (int) - number of samplers run at once, defaults to one per CPU
+    label (str) - label column
+    cache (bool) - share k-NN graphs between samplers and runs through `knn_cache`
+
+    RETURNS
+    pd.DataFrame - wall time (s), peak RSS (MB) and output rows per sampler
+    """
+    unknown = set(samplers) - set(SAMPLERS)
+    if unknown:
+        raise ValueError(f"Unknown samplers {sorted(unknown)}, expected any of {SAMPLERS}")
+
+    with stage("load") as timing:
+        if (printing): print("Data ",end="",flush=True)
+        meta_data = load_frame(file_path)
+        dtypes = meta_data.dtypes.drop(label)
+        rows = timing.rows_out = len(meta_data)
+        if (printing): print("LOADED")
+
+    # created before any sampler runs, so a bad path cannot lose their results
+    os.makedirs(out_dir, exist_ok=True)
+    report = []
+    with tempfile.TemporaryDirectory() as directory:
+        X_path, y_path = share_features(meta_data, directory, label)
+        del meta_data
+
+        # one task per worker process, so each sampler's peak memory is measured on its own
+        context = mp.get_context("spawn")
+        with context.Pool(processes=n_jobs or min(len(samplers), os.cpu_count()), maxtasksperchild=1) as pool:
+            tasks = [(name, X_path, y_path, cache) for name in samplers]
+            for name, X_resampled, y_resampled, elapsed, cpu, peak_rss in pool.imap_unordered(run_sampler, tasks):
+                # measured in the worker, which does not trace itself
+                record(name, elapsed, cpu, peak_rss, rows_in=rows, rows_out=len(y_resampled))
+                with stage(f"{name}/write"):
+                    path = write_samples(name, X_resampled, y_resampled, dtypes, out_dir, label)
+                report.append({"sampler": name, "seconds": elapsed, "peak_rss_mb": peak_rss, "rows": len(y_resampled)})
+                if (printing): print(f"{name:<12} {elapsed:>8.1f}s {peak_rss:>8.0f}MB  -> {path}")
+
+    return pd.DataFrame(report).set_index("sampler")
+
+if __name__ == "__main__":
+    # e.g. "python resample.py SMOTE ADASYN --data data/meta_features_train --out data", all samplers by default
+    parser = argparse.ArgumentParser(description="Run the resampling methods over one load of the meta features")
+    parser.add_argument("samplers", nargs="*", help=f"any of {', '.join(SAMPLERS)}")
+    parser.add_argument("--data", default="data/meta_features_train")
+    parser.add_argument("--out", default="data")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--cache", action="store_true", help="reuse k-NN graphs from data/knn_cache")
+    args = parser.parse_args()
+
+    print(resample_all(args.data, args.samplers or SAMPLERS, args.out, args.jobs, cache=args.cache))
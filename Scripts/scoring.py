@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from forest_arrays import FlatForest, export_forest
+from storage import load_frame
+
+class Preprocessor:
+    """
+    The scaling and encoding of ads_model_pipeline.ipynb, fitted once on the training set and then applied to any
+    number of transactions: numeric features are standard-scaled and the others label-encoded.
+
+    The notebook refits both on every frame it scores, which cannot work for one transaction at a time, so the
+    service reuses the training set's means, scales and classes. `fit(df).transform(df)` gives the same matrix as
+    `experiments.preprocess(df)`. Categories not seen in training are encoded as -1.
+    """
+    def __init__(self, label="is_fraud"):
+        self.label = label
+        self.numeric = []
+        self.mean = np.empty(0)
+        self.scale = np.empty(0)
+        self.classes = {}
+
+    def fit(self, df):
+        numeric = df.select_dtypes(include=[np.number]).drop(columns=[self.label])
+        self.numeric = list(numeric.columns)
+        self.mean = numeric.mean().to_numpy(dtype=np.float64)
+        # StandardScaler's population standard deviation, with constant columns left unscaled
+        scale = numeric.std(ddof=0).to_numpy(dtype=np.float64)
+        self.scale = np.where(scale == 0, 1.0, scale)
+        self.classes = {column: sorted(df[column].astype(str).unique()) for column in df.select_dtypes(exclude=[np.number]).columns}
+        return self
+
+    @property
+    def columns(self) -> list:
+        return self.numeric + list(self.classes)
+
+    def transform(self, df) -> pd.DataFrame:
+        scaled = pd.DataFrame((df[self.numeric].to_numpy(dtype=np.float64) - self.mean) / self.scale,
+                              index=df.index, columns=self.numeric)
+        for column, classes in self.classes.items():
+            scaled[column] = pd.Index(classes).get_indexer(df[column].astype(str))
+        return scaled
+
+    def to_dict(self) -> dict:
+        return {"label": self.label, "numeric": self.numeric, "mean": self.mean.tolist(), "scale": self.scale.tolist(),
+                "classes": self.classes}
+
+    @classmethod
+    def from_dict(cls, saved):
+        preprocessor = cls(saved["label"])
+        preprocessor.numeric = saved["numeric"]
+        preprocessor.mean = np.asarray(saved["mean"], dtype=np.float64)
+        preprocessor.scale = np.asarray(saved["scale"], dtype=np.float64)
+        preprocessor.classes = saved["classes"]
+        return preprocessor
+
+class ScoringModel:
+    """
+    A trained classifier with the preprocessing and feature selection it was trained with, saved as a directory of
+    preprocessing.json and one of forest/ (forests, as memory-mapped `FlatForest` arrays), model.joblib (other sklearn
+    classifiers) or model.h5 (keras, needs tensorflow to load).
+
+    PARAMETERS
+    model - fitted sklearn classifier or keras model with one sigmoid output
+    preprocessor (Preprocessor) - fitted on the training set
+    features (list of str) - columns of the preprocessed frame the model was trained on, in order
+    """
+    def __init__(self, model, preprocessor, features):
+        self.model = model
+        self.preprocessor = preprocessor
+        self.features = list(features)
+
+    def matrix(self, transactions) -> np.ndarray:
+        """Preprocessed feature matrix of a list of transaction dicts (or a frame)"""
+        df = transactions if isinstance(transactions, pd.DataFrame) else pd.DataFrame.from_records(transactions)
+        return self.preprocessor.transform(df)[self.features].to_numpy(dtype=np.float64)
+
+    def check(self, transaction):
+        """Raise if a transaction could not be scored: it must be an object with a number for every feature"""
+        if not isinstance(transaction, dict):
+            raise TypeError(f"A transaction must be an object, got {type(transaction).__name__}")
+        missing = [column for column in self.preprocessor.columns if column not in transaction]
+        if missing:
+            raise ValueError(f"Transaction without {', '.join(missing)}")
+        not_numbers = [column for column in self.preprocessor.numeric if not isinstance(transaction[column], (int, float))]
+        if not_numbers:
+            raise ValueError(f"Transaction values that must be numbers: {', '.join(not_numbers)}")
+
+    def predict_proba(self, transactions) -> np.ndarray:
+        """Fraud probability of each transaction"""
+        X = self.matrix(transactions)
+        if hasattr(self.model, "predict_proba"):
+            return self.model.predict_proba(X)[:, 1]
+        # keras: the convolutional models take one channel per feature
+        if len(self.model.input_shape) == 3:
+            X = X.reshape(len(X), X.shape[1], 1)
+        return np.asarray(self.model.predict(X, verbose=0), dtype=np.float64).ravel()
+
+    def save(self, directory):
+        import joblib
+        from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "preprocessing.json"), "w") as f:
+            json.dump({"preprocessor": self.preprocessor.to_dict(), "features": self.features}, f)
+        if isinstance(self.model, (ExtraTreesClassifier, RandomForestClassifier)):
+            export_forest(self.model).save(os.path.join(directory, "forest"))
+        elif isinstance(self.model, FlatForest):
+            self.model.save(os.path.join(directory, "forest"))
+        elif hasattr(self.model, "predict_proba"):
+            joblib.dump(self.model, os.path.join(directory, "model.joblib"))
+        else:
+            self.model.save(os.path.join(directory, "model.h5"))
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "preprocessing.json")) as f:
+            saved = json.load(f)
+        if os.path.exists(os.path.join(directory, "forest", "meta.json")):
+            model = FlatForest.load(os.path.join(directory, "forest"))
+        elif os.path.exists(os.path.join(directory, "model.joblib")):
+            import joblib
+            model = joblib.load(os.path.join(directory, "model.joblib"))
+        else:
+            from tensorflow.keras.models import load_model
+            model = load_model(os.path.join(directory, "model.h5"))
+        return cls(model, Preprocessor.from_dict(saved["preprocessor"]), saved["features"])
+
+def train_model(file_path, classifier, out_dir, n_features=10, label="is_fraud", cache_dir=None) -> ScoringModel:
+    """
+    Train one of the `experiments.CLASSIFIERS` on a resampled training set as the grid does (top `n_features` by
+    forest importance, read from the experiment cache) and save it for the scoring service.
+
+    PARAMETERS
+    file_path (str) - resampled training set, e.g. data/SMOTE_samples
+    classifier (str) - name from `experiments.CLASSIFIERS`
+    out_dir (str) - directory the model is saved to
+    """
+    from experiments import CACHE_DIR, load_prepared, make_classifier, prepare, selected_features
+
+    directory = prepare((file_path, cache_dir or CACHE_DIR, label, True))
+    features = selected_features(directory, n_features)
+    X, y, _ = load_prepared(directory, features)
+    model = ScoringModel(make_classifier(classifier).fit(X, y), Preprocessor(label).fit(load_frame(file_path)), features)
+    model.save(out_dir)
+    return model
+
+def keras_model(h5_path, file_path, out_dir, n_features=10, label="is_fraud", cache_dir=None) -> ScoringModel:
+    """Package a keras model trained on the top features of `file_path` (e.g. fcn_model.h5) for the scoring service"""
+    from experiments import CACHE_DIR, prepare, selected_features
+
+    directory = prepare((file_path, cache_dir or CACHE_DIR, label, True))
+    os.makedirs(out_dir, exist_ok=True)
+    shutil.copy(h5_path, os.path.join(out_dir, "model.h5"))
+    with open(os.path.join(out_dir, "preprocessing.json"), "w") as f:
+        json.dump({"preprocessor": Preprocessor(label).fit(load_frame(file_path)).to_dict(),
+                   "features": selected_features(directory, n_features)}, f)
+    return ScoringModel.load(out_dir)
+
+if __name__ == "__main__":
+    # e.g. "python scoring.py data/SMOTE_samples data/models/extra_trees_smote --classifier extra_trees"
+    # or   "python scoring.py data/SMOTE_samples data/models/fcn_smote --keras fcn_model.h5"
+    parser = argparse.ArgumentParser(description="Train and save a model for the scoring service")
+    parser.add_argument("data", help="resampled training set")
+    parser.add_argument("out", help="directory the model is saved to")
+    parser.add_argument("--classifier", default="extra_trees")
+    parser.add_argument("--keras", default=None, help="package this .h5 model instead of training a classifier")
+    parser.add_argument("--features", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.keras:
+        model = keras_model(args.keras, args.data, args.out, args.features)
+    else:
+        model = train_model(args.data, args.classifier, args.out, args.features)
+    print(f"Saved {args.out} ({', '.join(model.features)})")
@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import json
+import numpy as np
+import sys
+import traceback
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from scoring import ScoringModel
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+class ServiceStats:
+    """
+    Request counters and a window of the most recent request latencies, for the /stats endpoint
+
+    PARAMETERS
+    window (int) - number of recent requests the latency percentiles and recent throughput are computed over
+    """
+    def __init__(self, window=100000):
+        self.started = perf_counter()
+        self.requests = 0
+        self.transactions = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_transactions = 0
+        self.finished = deque(maxlen=window)
+        self.latencies = deque(maxlen=window)
+
+    def record_request(self, started, n_transactions, ok=True):
+        now = perf_counter()
+        self.requests += 1
+        self.transactions += n_transactions
+        self.errors += not ok
+        self.finished.append(now)
+        self.latencies.append(now - started)
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batched_transactions += size
+
+    def snapshot(self) -> dict:
+        now = perf_counter()
+        latencies = np.array(self.latencies) * 1000
+        finished = np.array(self.finished)
+        # throughput over the last 10 seconds, or over however much of them the window covers
+        recent = finished[finished >= now - 10]
+        span = min(10, now - self.started)
+        return {
+            "uptime_s": now - self.started,
+            "requests": self.requests,
+            "transactions": self.transactions,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_transactions / self.batches if self.batches else 0.0,
+            "requests_per_s": self.requests / (now - self.started),
+            "recent_requests_per_s": len(recent) / span if span > 0 else 0.0,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+class MicroBatcher:
+    """
+    Collects transactions submitted by concurrent requests and scores them together, so the model runs once per batch
+    instead of once per request. A batch is closed when it holds `max_batch_size` transactions or `max_wait` seconds
+    after its first one arrived, whichever comes first. Scoring runs on a worker thread so the event loop keeps
+    accepting requests, which then queue up for the next batch.
+
+    PARAMETERS
+    model (ScoringModel) - loaded model
+    max_batch_size (int) - most transactions scored at once
+    max_wait (float) - longest a transaction waits for others to join its batch, in seconds
+    stats (ServiceStats) - batch counters are recorded here
+
+    Must be created on the loop that runs it: before Python 3.10 the queue binds to the loop current at creation.
+    """
+    def __init__(self, model, max_batch_size=256, max_wait=0.002, stats=None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = stats
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batch = []
+        self.error = None
+
+    async def score(self, transactions) -> list:
+        """Fraud probabilities of a list of transactions, once the batches holding them have been scored"""
+        if self.error is not None:
+            raise RuntimeError(f"The batcher has stopped: {self.error!r}")
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in transactions]
+        for transaction, future in zip(transactions, futures):
+            self.queue.put_nowait((transaction, future))
+        return await asyncio.gather(*futures)
+
+    async def next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def score_alone(self, transaction):
+        """Score of one transaction, or the error scoring it raised"""
+        loop = asyncio.get_running_loop()
+        try:
+            return float((await loop.run_in_executor(self.executor, self.model.predict_proba, [transaction]))[0])
+        except Exception as error:
+            return error
+
+    def fail(self, error):
+        """Fail the transactions waiting in the queue or in the current batch, once `run` has stopped"""
+        self.error = error
+        pending = [future for _, future in self.batch]
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait()[1])
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError(f"The batcher has stopped: {error!r}"))
+        self.batch = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self.batch = batch = await self.next_batch()
+            transactions = [transaction for transaction, _ in batch]
+            try:
+                scores = await loop.run_in_executor(self.executor, self.model.predict_proba, transactions)
+            except Exception:
+                # requests are checked before they are queued, but a batch shares one call: if it still fails, score
+                # its transactions one by one so the error only reaches the request it came from
+                scores = [await self.score_alone(transaction) for transaction in transactions]
+            if self.stats is not None:
+                self.stats.record_batch(len(batch))
+            for (_, future), score in zip(batch, scores):
+                if future.done():
+                    continue
+                if isinstance(score, Exception):
+                    future.set_exception(score)
+                else:
+                    future.set_result(float(score))
+            self.batch = []
+
+class ScoringService:
+    """
+    Local HTTP/1.1 scoring service (keep-alive, JSON bodies) over `MicroBatcher`s, one per model.
+
+    POST /score/<model>   body: one transaction object or a list of them
+                          returns {"model": ..., "scores": [fraud probability per transaction]}
+    GET  /stats           latency percentiles, throughput and batch counters
+    GET  /models          loaded model names and their features
+    GET  /health
+
+    PARAMETERS
+    models (dict) - name: ScoringModel, loaded once at startup
+    max_batch_size (int), max_wait (float) - micro-batching limits, see `MicroBatcher`
+    """
+    def __init__(self, models, max_batch_size=256, max_wait=0.002):
+        self.models = models
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = ServiceStats()
+        # created by `serve`, on the loop that runs them
+        self.batchers = {}
+        self.tasks = []
+
+    async def route(self, method, path, body) -> tuple:
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            return 200, self.stats.snapshot()
+        if method == "GET" and path == "/models":
+            return 200, {name: model.features for name, model in self.models.items()}
+        if method == "POST" and path.startswith("/score/"):
+            name = path[len("/score/"):]
+            if name not in self.models:
+                return 404, {"error": f"unknown model {name}, loaded: {sorted(self.models)}"}
+            transactions = json.loads(body)
+            if isinstance(transactions, dict):
+                transactions = [transactions]
+            if not isinstance(transactions, list):
+                raise TypeError("The body must be a transaction object or a list of them")
+            # checked before queueing, as the transactions are scored in batches with those of other requests
+            for transaction in transactions:
+                self.models[name].check(transaction)
+            return 200, {"model": name, "scores": await self.batchers[name].score(transactions)}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def handle(self, reader, writer):
+        """Serve the requests of one connection until the client closes it"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                started = perf_counter()
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                n_transactions = 0
+                try:
+                    status, payload = await self.route(method, path, body)
+                    n_transactions = len(payload.get("scores", ()))
+                except (ValueError, KeyError, TypeError) as error:
+                    status, payload = 400, {"error": str(error)}
+                except Exception as error:
+                    status, payload = 500, {"error": repr(error)}
+                if path.startswith("/score/"):
+                    self.stats.record_request(started, n_transactions, status == 200)
+
+                data = json.dumps(payload).encode()
+                writer.write(f"{version} {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close" or version == "HTTP/1.0":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def batcher_stopped(self, name, task):
+        """Report why the batcher of a model stopped and fail the transactions still waiting on it"""
+        if task.cancelled():
+            error = asyncio.CancelledError()
+        else:
+            error = task.exception() or RuntimeError("run returned")
+            print(f"Batcher for {name} stopped:", file=sys.stderr)
+            traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+        self.batchers[name].fail(error)
+
+    async def serve(self, host="127.0.0.1", port=8080, printing=True):
+        for name, model in self.models.items():
+            self.batchers[name] = MicroBatcher(model, self.max_batch_size, self.max_wait, self.stats)
+            task = asyncio.create_task(self.batchers[name].run())
+            task.add_done_callback(lambda task, name=name: self.batcher_stopped(name, task))
+            self.tasks.append(task)
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        if (printing): print(f"Scoring {', '.join(self.models)} on http://{host}:{port}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    # e.g. "python scoring_service.py extra_trees=data/models/extra_trees_smote fcn=data/models/fcn_smote --port 8080"
+    parser = argparse.ArgumentParser(description="Serve trained models over HTTP with micro-batching")
+    parser.add_argument("models", nargs="+", help="name=directory pairs of models saved by scoring.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    models = {}
+    print("Models ", end="", flush=True)
+    for pair in args.models:
+        name, _, directory = pair.partition("=")
+        models[name] = ScoringModel.load(directory or name)
+    print("LOADED")
+
+    service = ScoringService(models, args.max_batch_size, args.max_wait_ms / 1000)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
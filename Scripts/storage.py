@@ -0,0 +1,128 @@
+import os
+import sys
+import pandas as pd
+
+from time import perf_counter
+
+# Format used by `save_frame` when the path has no extension. CSV keeps the notebooks working, set ADS_DATA_FORMAT=parquet
+# (or feather) to write the smaller binary formats instead
+DEFAULT_FORMAT = os.environ.get("ADS_DATA_FORMAT", "csv")
+# Extensions tried by `load_frame` when the path has no extension, the order breaks ties between equally new files
+FORMATS = ["parquet", "feather", "csv"]
+# Feather cannot store a pandas index, so it is written as this column and restored on load
+INDEX_COLUMN = "__index__"
+
+def compact_dtypes(df : pd.DataFrame, float_dtype="float32", categories=()) -> pd.DataFrame:
+    """
+    Downcast columns to the smallest dtype that holds them: integer codes and counts to the smallest int that fits
+    their values, floats to `float_dtype` and the given columns to pandas categoricals.
+
+    PARAMETERS
+    df (pd.DataFrame) - frame to compact, not modified
+    float_dtype (str) - dtype for float columns, "float64" keeps full precision
+    categories (iterable of str) - columns to store as categoricals
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in categories:
+            df[column] = df[column].astype("category")
+        elif pd.api.types.is_integer_dtype(df[column]) or pd.api.types.is_bool_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+        elif pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype(float_dtype)
+    return df
+
+def resolve_path(file_path) -> str:
+    """
+    Path with an extension: `file_path` itself if it has one, otherwise the most recently written of the existing
+    files in `FORMATS`, so a stale Parquet copy never shadows a newer CSV
+    """
+    file_path = str(file_path)
+    if os.path.splitext(file_path)[1]:
+        return file_path
+    found = [f"{file_path}.{fmt}" for fmt in FORMATS if os.path.exists(f"{file_path}.{fmt}")]
+    if not found:
+        raise FileNotFoundError(f"No {'/'.join(FORMATS)} file for {file_path}")
+    # max keeps the first of equal times, so FORMATS order breaks ties
+    return max(found, key=os.path.getmtime)
+
+def save_frame(df : pd.DataFrame, file_path, compact=True, float_dtype="float32", categories=()) -> str:
+    """
+    Write a frame as Parquet, Feather or CSV depending on the extension of `file_path` (`DEFAULT_FORMAT` if it has none).
+
+    RETURNS
+    str - the path written
+    """
+    file_path = str(file_path)
+    if not os.path.splitext(file_path)[1]:
+        file_path = f"{file_path}.{DEFAULT_FORMAT}"
+    # CSV is text, so downcasting only rounds the floats written without making the file any smaller
+    if compact and not file_path.endswith(".csv"):
+        df = compact_dtypes(df, float_dtype, categories)
+
+    if file_path.endswith(".parquet"):
+        df.to_parquet(file_path)
+    elif file_path.endswith(".feather"):
+        df.rename_axis(INDEX_COLUMN).reset_index().to_feather(file_path)
+    else:
+        df.to_csv(file_path)
+    return file_path
+
+def load_frame(file_path, columns=None, memory_map=True) -> pd.DataFrame:
+    """
+    Read a frame written by `save_frame` (or any of the CSVs with an index column written by the scripts).
+
+    PARAMETERS
+    file_path (str) - path with extension, or without one to pick the most recently written of the existing formats
+                      (see `resolve_path`)
+    columns (list of str) - only read these columns (the index is always restored)
+    memory_map (bool) - memory-map Parquet/Feather files instead of reading them into a buffer
+    """
+    file_path = resolve_path(file_path)
+
+    if file_path.endswith(".parquet"):
+        return pd.read_parquet(file_path, columns=columns, memory_map=memory_map)
+    if file_path.endswith(".feather"):
+        import pyarrow.feather as feather
+        table = feather.read_table(file_path, columns=None if columns is None else [INDEX_COLUMN] + list(columns), memory_map=memory_map)
+        return table.to_pandas().set_index(INDEX_COLUMN).rename_axis(None)
+
+    usecols = None if columns is None else lambda column: column in columns or column.startswith("Unnamed: 0")
+    return pd.read_csv(file_path, index_col=0, usecols=usecols)
+
+def report_load(file_path, columns, queue):
+    import resource
+    start = perf_counter()
+    df = load_frame(file_path, columns)
+    elapsed = perf_counter() - start
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, df.memory_usage(deep=True).sum() / 2**20))
+
+def measure_load(file_path, columns=None):
+    """
+    Load time and peak RSS (MB) of reading `file_path` in a fresh process, so earlier loads do not affect the figures.
+    The peak includes the interpreter and library imports, which are the same for every format
+    """
+    import multiprocessing as mp
+
+    context = mp.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=report_load, args=(file_path, columns, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+if __name__ == "__main__":
+    # "python storage.py data/meta_features_train.csv" converts a CSV to Parquet and Feather and compares loading them
+    csv_path = sys.argv[1]
+    stem = os.path.splitext(csv_path)[0]
+
+    print("Data ", end="", flush=True)
+    df = pd.read_csv(csv_path, index_col=0)
+    print("LOADED")
+    paths = [csv_path, save_frame(df, f"{stem}.parquet"), save_frame(df, f"{stem}.feather")]
+
+    print(f"{'file':<45} {'size MB':>9} {'load s':>8} {'peak RSS MB':>12} {'frame MB':>9}")
+    for path in paths:
+        elapsed, peak_rss, frame_size = measure_load(path)
+        print(f"{path:<45} {os.path.getsize(path) / 2**20:>9.1f} {elapsed:>8.2f} {peak_rss:>12.0f} {frame_size:>9.1f}")
@@ -0,0 +1,222 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from storage import resolve_path, save_frame
+
+# Per distinct score: number of fraudulent and legitimate transactions and their amounts
+FIELDS = ["fraud", "legitimate", "fraud_amt", "legitimate_amt"]
+
+def group_scores(scores, table) -> tuple:
+    """
+    Sum the rows of `table` (n_rows, len(FIELDS)) per distinct score with one stable sort
+
+    RETURNS
+    np.ndarray, np.ndarray - distinct scores in decreasing order and their summed rows
+    """
+    order = np.argsort(-scores, kind="stable")
+    scores, table = scores[order], table[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(scores)) + 1]) if len(scores) else np.empty(0, dtype=np.int64)
+    return scores[starts], np.add.reduceat(table, starts, axis=0) if len(scores) else table
+
+class ThresholdSweep:
+    """
+    Loss, savings, recall and precision of flagging every transaction whose score is at or above each threshold, for
+    every distinct score seen, built from batches of scores in bounded memory.
+
+    Each batch is reduced to one row per distinct score (one sort) and merged into the running table, and `curve`
+    takes cumulative sums down the table, so the whole curve costs one sort rather than one evaluation per
+    threshold. Memory is bounded by the batch size and `max_thresholds` (the table takes 40 bytes per threshold and
+    the curve about 100): when there are more distinct scores than that, scores are rounded down onto a grid of
+    `max_thresholds` steps between the lowest and highest seen and `exact` becomes False. Tree probabilities
+    (multiples of 1/n_trees) never need this.
+
+    PARAMETERS
+    max_thresholds (int) - most distinct thresholds kept, at least 2 for the lowest and highest score
+    """
+    def __init__(self, max_thresholds=1_000_000):
+        if max_thresholds < 2:
+            raise ValueError(f"max_thresholds must be at least 2, got {max_thresholds}")
+        self.max_thresholds = max_thresholds
+        self.scores = np.empty(0)
+        self.table = np.empty((0, len(FIELDS)))
+        self.exact = True
+
+    def update(self, scores, y_true, amt):
+        """Add a batch of transactions: model scores, true labels (1 for fraud) and amounts"""
+        scores = np.asarray(scores, dtype=np.float64).ravel()
+        y_true = np.asarray(y_true).astype(bool)
+        amt = np.asarray(amt, dtype=np.float64)
+        batch = np.column_stack([y_true, ~y_true, amt * y_true, amt * ~y_true]).astype(np.float64)
+        self.merge(*group_scores(scores, batch))
+        if len(self.scores) > self.max_thresholds:
+            self.coarsen()
+        return self
+
+    def merge(self, scores, table):
+        """Add grouped rows (distinct scores in decreasing order) to the table without sorting it again"""
+        positions = np.searchsorted(-self.scores, -scores)
+        found = positions < len(self.scores)
+        found[found] = self.scores[positions[found]] == scores[found]
+        self.table[positions[found]] += table[found]
+        self.scores = np.insert(self.scores, positions[~found], scores[~found])
+        self.table = np.insert(self.table, positions[~found], table[~found], axis=0)
+
+    def coarsen(self):
+        low, high = self.scores[-1], self.scores[0]
+        step = (high - low) / (self.max_thresholds - 1)
+        self.scores, self.table = group_scores(low + np.floor((self.scores - low) / step) * step, self.table)
+        self.exact = False
+
+    def curve(self, investigation_cost=None) -> pd.DataFrame:
+        """
+        One row per threshold, from flagging nothing (threshold inf) down to flagging everything
+
+        PARAMETERS
+        investigation_cost (float) - cost of reviewing one flagged transaction. When given, `cost` is the missed fraud
+                                     amount plus this cost per flagged transaction
+
+        RETURNS
+        pd.DataFrame - threshold, flagged, tp, fp, fn, tn, recall, precision, fraud_loss (missed fraud amount),
+                       savings (caught fraud amount), investigated_amount (flagged legitimate amount),
+                       financial_loss (fraud_loss + investigated_amount, as in `evaluation.evaluate`) and cost
+        """
+        from evaluation import ratio
+
+        flagged = np.vstack([np.zeros((1, len(FIELDS))), np.cumsum(self.table, axis=0)])
+        total = flagged[-1]
+        tp, fp, caught_amt, investigated_amt = flagged.T
+        curve = pd.DataFrame({
+            "threshold": np.concatenate([[np.inf], self.scores]),
+            "flagged": (tp + fp).astype(np.int64),
+            "tp": tp.astype(np.int64), "fp": fp.astype(np.int64),
+            "fn": (total[0] - tp).astype(np.int64), "tn": (total[1] - fp).astype(np.int64),
+            "recall": ratio(tp, total[0]),
+            "precision": ratio(tp, tp + fp),
+            "fraud_loss": total[2] - caught_amt,
+            "savings": caught_amt,
+            "investigated_amount": investigated_amt,
+        })
+        curve["financial_loss"] = curve["fraud_loss"] + curve["investigated_amount"]
+        if investigation_cost is not None:
+            curve["cost"] = curve["fraud_loss"] + investigation_cost * curve["flagged"]
+        return curve
+
+def threshold_curve(scores, y_true, amt, investigation_cost=None) -> pd.DataFrame:
+    """Exact `ThresholdSweep.curve` of one set of scores held in memory"""
+    return ThresholdSweep(max_thresholds=max(len(scores), 2)).update(scores, y_true, amt).curve(investigation_cost)
+
+def best_threshold(curve, objective="financial_loss") -> pd.Series:
+    """Row of the curve that minimises `objective` (e.g. financial_loss or cost)"""
+    return curve.loc[curve[objective].idxmin()]
+
+def sweep_file(file_path, score_column, label="is_fraud", amt_column="amt", batch_rows=1_000_000, calibrator=None,
+               max_thresholds=1_000_000, skip_rows=0) -> ThresholdSweep:
+    """
+    Sweep the scores stored in a Parquet file (e.g. test set predictions) one row group at a time, in batches of
+    `batch_rows` rows, so tens of millions of rows fit in a fixed amount of memory (pyarrow's `iter_batches` keeps
+    growing its buffers over a whole file, reading row groups one by one does not)
+
+    PARAMETERS
+    calibrator (Calibrator) - applied to each batch of scores before it is added
+    skip_rows (int) - leave out the first rows of the file, e.g. those the calibrator was fitted on
+    """
+    import pyarrow.parquet as pq
+
+    sweep = ThresholdSweep(max_thresholds)
+    parquet_file = pq.ParquetFile(resolve_path(file_path))
+    for row_group in range(parquet_file.num_row_groups):
+        group_rows = parquet_file.metadata.row_group(row_group).num_rows
+        if skip_rows >= group_rows:
+            skip_rows -= group_rows
+            continue
+        table = parquet_file.read_row_group(row_group, columns=[score_column, label, amt_column]).slice(skip_rows)
+        skip_rows = 0
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            batch = batch.to_pandas()
+            scores = batch[score_column].to_numpy(dtype=np.float64)
+            if calibrator is not None:
+                scores = calibrator.predict(scores)
+            sweep.update(scores, batch[label].to_numpy(), batch[amt_column].to_numpy())
+        del table
+    return sweep
+
+#########################---Calibration--################
+
+class Calibrator:
+    """
+    Maps raw model scores to fraud probabilities, fitted on a held-out set the model was not trained on.
+
+    "isotonic" fits a non-decreasing step function (best with plenty of fraud cases, suits the tree probabilities,
+    which are coarse and biased by resampling). "sigmoid" is Platt scaling, a logistic regression on the log-odds of
+    the score (suits the FCN/CNN sigmoid outputs, whose shape is right but whose level is shifted by resampling).
+    Both are monotonic, so a calibrated sweep has the same points (isotonic steps may merge neighbouring ones) and
+    only the probability each threshold stands for changes.
+
+    PARAMETERS
+    method (str) - "isotonic" or "sigmoid"
+    """
+    def __init__(self, method="isotonic"):
+        if method not in ("isotonic", "sigmoid"):
+            raise ValueError(f"Unknown calibration method {method}, expected isotonic or sigmoid")
+        self.method = method
+
+    @staticmethod
+    def log_odds(scores) -> np.ndarray:
+        scores = np.clip(np.asarray(scores, dtype=np.float64), 1e-12, 1 - 1e-12)
+        return np.log(scores / (1 - scores)).reshape(-1, 1)
+
+    def fit(self, scores, y_true):
+        if self.method == "isotonic":
+            from sklearn.isotonic import IsotonicRegression
+            self.model = IsotonicRegression(y_min=0, y_max=1, out_of_bounds="clip").fit(np.asarray(scores, dtype=np.float64), y_true)
+        else:
+            from sklearn.linear_model import LogisticRegression
+            self.model = LogisticRegression(C=1e6).fit(self.log_odds(scores), y_true)
+        return self
+
+    def predict(self, scores) -> np.ndarray:
+        if self.method == "isotonic":
+            return self.model.predict(np.asarray(scores, dtype=np.float64))
+        return self.model.predict_proba(self.log_odds(scores))[:, 1]
+
+def reliability_table(probabilities, y_true, n_bins=10) -> pd.DataFrame:
+    """Mean predicted probability against observed fraud rate per equal-width bin, to check a calibration"""
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    bins = np.minimum((probabilities * n_bins).astype(np.int64), n_bins - 1)
+    table = pd.DataFrame({"bin": bins, "predicted": probabilities, "observed": np.asarray(y_true, dtype=np.float64)})
+    table = table.groupby("bin").agg(transactions=("predicted", "size"), predicted=("predicted", "mean"), observed=("observed", "mean"))
+    return table
+
+def brier_score(probabilities, y_true) -> float:
+    return float(np.mean((np.asarray(probabilities, dtype=np.float64) - np.asarray(y_true)) ** 2))
+
+if __name__ == "__main__":
+    # e.g. "python thresholds.py data/test_scores score --calibrate isotonic --investigation-cost 5"
+    parser = argparse.ArgumentParser(description="Loss, savings, recall and precision at every score threshold")
+    parser.add_argument("data", help="Parquet file with a score column, the label and amt")
+    parser.add_argument("score_column")
+    parser.add_argument("--calibrate", default=None, help="isotonic or sigmoid, fitted on --calibration-data if given, otherwise on the first --calibration-rows rows, which are then left out of the sweep")
+    parser.add_argument("--calibration-data", default=None, help="Parquet file of held-out scores to fit the calibrator on, with the same columns")
+    parser.add_argument("--calibration-rows", type=int, default=100000)
+    parser.add_argument("--investigation-cost", type=float, default=None)
+    parser.add_argument("--batch-rows", type=int, default=1_000_000)
+    parser.add_argument("--out", default="data/threshold_curve")
+    args = parser.parse_args()
+
+    calibrator = None
+    skip_rows = 0
+    if args.calibrate:
+        import pyarrow.parquet as pq
+        calibration_path = args.calibration_data or args.data
+        held_out = next(pq.ParquetFile(resolve_path(calibration_path)).iter_batches(batch_size=args.calibration_rows,
+                                                                                   columns=[args.score_column, "is_fraud"])).to_pandas()
+        calibrator = Calibrator(args.calibrate).fit(held_out[args.score_column], held_out["is_fraud"])
+        # scores the calibrator has seen would make the curve look better calibrated than it is
+        if args.calibration_data is None:
+            skip_rows = len(held_out)
+
+    sweep = sweep_file(args.data, args.score_column, batch_rows=args.batch_rows, calibrator=calibrator, skip_rows=skip_rows)
+    curve = sweep.curve(args.investigation_cost)
+    print(save_frame(curve, args.out, compact=False), "" if sweep.exact else "(scores rounded to fit max_thresholds)")
+    print(best_threshold(curve, "cost" if args.investigation_cost is not None else "financial_loss"))